@@ -22,8 +22,12 @@
 #  OTHER DEALINGS IN THE SOFTWARE.
 #
 """ Auth related methods. """
+import errno
+import fcntl
 import json
 import os
+import threading
+import time
 import warnings
 import click
 # pylint: disable=fixme
@@ -46,14 +50,68 @@ from cray.constants import AUTH_DIR_NAME
 from cray.echo import echo
 from cray.echo import LOG_RAW
 from cray.rest import make_url
+from cray.utils import get_hostname
 from cray.utils import hostname_to_name
 from cray.utils import open_atomic
 
+# Parsed token files, keyed by path. See _read_token()
+_TOKEN_CACHE = {}
+# Guards loading the pending credentials, see get_auth()
+_AUTH_LOCK = threading.Lock()
+
+
+def _read_token(path):
+    """ Read and parse a token file. The parsed token is kept in memory and
+    reused for as long as the file's inode, mtime and size don't change.
+    Token files are replaced rather than rewritten, so a new inode means a
+    new token even within the mtime granularity. """
+    file_stat = os.stat(path)
+    key = (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+    cached = _TOKEN_CACHE.get(path)
+    if cached is None or cached[0] != key:
+        with open(path, encoding='utf-8') as token_file:
+            cached = (key, json.load(token_file))
+        _TOKEN_CACHE[path] = cached
+    # Callers modify the token they get, so hand out a copy
+    return dict(cached[1])
+
+
+def get_auth(ctx=None):
+    """ Get the Auth object for the current command, or None if there are
+    no credentials configured. Credentials are loaded on first use so that
+    commands which never make a request don't pay for it. """
+    ctx = ctx or click.get_current_context()
+    # Requests can be made from several threads (e.g. executable transfers)
+    with _AUTH_LOCK:
+        pending = ctx.obj.get('auth_pending')
+        if pending is not None:
+            hostname = get_hostname(ctx)
+            auth = None
+            if pending.get('token_file'):
+                auth = AuthFile(pending['token_file'], hostname, ctx=ctx)
+            else:
+                username = ctx.obj['config'].get('auth.login.username')
+                if username:
+                    auth = AuthUsername(username, hostname, ctx=ctx)
+            if auth:
+                auth.load()
+            ctx.obj['auth'] = auth
+            del ctx.obj['auth_pending']
+    auth = ctx.obj.get('auth')
+    if auth:
+        auth.refresh_if_expiring()
+    return auth
+
 
 class Auth(object):  # pylint: disable=too-many-instance-attributes
     """ Auth Class used for generating, refreshing, and saving OAuth Tokens """
 
     TOKEN_URI = '/keycloak/realms/{}/protocol/openid-connect/token'
+    # Seconds before expiry to refresh the token, see refresh_if_expiring()
+    REFRESH_MARGIN = 30
+    # Seconds to wait for another process to finish refreshing
+    REFRESH_LOCK_TIMEOUT = 10
+    REFRESH_LOCK_POLL = 0.05
 
     def __init__(self, hostname, path, username=None, name=None, **kwargs):
         ctx = kwargs.get('ctx', click.get_current_context())
@@ -74,6 +132,11 @@ class Auth(object):  # pylint: disable=too-many-instance-attributes
         self.client_id = kwargs.get('client_id', 'shasta')
         self._token_path = os.path.join(self.path, self.name)
         self.session = None
+        self.refresh_margin = kwargs.get('refresh_margin')
+        if self.refresh_margin is None:
+            self.refresh_margin = float(ctx.obj['config'].get(
+                'auth.refresh_margin', self.REFRESH_MARGIN
+            ))
 
     def get_session_opts(self):
         """ Set the session options to pass when getting tokens """
@@ -108,6 +171,7 @@ class Auth(object):  # pylint: disable=too-many-instance-attributes
             token['client_id'] = self.client_id
         with open_atomic(self._token_path) as token_file:
             json.dump(token, token_file)
+        _TOKEN_CACHE.pop(self._token_path, None)
         echo(
             f'Saved token: {self._token_path}',
             ctx=self.ctx,
@@ -120,8 +184,7 @@ class Auth(object):  # pylint: disable=too-many-instance-attributes
             self.set_name(name)
         token = {}
         if os.path.isfile(self._token_path):
-            with open(self._token_path, encoding='utf-8') as token_file:
-                token = json.load(token_file)
+            token = _read_token(self._token_path)
             echo(
                 f'Loaded token: {self._token_path}',
                 ctx=self.ctx,
@@ -132,6 +195,63 @@ class Auth(object):  # pylint: disable=too-many-instance-attributes
         self.session = self.get_session(token=token)
         return token
 
+    def _needs_refresh(self):
+        token = self.session.token if self.session else None
+        if not isinstance(token, dict) or 'refresh_token' not in token:
+            return False
+        expires_at = token.get('expires_at')
+        if expires_at is None:
+            return False
+        return float(expires_at) - time.time() <= self.refresh_margin
+
+    def _lock_token(self, lock_fp):
+        """ Take the refresh lock, return False if it couldn't be taken
+        within REFRESH_LOCK_TIMEOUT seconds """
+        deadline = time.monotonic() + self.REFRESH_LOCK_TIMEOUT
+        while True:
+            try:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except OSError as err:
+                if err.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.REFRESH_LOCK_POLL)
+
+    def refresh_if_expiring(self):
+        """ Refresh the token if it expires within refresh_margin seconds.
+        A lock file next to the token makes sure only one process refreshes
+        while the others wait and then pick up the newly saved token. """
+        # pylint: disable=broad-except
+        if not self._needs_refresh():
+            return
+        try:
+            with open(
+                    f'{self._token_path}.lock', 'a', encoding='utf-8'
+            ) as lock_fp:
+                locked = self._lock_token(lock_fp)
+                # Another process may have refreshed while we waited
+                self.load()
+                if locked and self._needs_refresh():
+                    self._refresh()
+        except Exception as e:
+            # Fall back on refreshing when a request fails
+            echo(f'AUTH REFRESH ERROR: {e}', ctx=self.ctx, level=LOG_RAW)
+
+    def _refresh(self):
+        with warnings.catch_warnings():
+            # TODO Remove when have valid certs
+            warnings.filterwarnings(
+                "ignore",
+                category=InsecureRequestWarning
+            )
+            token = self.session.refresh_token(
+                self.url, verify=False,
+                **self.get_session_opts()['auto_refresh_kwargs']
+            )
+        self.save(token)
+
     def get_token(self, **kwargs):
         """ Fetch a new token """
         token = kwargs.get('token')
@@ -191,8 +311,7 @@ class AuthFile(Auth):
         path = os.path.dirname(token_path)
         name = os.path.basename(token_path)
         try:
-            with open(token_path, encoding='utf-8') as token_file:
-                token = json.load(token_file)
+            token = _read_token(token_path)
         except Exception as e:
             echo(
                 f'AUTH ERROR: {e}',
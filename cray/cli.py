@@ -41,7 +41,7 @@ from cray.core import group
 from cray.core import option
 from cray.echo import echo
 from cray.echo import LOG_FORCE
-from cray.formatting import format_result
+from cray.formatting import echo_result
 from cray.utils import get_hostname
 
 CONTEXT_SETTINGS = {
@@ -200,9 +200,9 @@ def login(ctx, username, password, rsa_token, *args, **kwargs):
 @click.pass_context
 def cli_cb(ctx, result, **kwargs):
     """ Global callback function. Will properly format the results """
-    # Use click echo instead of our logging because we always want to echo
+    # Write with click instead of our logging because we always want to echo
     # our results
-    click.echo(format_result(result, ctx.obj['globals'].get('format')))
+    echo_result(result, ctx.obj['globals'].get('format'))
 
 
 # Handle the usage of ``cli`` for Pyinstaller.
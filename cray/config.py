@@ -25,12 +25,17 @@
 
 # pylint: disable=invalid-name
 
+import copy
 import os
+import pickle
+import stat
 
 import click
 import toml
 
 from cray.constants import ACTIVE_CONFIG
+from cray.constants import CONFIG_CACHE_ENVVAR
+from cray.constants import DEFAULT_CONFIG
 from cray.constants import NAME
 from cray.nesteddict import NestedDict
 from cray.utils import open_atomic
@@ -38,14 +43,74 @@ from cray.utils import open_atomic
 _CONFIG_DIR_NAME = 'configurations'
 _LOG_DIR_NAME = 'logs'
 _AUTH_DIR_NAME = 'tokens'
-
-
-def _read_file(path, frmt=toml):
-    data = None
-    if os.path.isfile(path):
-        with open(path, 'r', encoding='utf-8') as f:
-            data = frmt.load(f)
-    return data
+_CACHE_DIR_NAME = 'cache'
+
+# Parsed files keyed by path, see _read_file()
+_FILE_CACHE = {}
+
+
+def _file_key(path):
+    """ Get the (mtime, size) a parsed file is cached on, None if the path
+    is not a regular file """
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(file_stat.st_mode):
+        return None
+    return (file_stat.st_mtime_ns, file_stat.st_size)
+
+
+def _side_cache_path(path, cache_dir):
+    return os.path.join(cache_dir, f'{os.path.basename(path)}.pickle')
+
+
+def _read_side_cache(path, key, cache_dir):
+    # pylint: disable=broad-except
+    try:
+        with open(_side_cache_path(path, cache_dir), 'rb') as f:
+            cached_key, data = pickle.load(f)
+    except Exception:
+        return None
+    return data if cached_key == key else None
+
+
+def _write_side_cache(path, key, data, cache_dir):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open_atomic(_side_cache_path(path, cache_dir), mode='wb') as f:
+            pickle.dump((key, data), f)
+    except OSError:  # pragma: NO COVER
+        pass
+
+
+def _read_file(path, frmt=toml, cache_dir=None):
+    """ Parse a file with frmt, or read it as plain text if frmt is None.
+    Parsed data is memoized per process on the file's path, mtime and size.
+    If cache_dir is given it is also pickled there for other processes. """
+    key = _file_key(path)
+    if key is None:
+        return None
+    cached = _FILE_CACHE.get(path)
+    if cached is None or cached[0] != key:
+        data = None
+        if cache_dir:
+            data = _read_side_cache(path, key, cache_dir)
+        if data is None:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = frmt.load(f) if frmt else f.read()
+            if cache_dir:
+                _write_side_cache(path, key, data, cache_dir)
+        cached = (key, data)
+        _FILE_CACHE[path] = cached
+    # Configs are modified in place, don't let that leak into the cache
+    return copy.deepcopy(cached[1])
+
+
+def get_active_config(path):
+    """ Get the name of the active configuration """
+    active_config = _read_file(os.path.join(path, ACTIVE_CONFIG), frmt=None)
+    return active_config or DEFAULT_CONFIG
 
 
 def _get_cmd_call(ctx, names=None):
@@ -105,8 +170,16 @@ class Config(NestedDict):
             self._config_name
         )
 
+    def _get_cache_dir(self):
+        if os.environ.get(CONFIG_CACHE_ENVVAR, '0') not in ('', '0'):
+            return os.path.join(self._config_dir, _CACHE_DIR_NAME)
+        return None
+
     def _load(self):
-        data = _read_file(self._get_config_file_name())
+        data = _read_file(
+            self._get_config_file_name(),
+            cache_dir=self._get_cache_dir()
+        )
         if not data and self._raise_err:
             raise click.UsageError("Unable to find configuration file.")
         data = data or {}
@@ -36,6 +36,7 @@ TOKEN_ENVVAR = _make_envvar('CREDENTIALS')
 QUIET_ENVVAR = _make_envvar('QUIET')
 FORMAT_ENVVAR = _make_envvar('FORMAT')
 CONFIG_DIR_ENVVAR = _make_envvar('CONFIG_DIR')
+CONFIG_CACHE_ENVVAR = _make_envvar('CONFIG_CACHE')
 
 # Generator constants
 TAG_SPLIT = "$"
@@ -54,6 +55,7 @@ EMPTY_CONFIG = ''
 CONFIG_DIR_NAME = 'configurations'
 LOG_DIR_NAME = 'logs'
 AUTH_DIR_NAME = 'tokens'
+CACHE_DIR_NAME = 'cache'
 
 # Rest constants
 TENANT_HEADER_NAME_KEY = "Cray-Tenant-Name"
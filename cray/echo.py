@@ -36,8 +36,9 @@ LOG_RAW = 3  # Ultra verbose
 
 
 # Custom utils
-def echo(*args, **kwargs):
-    """ Logging to console and files """
+def is_echoed(level, **kwargs):
+    """ Check whether echo() at this level would print anything, so callers
+    can skip building messages that won't be shown """
     default_verbose = 0
     default_is_quiet = False
     try:
@@ -49,12 +50,12 @@ def echo(*args, **kwargs):
         verbosity = default_verbose
         is_quiet = default_is_quiet
 
-    if 'ctx' in kwargs:
-        del kwargs['ctx']
-    level = kwargs.get('level', 2)
-    if 'level' in kwargs:
-        del kwargs['level']
-    to_log = (level <= verbosity)
+    return not is_quiet and level <= verbosity
+
 
-    if not is_quiet and to_log:
+def echo(*args, **kwargs):
+    """ Logging to console and files """
+    level = kwargs.pop('level', 2)
+    if is_echoed(level, **kwargs):
+        kwargs.pop('ctx', None)
         click.echo(*args, **kwargs)
@@ -0,0 +1,146 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+""" ensemble.py - Running many PALS applications at once. """
+import asyncio
+import concurrent.futures
+import io
+import os
+import click
+
+from cray.echo import echo
+from cray.echo import LOG_WARN
+from cray.pals import get_executables
+from cray.stdio import setup_signals
+from cray.stdio import StdioLoop
+
+ENSEMBLE_LIMIT = 16  # Ensemble applications running at once
+
+
+class Ensemble(object):
+    """ Run many applications at once, with at most limit of them launched
+    at a time. Each application's stdio is handled by its own StdioLoop,
+    all on one event loop. Launch and delete requests run in a thread pool,
+    so every application shares the command's session and its connection
+    pool. """
+
+    def __init__(self, limit=ENSEMBLE_LIMIT, transfer=False, label=False):
+        self.limit = limit
+        self.transfer = transfer
+        self.label = label
+        self.apps = []
+        self.running = set()
+        self.ctx = None
+        self.executor = None
+
+    def add(self, name, app, launchreq, procinfo_file=None):
+        """ Add an application to run, writing its procinfo to
+        procinfo_file if given """
+        # A debugger can only follow one application
+        app.mpir = False
+        self.apps.append((name, app, launchreq, procinfo_file))
+
+    def run(self):
+        """ Run every application and return their exit codes by name """
+        self.ctx = click.get_current_context()
+        loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.limit)
+        sig_read = setup_signals()
+        try:
+            loop.add_reader(sig_read, self.forward_signal, sig_read)
+            exit_codes = loop.run_until_complete(self.run_all())
+        finally:
+            loop.remove_reader(sig_read)
+            self.executor.shutdown()
+            loop.close()
+        return dict(zip([name for name, _, _, _ in self.apps], exit_codes))
+
+    async def run_all(self):
+        """ Run the applications, limit at a time """
+        semaphore = asyncio.Semaphore(self.limit)
+        return await asyncio.gather(*[
+            self.run_app(semaphore, name, app, launchreq, procinfo_file)
+            for name, app, launchreq, procinfo_file in self.apps
+        ])
+
+    def call(self, func, *args):
+        """ Make a blocking call in the thread pool """
+        def call_with_ctx():
+            with self.ctx:
+                return func(*args)
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor, call_with_ctx
+        )
+
+    async def run_app(
+            self, semaphore, name, app, launchreq, procinfo_file=None
+    ):
+        """ Launch and run one application, returning its exit code """
+        async with semaphore:
+            atp_frontend_handle = None
+            try:
+                executables = get_executables(launchreq, self.transfer)
+                atp_frontend_handle = await self.call(
+                    app.launch_atp, launchreq, executables
+                )
+                await self.call(
+                    app.submit, launchreq, executables, self.transfer,
+                    atp_frontend_handle
+                )
+                await self.run_stdio(app, procinfo_file)
+            except Exception as err:  # pylint: disable=broad-except
+                # Don't let one application's failure stop the others
+                message = err.format_message() \
+                    if isinstance(err, click.ClickException) else str(err)
+                echo(f"{name} failed: {message}", level=LOG_WARN)
+                app.exit_codes.add(255)
+            finally:
+                app.finish()
+                await self.call(app.teardown, atp_frontend_handle)
+
+        exit_code = max(app.exit_codes) if app.exit_codes else 0
+        echo(
+            f"{name} ({app.apid or 'not launched'}) exited with code "
+            f"{exit_code:d}",
+            level=LOG_WARN
+        )
+        return exit_code
+
+    async def run_stdio(self, app, procinfo_file=None):
+        """ Handle an application's stdio until it completes. Only one
+        application could read stdin, so none of them do. """
+        stdio = StdioLoop(app, self.label, procinfo_file, stdin=io.BytesIO())
+        self.running.add(stdio)
+        try:
+            with app.timer.phase("run"):
+                stdio.start(asyncio.get_running_loop())
+                await stdio.done
+        finally:
+            self.running.discard(stdio)
+            stdio.stop()
+
+    def forward_signal(self, sig_read):
+        """ Forward a received signal to every running application """
+        os.read(sig_read, 4096)
+        for stdio in list(self.running):
+            stdio.guard(stdio.send_signal)
@@ -0,0 +1,98 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+""" env.py - Helpers for sending the launch environment to PALS. """
+import fnmatch
+import hashlib
+import click
+
+from cray.echo import echo
+from cray.echo import LOG_DEBUG
+
+
+def filter_environ(environ, include=None, exclude=None):
+    """ Filter environment variables by comma-separated lists of name
+    globs, e.g. 'SLURM_*,PBS_*'. With include, only matching variables are
+    kept, then any that match exclude are dropped. """
+    include = [pattern for pattern in (include or "").split(",") if pattern]
+    exclude = [pattern for pattern in (exclude or "").split(",") if pattern]
+
+    def matches(key, patterns):
+        return any(fnmatch.fnmatchcase(key, pattern) for pattern in patterns)
+
+    return {
+        key: val for key, val in environ.items()
+        if (not include or matches(key, include))
+        and not matches(key, exclude)
+    }
+
+
+def read_env_baseline(path):
+    """ Read a baseline environment file of KEY=VAL entries, separated by
+    newlines or, as written by 'env -0', NULs. Returns the baseline and a
+    digest of its contents that the service knows the baseline by. """
+    try:
+        with open(path, "rb") as baseline_file:
+            data = baseline_file.read()
+    except OSError as err:
+        raise click.ClickException(
+            f"Couldn't read baseline environment {path}: {err}"
+        )
+    delim = b"\0" if b"\0" in data else b"\n"
+    baseline = {}
+    for entry in data.split(delim):
+        key, sep, val = entry.decode("utf-8", "surrogateescape").partition("=")
+        if sep:
+            baseline[key] = val
+
+    digest = hashlib.sha256()
+    for key in sorted(baseline):
+        digest.update(f"{key}={baseline[key]}\0".encode("utf-8", "surrogateescape"))
+    return baseline, digest.hexdigest()
+
+
+def set_launch_env(launchreq, environment, baseline=None):
+    """ Add the environment to a launch request. Given a baseline file, only
+    the variables that differ from the baseline are sent, along with the
+    baseline digest and the baseline variables the application doesn't
+    have. The application environment is the same either way. """
+    if not baseline:
+        launchreq["environment"] = environment
+        return launchreq
+
+    base, digest = read_env_baseline(baseline)
+    environ = dict(envvar.partition("=")[::2] for envvar in environment)
+    launchreq["environment"] = [
+        f"{key}={val}" for key, val in environ.items()
+        if base.get(key) != val
+    ]
+    launchreq["environment_baseline"] = digest
+    unset = [key for key in base if key not in environ]
+    if unset:
+        launchreq["environment_unset"] = unset
+    echo(
+        f"Sending {len(launchreq['environment'])} of {len(environ)} "
+        f"environment variables relative to baseline {digest}",
+        level=LOG_DEBUG
+    )
+    return launchreq
@@ -56,6 +56,7 @@ class BadResponseError(UsageError):
     _DEFAULT = "Error received from server: {} {}"
 
     def __init__(self, response, ctx=None):
+        self.response = response
         message = self._DEFAULT.format(response.status_code, response.reason)
         try:
             data = response.json()
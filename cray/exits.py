@@ -0,0 +1,169 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+""" exits.py - Logging and reporting PALS rank exits. """
+import json
+import os
+import time
+
+from cray import hostlist
+from cray.echo import echo
+from cray.echo import is_echoed
+from cray.echo import LOG_DEBUG
+from cray.echo import LOG_INFO
+from cray.echo import LOG_RAW
+from cray.echo import LOG_WARN
+
+EXIT_REPORT_INTERVAL = 10  # Seconds between rank exit summaries
+
+
+def describe_status(status):
+    """ Describe an exit status as (action, code, extra, log level) """
+    extra = ""
+    level = LOG_INFO
+    if os.WIFEXITED(status):
+        action = "exited with code"
+        code = os.WEXITSTATUS(status)
+        if code == 0:
+            level = LOG_RAW
+    elif os.WIFSIGNALED(status):
+        action = "died from signal"
+        code = os.WTERMSIG(status)
+        if os.WCOREDUMP(status):
+            extra = " and dumped core"
+    else:
+        action = "invalid status"
+        code = status
+    return action, code, extra, level
+
+
+def log_rank_exit(rankid, host, status):
+    """ Log a rank exit """
+    if rankid == -1:
+        rank = "shepherd"
+    else:
+        rank = f"rank {rankid:d}"
+
+    action, code, extra, level = describe_status(status)
+    echo(f"{host}: {rank} {action} {code:d}{extra}", level=level)
+
+
+def format_ranks(ranks):
+    """ Format rank numbers as a compact range list, e.g. 0-3,7 """
+    ranges = []
+    for rank in sorted(set(ranks)):
+        if ranges and ranges[-1][1] == rank - 1:
+            ranges[-1][1] = rank
+        else:
+            ranges.append([rank, rank])
+    return ",".join(
+        str(first) if first == last else f"{first:d}-{last:d}"
+        for first, last in ranges
+    )
+
+
+class ExitSummary(object):
+    """ Collect rank exits and log them as one line per exit status, with
+    hostlist-compressed hosts, instead of one line per rank. The first
+    failure is logged as soon as it arrives, along with the exits before
+    it. Each rank is still logged at the most verbose level, and all of them
+    are written to report_file as JSON if it is given. Application output
+    is flushed first so it comes before the exits. """
+
+    def __init__(self, output, report_file=None):
+        self.output = output
+        self.report_file = report_file
+        self.detail = is_echoed(LOG_RAW)
+        self.groups = {}
+        self.exits = []
+        self.last_report = time.monotonic()
+        self.failed = False
+
+    def add(self, rankid, host, status):
+        """ Record a rank exit, logging a summary at the first failure and
+        then every EXIT_REPORT_INTERVAL seconds while ranks keep exiting """
+        if self.detail:
+            if status:
+                self.output.flush()
+            log_rank_exit(rankid, host, status)
+        if self.report_file:
+            self.exits.append((rankid, host, status))
+
+        group = self.groups.get((status, rankid == -1))
+        if group is None:
+            group = self.groups[(status, rankid == -1)] = ([], set())
+        group[0].append(rankid)
+        group[1].add(host)
+
+        # Don't keep a failure back waiting for more exits that may not come
+        if status and not self.failed and not self.detail:
+            self.failed = True
+            self.report()
+        elif time.monotonic() - self.last_report >= EXIT_REPORT_INTERVAL:
+            self.report()
+
+    def report(self):
+        """ Log a summary of the exits since the last one """
+        if self.groups:
+            self.output.flush()
+        for (status, shepherd), (ranks, hosts) in self.groups.items():
+            action, code, extra, level = describe_status(status)
+            if shepherd:
+                who = "shepherd" if len(hosts) == 1 else "shepherds"
+            elif len(ranks) == 1:
+                who = f"rank {ranks[0]:d}"
+            else:
+                who = f"ranks {format_ranks(ranks)}"
+            # A summary of successful exits is short enough to show sooner
+            echo(
+                f"{who} on {hostlist.compress(hosts)} {action} "
+                f"{code:d}{extra}",
+                level=min(level, LOG_DEBUG)
+            )
+        self.groups = {}
+        self.last_report = time.monotonic()
+
+    def close(self):
+        """ Log any remaining exits and write the JSON report """
+        self.report()
+        if not self.report_file:
+            return
+        exits = []
+        for (rankid, host, status) in self.exits:
+            action, code, _, _ = describe_status(status)
+            exits.append({
+                "rankid": rankid,
+                "host": host,
+                "status": status,
+                "action": action,
+                "code": code,
+                "core": os.WIFSIGNALED(status) and os.WCOREDUMP(status),
+            })
+        try:
+            with open(self.report_file, "w", encoding="utf-8") as a_file:
+                json.dump({"exits": exits}, a_file)
+        except OSError as err:
+            echo(
+                f"Couldn't write {self.report_file}: {str(err)}",
+                level=LOG_WARN
+            )
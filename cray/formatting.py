@@ -23,19 +23,21 @@
 #
 """ Formatting Module. """
 # pylint: disable=too-few-public-methods
+import functools
+import io
 import json
 import click
 import requests
 import toml
-from ruamel import yaml
+from ruamel.yaml import YAML as _RuamelYAML
+from ruamel.yaml.representer import SafeRepresenter
 
 from cray.echo import echo
 from cray.echo import LOG_DEBUG
 
 
-def format_result(result, format_type='json', **kwargs):
-    """ Format a given result into the desired format """
-    # pylint: disable=broad-except
+def _prepare_result(result):
+    """ Convert a result into native python data ready for formatting """
     if isinstance(result, requests.Response):
         try:
             result = result.json()
@@ -45,6 +47,13 @@ def format_result(result, format_type='json', **kwargs):
         # Some formatters try to reinitialize the object which fails.
         # Cast into native dict to prevent this.
         result = dict(result)
+    return result
+
+
+def format_result(result, format_type='json', **kwargs):
+    """ Format a given result into the desired format """
+    # pylint: disable=broad-except
+    result = _prepare_result(result)
     if isinstance(result, (list, dict)):
         try:
             return _formatter(format_type)(result, **kwargs).parse()
@@ -56,6 +65,23 @@ def format_result(result, format_type='json', **kwargs):
         return Formatter(result, **kwargs).parse()
 
 
+def echo_result(result, format_type='json', file=None, **kwargs):
+    """ Format a given result and write it to file (stdout by default).
+    Formatters that support it write incrementally instead of building
+    the whole output in memory first. """
+    # pylint: disable=broad-except
+    result = _prepare_result(result)
+    if isinstance(result, (list, dict)):
+        try:
+            _formatter(format_type)(result, **kwargs).echo(file)
+        except Exception as e:
+            echo(result, level=LOG_DEBUG)
+            echo(e, level=LOG_DEBUG)
+            raise click.ClickException("Error parsing results.")
+    else:
+        Formatter(result, **kwargs).echo(file)
+
+
 def _formatter(format_type):
     if format_type.lower() == 'toml':
         return TOML
@@ -64,16 +90,32 @@ def _formatter(format_type):
     return JSON
 
 
-class _NullStream:
-    """ NullStream used for YAML dump """
+class _YAMLRepresenter(SafeRepresenter):
+    """ Safe representer that keeps the output of the round-trip dumper:
+    mappings stay in insertion order and nested nulls are left empty. """
+
+    def __init__(self, *args, **kwargs):
+        SafeRepresenter.__init__(self, *args, **kwargs)
+        self.sort_base_mapping_type_on_output = False
+
+    def represent_none(self, data):
+        if not self.represented_objects:
+            return self.represent_scalar('tag:yaml.org,2002:null', 'null')
+        return self.represent_scalar('tag:yaml.org,2002:null', '')
 
-    def write(self, *args, **kwargs):
-        """ Null writer """
-        pass
 
-    def flush(self, *args, **kwargs):
-        """ Null flusher """
-        pass
+_YAMLRepresenter.add_representer(type(None), _YAMLRepresenter.represent_none)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_yaml():
+    """ Get the shared YAML emitter, creating it on first use. The safe
+    dumper uses the C emitter from ruamel.yaml.clib when it is installed. """
+    yaml = _RuamelYAML(typ='safe')
+    yaml.Representer = _YAMLRepresenter
+    yaml.default_flow_style = False
+    yaml.allow_unicode = True
+    return yaml
 
 
 class Formatter(object):
@@ -87,6 +129,10 @@ class Formatter(object):
         """ Parse data into formatter format """
         return self.data
 
+    def echo(self, file=None):
+        """ Write the formatted data to file """
+        click.echo(self.parse(), file=file)
+
 
 class JSON(Formatter):
     """ JSON Formatter """
@@ -98,16 +144,19 @@ class JSON(Formatter):
 class YAML(Formatter):
     """ YAML Formatter """
 
-    def __init__(self, data, **kwargs):
-        Formatter.__init__(self, data, **kwargs)
-        self.yaml = None
-
-    def _to_string(self, data):
-        self.yaml = data
+    def dump(self, stream):
+        """ Write the YAML document directly to stream """
+        _get_yaml().dump(self.data, stream)
 
     def parse(self):
-        yaml.YAML().dump(self.data, _NullStream(), transform=self._to_string)
-        return self.yaml
+        stream = io.StringIO()
+        self.dump(stream)
+        return stream.getvalue()
+
+    def echo(self, file=None):
+        file = file or click.get_text_stream('stdout')
+        self.dump(file)
+        click.echo(file=file)
 
 
 class TOML(Formatter):
@@ -21,11 +21,147 @@
 #  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 #  OTHER DEALINGS IN THE SOFTWARE.
 #
-""" A slurm-style hostlist processor. """
+""" A slurm-style hostlist processor.
+
+A HostList keeps one tree of runs per hostname "shape", the text around the
+numbers in the hostname, so x[1000-3999]c[0-7]n[0-1] is stored as three
+ranges rather than as one entry per host. Each tree level is a tuple of
+(width, start, end, child) runs for one number, sorted and with adjacent
+runs merged when their children are equal. The width is the zero-padded
+width of the number, 0 for no padding, and the children of the last number
+are _LEAF. Expressions may contain several brackets, and zero-padded ranges
+such as nid[000001-004096] keep their padding.
+"""
 # pylint: disable=too-many-locals, too-many-branches
 
+import bisect
+import itertools
 import re
 
+_NUM_RE = re.compile(r'(\d+)')
+_LEAF = True
+_UNION, _INTERSECTION, _DIFFERENCE = range(3)
+# Hostnames are parsed into trees this many at a time, to bound the memory
+# used when building a host list from a long list of hostnames
+_CHUNK_SIZE = 262144
+
+
+def _width(digits):
+    """ Get the zero-padded width of a number string, 0 if not padded """
+    if len(digits) > 1 and digits[0] == '0':
+        return len(digits)
+    return 0
+
+
+def _format_number(num, width):
+    return f'{num:0{width}d}' if width else str(num)
+
+
+def merge_runs(runs):
+    """ Sort and merge a list of (start, end) runs """
+    merged = []
+    for start, end in sorted(runs):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _split_elements(nodelist):
+    """ Split a host list expression on commas and whitespace, leaving
+    commas within brackets in place """
+    depth = 0
+    start = 0
+    for idx, char in enumerate(nodelist):
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        elif depth == 0 and (char == ',' or char.isspace()):
+            if idx > start:
+                yield nodelist[start:idx]
+            start = idx + 1
+    if start < len(nodelist):
+        yield nodelist[start:]
+
+
+def _parse_bracket(content):
+    """ Parse bracket content like 1-3,07 into sorted (start, end, width)
+    runs. As with the original expand, a reversed range such as 3-1 is
+    empty and duplicates are kept. """
+    runs = []
+    for item in content.split(','):
+        first, sep, last = item.strip().partition('-')
+        if not first.isdigit() or (sep and not last.isdigit()):
+            raise ValueError(f"Invalid range '{item}' in host list")
+        start = int(first)
+        end = int(last) if sep else start
+        if end >= start:
+            runs.append((start, end, _width(first)))
+    runs.sort()
+    return runs
+
+
+def _parse_element(element):
+    """ Parse one host list element into a list of alternating literal
+    strings and bracket runs, always starting and ending with a literal """
+    parts = []
+    pos = 0
+    while True:
+        open_idx = element.find('[', pos)
+        if open_idx == -1:
+            break
+        close_idx = element.find(']', open_idx)
+        if close_idx == -1:
+            raise ValueError(f"Unbalanced brackets in host list '{element}'")
+        parts.append(element[pos:open_idx])
+        parts.append(_parse_bracket(element[open_idx + 1:close_idx]))
+        pos = close_idx + 1
+    if ']' in element[pos:]:
+        raise ValueError(f"Unbalanced brackets in host list '{element}'")
+    parts.append(element[pos:])
+    return parts
+
+
+def _iter_runs(runs):
+    """ Iterate over the formatted numbers in a list of bracket runs, in
+    numeric order and keeping duplicates """
+    if any(runs[idx][0] <= runs[idx - 1][1] for idx in range(1, len(runs))):
+        # Overlapping runs are rare and small, so sort the numbers
+        nums = sorted(
+            (num, width) for start, end, width in runs
+            for num in range(start, end + 1)
+        )
+        yield from itertools.starmap(_format_number, nums)
+        return
+    for start, end, width in runs:
+        if width:
+            for num in range(start, end + 1):
+                yield f'{num:0{width}d}'
+        else:
+            yield from map(str, range(start, end + 1))
+
+
+def _iter_element(parts):
+    """ Iterate over the hostnames in a parsed element """
+    if len(parts) == 1:
+        yield parts[0]
+        return
+    suffix = parts[-1]
+    nums = list(_iter_runs(parts[-2]))
+    if suffix:
+        nums = [num + suffix for num in nums]
+    dims = [
+        [parts[idx] + num for num in _iter_runs(parts[idx + 1])]
+        for idx in range(0, len(parts) - 3, 2)
+    ]
+    for combo in itertools.product(*dims):
+        prefix = ''.join(combo) + parts[-3]
+        for num in nums:
+            yield prefix + num
+
 
 def split_nodelist(nodelist):
     """
@@ -34,82 +170,434 @@ def split_nodelist(nodelist):
     :param: nodelist: The hostlist string.
     :return: An array of components with expansions in place.
     """
-    line = nodelist.replace(',', ' ')
-    add_comma = False
-    index = 0
-    for char in line:
-        if char in '[':
-            add_comma = True
-        if char in ']':
-            add_comma = False
-        if char in ' ' and add_comma:
-            line = line[:index] + ',' + line[index + 1:]
-        index = index + 1
-    return line.split(' ')
+    return list(_split_elements(nodelist))
+
+
+def iter_expand(nodelist):
+    """
+    iter_expand lazily generates every host in a compressed hostlist string,
+    in the order given. Brackets may hold comma-separated numbers and ranges,
+    and there may be more than one bracket per host, e.g. x[0-1]c[0-7].
+    Numbers are sorted within each bracket, duplicates are kept and a
+    reversed range such as [3-1] expands to nothing.
+    :param: nodelist: The hostlist string.
+    :return: A generator of hostnames.
+    """
+    for element in _split_elements(nodelist):
+        yield from _iter_element(_parse_element(element))
 
 
 def expand(nodelist):
     """
     expand takes in a compressed hostlist string and returns all hosts listed.
+    Elements that can't be parsed are passed through unchanged.
     :param: nodelist: The hostlist string.
     :return: The expanded hostlist string.
     """
     if nodelist.find('[') == -1:
         return nodelist
 
-    node_list = split_nodelist(nodelist)
-
     result_hostlist = []
-    for node in node_list:
-        nodelist_match = r"(\w*-?)\[((,?[0-9]+-?,?-?){0,})\](.*)?"
-        if re.search(nodelist_match, node):
-            match = re.search(nodelist_match, node)
-
-            extra_expand = expand(match.group(4))
-            # holds the ranges of nodes as a string
-            # now we can manipulate the string and cast it to a list of numbers
-            oldstr = str(match.group(2))
-            left_br = oldstr.replace("[", "")
-            right_br = left_br.replace("]", "")
-            num_list = right_br.split(',')
-
-            final_list = []
-            for elem in num_list:
-                # if it is a range of numbers, break it by the hyphen and
-                # create a list
-                if '-' in elem:
-                    tmp_list = elem.replace("-", ",").split(",")
-
-                    rng_list = range(int(tmp_list[0]), int(tmp_list[1]) + 1)
-                    final_list.extend(rng_list)
-                else:
-                    final_list.append(int(elem))
-
-            # put final list in ascending order and append cluster name to
-            # each node number
-            final_list.sort()
-
-            # convert to string array
-            hostlist_tmp = []
-            for elem in final_list:
-                hostlist_tmp.append(str(elem))
-
-            # append hostname to the node numbers
-            hostlist_no_suffix = []
-            for elem in hostlist_tmp:
-                hostlist_no_suffix.append(match.group(1) + elem)
-
-            # append suffix to hostlist if there is one
-            final_hostlist = []
-            for elem in hostlist_no_suffix:
-                if extra_expand:
-                    for extra_elem in "".join(extra_expand.split()).split(','):
-                        final_hostlist.append(elem + extra_elem)
-                else:
-                    final_hostlist.append(elem)
-
-            result_hostlist.append(f'{",".join(map(str, final_hostlist))}')
+    for element in _split_elements(nodelist):
+        try:
+            parts = _parse_element(element)
+        except ValueError:
+            result_hostlist.append(element)
+            continue
+        result_hostlist.extend(_iter_element(parts))
+    return ','.join(result_hostlist)
+
+
+def compress(hosts):
+    """
+    compress is the inverse of expand, it takes hostnames and returns a
+    compressed hostlist string, e.g. x[0-1]c[0-7]n[000001-000004,000010].
+    Duplicates are dropped, numbers are sorted and every number that varies
+    gets its own bracket.
+    :param: hosts: A HostList, hostlist string, or iterable of hostnames.
+    :return: The compressed hostlist string.
+    """
+    if not isinstance(hosts, HostList):
+        hosts = HostList(hosts)
+    return hosts.compress()
+
+
+class HostList(object):
+    """ A set of hosts stored as a tree of runs per hostname shape.
+    Union, intersection and difference work on the runs directly, without
+    building the hostname strings. """
+
+    def __init__(self, hosts=None):
+        """ Create a host list from a hostlist string or hostnames """
+        # Literal text around the numbers -> tree of runs
+        self._trees = {}
+        if isinstance(hosts, str):
+            self.update_expression(hosts)
+        elif hosts is not None:
+            self.update(hosts)
+
+    def _add_tree(self, literals, tree):
+        tree = _combine_nodes(self._trees.get(literals), tree, _UNION)
+        if tree is not None:
+            self._trees[literals] = tree
+
+    def update_expression(self, nodelist):
+        """ Add the hosts in a hostlist string """
+        for element in _split_elements(nodelist):
+            parts = _parse_element(element)
+            shape = _element_tree(parts)
+            if shape is None:
+                # Adjacent numbers run together, e.g. n[1-10]0, so the
+                # brackets don't map onto the numbers in the hostnames
+                self.update(_iter_element(parts))
+            elif shape[1] is not None:
+                self._add_tree(*shape)
+        return self
+
+    def update(self, hosts):
+        """ Add an iterable of hostnames """
+        hosts = iter(hosts)
+        while True:
+            chunk = list(itertools.islice(hosts, _CHUNK_SIZE))
+            if not chunk:
+                return self
+            for literals, tree in _host_trees(chunk):
+                self._add_tree(literals, tree)
+
+    def __iter__(self):
+        for literals, tree in self._trees.items():
+            yield from _iter_node(tree, literals, '')
+
+    def __len__(self):
+        return sum(_count_node(tree) for tree in self._trees.values())
+
+    def __bool__(self):
+        return bool(self._trees)
+
+    def __contains__(self, host):
+        pieces = _NUM_RE.split(host)
+        node = self._trees.get(tuple(pieces[0::2]))
+        for digits in pieces[1::2]:
+            if node is None:
+                return False
+            width, num = _width(digits), int(digits)
+            idx = bisect.bisect_right(node, (width, num, float('inf'))) - 1
+            if idx < 0 or node[idx][0] != width or node[idx][2] < num:
+                return False
+            node = node[idx][3]
+        return node is _LEAF
+
+    def __eq__(self, other):
+        if not isinstance(other, HostList):
+            return NotImplemented
+        return self.trees() == other.trees()
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.compress()!r})'
+
+    def trees(self):
+        """ Get the trees of runs, keyed by the literal text around the
+        numbers in the hostnames """
+        return self._trees
+
+    def _combine(self, other, operation):
+        result = HostList()
+        other_trees = other.trees()
+        for literals in itertools.chain(
+                self._trees,
+                (key for key in other_trees if key not in self._trees)
+        ):
+            tree = _combine_nodes(
+                self._trees.get(literals), other_trees.get(literals),
+                operation
+            )
+            if tree is not None:
+                result.trees()[literals] = tree
+        return result
+
+    def union(self, other):
+        """ Hosts in either host list """
+        return self._combine(other, _UNION)
+
+    def intersection(self, other):
+        """ Hosts in both host lists """
+        return self._combine(other, _INTERSECTION)
+
+    def difference(self, other):
+        """ Hosts in this host list but not the other """
+        return self._combine(other, _DIFFERENCE)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def compress(self):
+        """ Get the compressed hostlist string for these hosts """
+        elements = []
+        for literals, tree in self._trees.items():
+            elements.extend(_compress_node(tree, literals))
+        return ','.join(elements)
+
+
+def _normalize_runs(runs):
+    """ Convert (start, end, width) runs into merged (width, start, end)
+    runs. Numbers at or above 10**(width - 1) need no padding, so they are
+    filed with the unpadded numbers to keep one representation per host. """
+    by_width = {}
+    for start, end, width in runs:
+        if width:
+            unpadded = 10 ** (width - 1)
+            if start < unpadded:
+                by_width.setdefault(width, []).append(
+                    (start, min(end, unpadded - 1))
+                )
+            start = max(start, unpadded)
+            if start > end:
+                continue
+        by_width.setdefault(0, []).append((start, end))
+    return [
+        (width, start, end)
+        for width in sorted(by_width)
+        for start, end in merge_runs(by_width[width])
+    ]
+
+
+def _element_tree(parts):
+    """ Get the (literals, tree) for a parsed element, or None if two
+    numbers in it are adjacent. The tree is None if the element is empty. """
+    literals = ['']
+    fields = []
+    for idx, part in enumerate(parts):
+        if idx % 2:
+            fields.append(_normalize_runs(part))
+            literals.append('')
+            continue
+        pieces = _NUM_RE.split(part)
+        literals[-1] += pieces[0]
+        for digits, text in zip(pieces[1::2], pieces[2::2]):
+            num = int(digits)
+            fields.append(_normalize_runs([(num, num, _width(digits))]))
+            literals.append(text)
+    if not all(literals[1:-1]):
+        return None
+    node = _LEAF
+    for runs in reversed(fields):
+        if not runs:
+            return tuple(literals), None
+        node = tuple((width, start, end, node) for width, start, end in runs)
+    return tuple(literals), node
+
+
+class _Numbers(dict):
+    """ Cache of number strings to (width, number) pairs """
+
+    def __missing__(self, digits):
+        value = self[digits] = (_width(digits), int(digits))
+        return value
+
+
+def _host_trees(hosts):
+    """ Iterate over the (literals, tree) for each shape in a list of
+    hostnames """
+    numbers = _Numbers()
+    points = {}
+    for host in hosts:
+        pieces = _NUM_RE.split(host)
+        points.setdefault(tuple(pieces[0::2]), []).append(
+            tuple(map(numbers.__getitem__, pieces[1::2]))
+        )
+    for literals, shape_points in points.items():
+        shape_points.sort()
+        yield literals, _build_tree(shape_points)
+
+
+def _build_tree(points):
+    """ Build a tree from sorted points, tuples of (width, number) pairs,
+    closing the levels below the first number that differs from the
+    previous point """
+    depth = len(points[0])
+    if not depth:
+        return _LEAF
+    levels = [[] for _ in range(depth)]
+    last = levels[-1]
+    prev = points[0]
+    for point in points:
+        if point[:-1] != prev[:-1]:
+            same = 0
+            while point[same] == prev[same]:
+                same += 1
+            _close_levels(levels, prev, same)
+            last = levels[-1]
+        width, num = point[-1]
+        # Points are sorted, so the last number only ever extends a run
+        if last and last[-1][0] == width and last[-1][2] + 1 >= num:
+            last[-1] = (width, last[-1][1], num, _LEAF)
         else:
-            result_hostlist.append(node)
+            last.append((width, num, num, _LEAF))
+        prev = point
+    _close_levels(levels, prev, 0)
+    return tuple(levels[0])
 
-    return ','.join(result_hostlist)
+
+def _close_levels(levels, point, depth):
+    """ Add the finished levels below depth to their parents """
+    for level in range(len(levels) - 1, depth, -1):
+        width, num = point[level - 1]
+        _append_run(levels[level - 1], width, num, num, tuple(levels[level]))
+        levels[level] = []
+
+
+def _append_run(entries, width, start, end, child):
+    """ Append a run to a tree level, merging it into the last run when
+    they touch and have equal children """
+    if entries:
+        last_width, last_start, last_end, last_child = entries[-1]
+        if last_width == width and last_end + 1 >= start and \
+                (last_child is child or last_child == child):
+            entries[-1] = (width, last_start, max(last_end, end), child)
+            return
+    entries.append((width, start, end, child))
+
+
+def _combine_nodes(node_a, node_b, operation):
+    """ Get the union, intersection or difference of two trees of the same
+    shape, where None is an empty tree """
+    if node_a is None or node_b is None:
+        if operation == _UNION:
+            return node_b if node_a is None else node_a
+        return node_a if operation == _DIFFERENCE else None
+    if node_a is node_b or node_a is _LEAF:
+        return None if operation == _DIFFERENCE else node_a
+    entries = []
+    for width, start, end, child_a, child_b in _segments(node_a, node_b):
+        child = _combine_nodes(child_a, child_b, operation)
+        if child is not None:
+            _append_run(entries, width, start, end, child)
+    return tuple(entries) or None
+
+
+def _segments(node_a, node_b):
+    """ Split the runs of two tree levels at every run boundary of either,
+    yielding (width, start, end, child_a, child_b) for each piece """
+    bounds = set()
+    for width, start, end, _ in node_a + node_b:
+        bounds.add((width, start))
+        bounds.add((width, end + 1))
+    bounds = sorted(bounds)
+    idx_a = idx_b = 0
+    for (width, start), (_, next_start) in zip(bounds, bounds[1:]):
+        # A run always ends at a bound with its own width, so a piece
+        # covered by either level never crosses into the next width
+        idx_a, child_a = _child_at(node_a, idx_a, width, start)
+        idx_b, child_b = _child_at(node_b, idx_b, width, start)
+        if child_a is not None or child_b is not None:
+            yield width, start, next_start - 1, child_a, child_b
+
+
+def _child_at(node, idx, width, num):
+    """ Find the child covering a number, starting the search at idx """
+    while idx < len(node) and (node[idx][0], node[idx][2]) < (width, num):
+        idx += 1
+    if idx < len(node) and node[idx][0] == width and node[idx][1] <= num:
+        return idx, node[idx][3]
+    return idx, None
+
+
+def _count_node(node):
+    if node is _LEAF:
+        return 1
+    return sum(
+        (end - start + 1) * _count_node(child)
+        for _, start, end, child in node
+    )
+
+
+def _iter_node(node, literals, prefix):
+    """ Iterate over the hostnames in a tree """
+    prefix += literals[0]
+    if node is _LEAF:
+        yield prefix
+        return
+    for width, start, end, child in node:
+        if child is _LEAF:
+            suffix = literals[1]
+            for num in range(start, end + 1):
+                yield f'{prefix}{_format_number(num, width)}{suffix}'
+            continue
+        for num in range(start, end + 1):
+            yield from _iter_node(
+                child, literals[1:], prefix + _format_number(num, width)
+            )
+
+
+def _compress_node(node, literals):
+    """ Get the host list elements for a tree, with one bracket for each
+    group of runs sharing a child """
+    if node is _LEAF:
+        return [literals[0]]
+    groups = {}
+    for width, start, end, child in node:
+        groups.setdefault(child, {}).setdefault(width, []).append(
+            (start, end)
+        )
+    elements = []
+    for child, by_width in groups.items():
+        tails = _compress_node(child, literals[1:])
+        for width, runs in _group_widths(by_width):
+            head = literals[0] + _format_runs(runs, width)
+            elements.extend(head + tail for tail in tails)
+    return elements
+
+
+def _subtract_runs(runs_a, runs_b):
+    result = []
+    idx_b = 0
+    for start, end in runs_a:
+        while idx_b < len(runs_b) and runs_b[idx_b][1] < start:
+            idx_b += 1
+        idx = idx_b
+        while idx < len(runs_b) and runs_b[idx][0] <= end:
+            if runs_b[idx][0] > start:
+                result.append((start, runs_b[idx][0] - 1))
+            start = max(start, runs_b[idx][1] + 1)
+            idx += 1
+        if start <= end:
+            result.append((start, end))
+    return result
+
+
+def _group_widths(by_width):
+    """ Combine padded and unpadded runs that print the same way, so that
+    nid[098-099] and nid[100-120] compress to nid[098-120] """
+    unpadded = by_width.get(0, [])
+    widths = sorted(width for width in by_width if width)
+    groups = []
+    for width in widths:
+        runs = by_width[width]
+        if width == widths[-1] and unpadded:
+            # Unpadded numbers with at least width digits print the same
+            # when padded, so they can join the padded runs
+            low = 10 ** (width - 1)
+            runs = merge_runs(
+                runs + [(max(start, low), end)
+                        for start, end in unpadded if end >= low]
+            )
+            unpadded = _subtract_runs(unpadded, [(low, float('inf'))])
+        groups.append((width, runs))
+    if unpadded:
+        groups.insert(0, (0, unpadded))
+    return groups
+
+
+def _format_runs(runs, width):
+    if len(runs) == 1 and runs[0][0] == runs[0][1]:
+        return _format_number(runs[0][0], width)
+    ranges = []
+    for start, end in runs:
+        if start == end:
+            ranges.append(_format_number(start, width))
+        else:
+            ranges.append(
+                f'{_format_number(start, width)}-{_format_number(end, width)}'
+            )
+    return f'[{",".join(ranges)}]'
@@ -0,0 +1,65 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+""" hosts.py - Helpers for sending host lists to PALS. """
+import collections
+
+from cray import hostlist
+from cray.echo import echo
+from cray.echo import LOG_DEBUG
+
+
+def dedup_hosts(hosts, ppn=0):
+    """ Drop the duplicates from a host list that names each host once per
+    slot, like PBS_NODEFILE. If every host has the same number of slots and
+    no ppn was given, the slot count becomes the ppn. Host lists with uneven
+    slot counts are returned unchanged. Returns (hosts, ppn). """
+    counts = collections.Counter(hosts)
+    slots = set(counts.values())
+    if len(slots) != 1 or 1 in slots:
+        return hosts, ppn
+    return list(counts), ppn or slots.pop()
+
+
+def compress_hosts(hosts):
+    """ Return a hostlist expression for the hosts, e.g. nid[000001-000004],
+    or None if the expression doesn't expand back to the same hosts in the
+    same order, since the host order decides rank placement """
+    expr = hostlist.compress(hosts)
+    if list(hostlist.iter_expand(expr)) != list(hosts):
+        return None
+    return expr
+
+
+def set_launch_hosts(launchreq, hosts, compress=False):
+    """ Add the hosts to a launch request, as a hostlist expression if
+    compress is set and the hosts can be compressed """
+    expr = compress_hosts(hosts) if compress else None
+    if expr is None:
+        if compress:
+            echo("Host list can't be compressed, sending all hosts",
+                 level=LOG_DEBUG)
+        launchreq["hosts"] = hosts
+    else:
+        launchreq["hostlist"] = expr
+    return launchreq
@@ -24,17 +24,27 @@
 """ cli.py - aprun PALS CLI """
 import argparse
 import base64
+import bisect
 import os
 import sys
 import click
 
 from cray import core
+from cray import hostlist
 from cray.echo import echo
 from cray.echo import LOG_WARN
+from cray.env import filter_environ
+from cray.env import set_launch_env
+from cray.hosts import dedup_hosts
+from cray.hosts import set_launch_hosts
+from cray.output import get_output_sink
+from cray.output import OUTPUT_PATTERN
 from cray.pals import get_resource_limits
 from cray.pals import PALSApp
+from cray.pals import PROCINFO_FORMATS
 from cray.pals import parse_hostfile
 from cray.pals import split_mpmd_args
+from cray.timing import PhaseTimer
 
 APRUN_ENV_ALIAS = {
     "ALPS_APP_DEPTH": "PALS_DEPTH",
@@ -43,36 +53,83 @@ APRUN_ENV_ALIAS = {
 }
 
 
-def parse_rangelist(rli):
-    """Parse a range list into a list of integers"""
+def parse_rangelist_runs(rli):
+    """Parse a range list into a list of (first, last) runs. Descending
+    ranges such as 4-1 keep their order, with first greater than last."""
     try:
-        mylist = []
+        runs = []
         for nidrange in rli.split(","):
             startstr, sep, endstr = nidrange.partition("-")
             start = int(startstr, 0)
-            if sep:
-                end = int(endstr, 0)
-                if end < start:
-                    mylist.extend(range(start, end - 1, -1))
-                else:
-                    mylist.extend(range(start, end + 1))
-            else:
-                mylist.append(start)
+            runs.append((start, int(endstr, 0) if sep else start))
     except ValueError:
         # pylint: disable=raise-missing-from
         raise click.ClickException(f"Invalid range list {rli}")
 
-    return mylist
+    return runs
 
 
-def parse_rangelist_file(rlif):
-    """Parse a file containing rangelists into a list of integers"""
-    mylist = []
+def iter_runs(runs):
+    """Iterate over the integers in a list of (first, last) runs"""
+    for first, last in runs:
+        if last < first:
+            yield from range(first, last - 1, -1)
+        else:
+            yield from range(first, last + 1)
+
+
+def parse_rangelist(rli):
+    """Parse a range list into a list of integers"""
+    return list(iter_runs(parse_rangelist_runs(rli)))
+
+
+def parse_rangelist_file_runs(rlif):
+    """Parse a file containing rangelists into a list of (first, last) runs"""
+    runs = []
     for line in rlif:
         line = line.strip()
         if line and line[0] != "#":
-            mylist.extend(parse_rangelist(line))
-    return mylist
+            runs.extend(parse_rangelist_runs(line))
+    return runs
+
+
+def parse_rangelist_file(rlif):
+    """Parse a file containing rangelists into a list of integers"""
+    return list(iter_runs(parse_rangelist_file_runs(rlif)))
+
+
+def exclude_runs(runs, excluded):
+    """Remove the integers in excluded, a sorted and merged run list, from
+    runs while keeping their order. This works on whole runs, so excluding
+    from large ranges doesn't expand them."""
+    ends = [end for _, end in excluded]
+    for first, last in runs:
+        start, end = min(first, last), max(first, last)
+        pieces = []
+        # Skip straight to the first exclusion that could overlap
+        idx = bisect.bisect_left(ends, start)
+        while idx < len(excluded) and excluded[idx][0] <= end:
+            if excluded[idx][0] > start:
+                pieces.append((start, excluded[idx][0] - 1))
+            start = excluded[idx][1] + 1
+            idx += 1
+        if start <= end:
+            pieces.append((start, end))
+        if last < first:
+            # Put descending runs back in their original order
+            pieces = [(end, start) for start, end in reversed(pieces)]
+        yield from pieces
+
+
+def host_to_nid(host):
+    """Get the nid of a nid hostname as formatted by nids_to_hosts, or
+    None for other hostnames"""
+    digits = host[3:]
+    if host.startswith("nid") and digits.isascii() and digits.isdigit():
+        nid = int(digits)
+        if f"{nid:06d}" == digits:
+            return nid
+    return None
 
 
 def nids_to_hosts(nidlist):
@@ -87,35 +144,55 @@ def get_hostlist(
         exclude_node_list_file
 ):
     """Given command-line arguments, produce a host list"""
+    # Node lists are kept as nid runs until exclusions are removed, so only
+    # the nids that are left get formatted into hostnames
+    noderuns = None
     nodelist = []
-    excllist = []
+    excluded = []
 
     # Build node list from command line arguments
     if node_list:
-        nodelist = nids_to_hosts(parse_rangelist(node_list))
+        noderuns = parse_rangelist_runs(node_list)
     elif node_list_file:
-        nodelist = nids_to_hosts(parse_rangelist_file(node_list_file))
+        noderuns = parse_rangelist_file_runs(node_list_file)
     elif "PBS_NODEFILE" in os.environ:
         with open(os.environ["PBS_NODEFILE"], encoding="utf-8") as nodefile:
             nodelist = parse_hostfile(nodefile)
 
     # Build exclude node list from command line arguments
     if exclude_node_list:
-        excllist = nids_to_hosts(parse_rangelist(exclude_node_list))
+        excluded = parse_rangelist_runs(exclude_node_list)
     elif exclude_node_list_file:
-        excllist = nids_to_hosts(parse_rangelist_file(exclude_node_list_file))
+        excluded = parse_rangelist_file_runs(exclude_node_list_file)
+    excluded = hostlist.merge_runs(
+        (min(first, last), max(first, last)) for first, last in excluded
+    )
 
     # Remove excluded nodes from host list
-    hostlist = [node for node in nodelist if node not in excllist]
+    if noderuns is not None:
+        hosts = nids_to_hosts(iter_runs(exclude_runs(noderuns, excluded)))
+    elif excluded:
+        starts = [start for start, _ in excluded]
+        hosts = []
+        for host, nid in zip(nodelist, map(host_to_nid, nodelist)):
+            if nid is not None:
+                idx = bisect.bisect_right(starts, nid) - 1
+                if idx >= 0 and nid <= excluded[idx][1]:
+                    continue
+            hosts.append(host)
+    else:
+        hosts = nodelist
 
     # Check list before returning
-    if not hostlist:
+    if not hosts:
         raise click.ClickException("No host list provided")
 
-    return hostlist
+    return hosts
 
 
-def get_launch_env(environment_override, environ=None):
+def get_launch_env(
+        environment_override, environ=None, include=None, exclude=None
+):
     """Given command line arguments, build up the environment array"""
     # Copy the environment to avoid modifying the original
     if environ is None:
@@ -123,6 +200,10 @@ def get_launch_env(environment_override, environ=None):
     else:
         environ = environ.copy()
 
+    # Filter the exported environment by name
+    if include or exclude:
+        environ = filter_environ(environ, include, exclude)
+
     # Override specified environment variables
     if environment_override:
         for envvar in environment_override:
@@ -396,6 +477,22 @@ def get_rlimits(memory_per_pe):
     multiple=True,
     help="set an application environment variable (use VARNAME=value format)",
 )
+@core.option(
+    "--env-include",
+    envvar="APRUN_ENV_INCLUDE",
+    help="comma-separated globs of exported environment variables to keep",
+)
+@core.option(
+    "--env-exclude",
+    envvar="APRUN_ENV_EXCLUDE",
+    help="comma-separated globs of exported environment variables to drop",
+)
+@core.option(
+    "--env-baseline",
+    envvar="APRUN_ENV_BASELINE",
+    type=click.Path(exists=True, dir_okay=False),
+    help="only send environment variables that differ from this baseline file",
+)
 @core.option(
     "-E",
     "--exclude-node-list",
@@ -507,6 +604,14 @@ def get_rlimits(memory_per_pe):
     envvar="APRUN_PROCINFO_FILE",
     help="write application process information to the given file",
 )
+@core.option(
+    "--procinfo-format",
+    envvar="APRUN_PROCINFO_FORMAT",
+    type=click.Choice(PROCINFO_FORMATS),
+    default=PROCINFO_FORMATS[0],
+    help="procinfo file format, 'binary' is compact and can be mmapped "
+    "('json' default)",
+)
 @core.option(
     "--abort-on-failure/--no-abort-on-failure",
     envvar="APRUN_ABORT_ON_FAILURE",
@@ -526,6 +631,38 @@ def get_rlimits(memory_per_pe):
     default=False,
     help="enable/disable Scalable Start Up",
 )
+@core.option(
+    "--output-dir",
+    envvar="APRUN_OUTPUT_DIR",
+    help="write each PE's stdout and stderr to files in the given directory",
+)
+@core.option(
+    "--output-pattern",
+    envvar="APRUN_OUTPUT_PATTERN",
+    default=OUTPUT_PATTERN,
+    help="output file name pattern, using {rank}, {host} and {stream}",
+)
+@core.option(
+    "--output-gzip/--no-output-gzip",
+    default=False,
+    envvar="APRUN_OUTPUT_GZIP",
+    help="compress output files with gzip",
+)
+@core.option(
+    "--compress-hosts/--no-compress-hosts",
+    default=False,
+    envvar="APRUN_COMPRESS_HOSTS",
+    help="send the host list as a hostlist expression, e.g. nid[000001-000004]",
+)
+@core.option(
+    "--timing",
+    is_flag=True,
+    help="report how long each launch phase takes as JSON on stderr",
+)
+@core.option(
+    "--timing-file",
+    help="write the launch phase timing report to the given file",
+)
 @core.argument("executable")
 @core.argument("args", nargs=-1)
 def cli(
@@ -538,6 +675,9 @@ def cli(
         cpus_per_pe,
         debug,
         environment_override,
+        env_include,
+        env_exclude,
+        env_baseline,
         exclude_node_list,
         exclude_node_list_file,
         access_mode,
@@ -561,9 +701,16 @@ def cli(
         zone_sort,
         zone_sort_secs,
         procinfo_file,
+        procinfo_format,
         abort_on_failure,
         pmi,
         sstartup,
+        output_dir,
+        output_pattern,
+        output_gzip,
+        compress_hosts,
+        timing,
+        timing_file,
         executable,
         args,
 ):
@@ -601,11 +748,21 @@ def cli(
     * APRUN_WDIR - Default working directory
     * APRUN_SYNC_TTY - Synchronize output
     * APRUN_PROCINFO_FILE - Write application process information to the given file
+    * APRUN_PROCINFO_FORMAT - Procinfo file format (json, binary)
     * APRUN_ABORT_ON_FAILURE - Whether to abort application on non-zero rank exit
     * APRUN_PMI - Application PMI wire-up setting (cray, pmix, none)
+    * APRUN_OUTPUT_DIR - Write each PE's stdout and stderr to this directory
+    * APRUN_OUTPUT_PATTERN - Output file name pattern
+    * APRUN_OUTPUT_GZIP - Whether to compress output files with gzip
+    * APRUN_COMPRESS_HOSTS - Whether to send the host list as a hostlist expression
+    * APRUN_ENV_INCLUDE - Globs of exported environment variables to keep
+    * APRUN_ENV_EXCLUDE - Globs of exported environment variables to drop
+    * APRUN_ENV_BASELINE - Baseline environment file to send differences from
     * APRUN_XFER_LIMITS - If set to 1, transfer all resource limits
     * APRUN_XFER_STACK_LIMIT - If set to 1, transfer stack limit
     * APRUN_LABEL - If set to 1, label output with hostname and rank number
+    * APRUN_LINE_ORDERED - If set to 1, hold partial output lines so lines
+      from different ranks don't mix
 
     \b
     Output Environment Variables:
@@ -614,19 +771,23 @@ def cli(
     * ALPS_APP_PE - Rank ID
     """
 
+    hosts = get_hostlist(
+        node_list,
+        node_list_file,
+        exclude_node_list,
+        exclude_node_list_file
+    )
+    # PBS_NODEFILE lists each host once per slot, so fold the duplicates
+    # into the PEs per node before it's used for the commands
+    if not node_list and not node_list_file:
+        hosts, pes_per_node = dedup_hosts(hosts, pes_per_node)
+
     # Create a launch request from arguments
     launchreq = {
         "cmds": parse_mpmd(
             executable, args, pes, get_wdir(wdir), cpus_per_pe, pes_per_node
         ),
-        "hosts": get_hostlist(
-            node_list,
-            node_list_file,
-            exclude_node_list,
-            exclude_node_list_file
-        ),
         "ppn": pes_per_node,
-        "environment": get_launch_env(environment_override),
         "cpubind": get_cpubind(cpu_binding),
         "membind": get_membind(strict_memory_containment),
         "envalias": APRUN_ENV_ALIAS,
@@ -634,6 +795,14 @@ def cli(
         "pmi": pmi,
         "rlimits": get_rlimits(memory_per_pe),
     }
+    set_launch_hosts(launchreq, hosts, compress_hosts)
+    set_launch_env(
+        launchreq,
+        get_launch_env(
+            environment_override, include=env_include, exclude=env_exclude
+        ),
+        env_baseline
+    )
 
     # Add optional settings
     if "PBS_JOBID" in os.environ:
@@ -647,10 +816,22 @@ def cli(
         launchreq["sstartup"] = True
 
     label = int(os.getenv("APRUN_LABEL", "0"))
+    line_ordered = int(os.getenv("APRUN_LINE_ORDERED", "0"))
+
+    output = get_output_sink(
+        line_ordered, output_dir, output_pattern, output_gzip
+    )
+
+    # Time the launch if requested, otherwise PALS_TIMING decides
+    timer = None
+    if timing or timing_file:
+        timer = PhaseTimer(timing, timing_file)
 
     # Make the launch request
     try:
-        app = PALSApp()
+        app = PALSApp(
+            output=output, timer=timer, procinfo_format=procinfo_format
+        )
         exit_codes = app.launch(
             launchreq, not bypass_app_transfer, label, procinfo_file
         )
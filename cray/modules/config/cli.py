@@ -89,7 +89,7 @@ def config_describe(ctx):
             f'Describing configuration: {configuration}',
             level=LOG_FORCE, ctx=ctx
         )
-    return Config(ctx.obj['config_dir'], configuration, True)
+    return ctx.obj['config']
 
 
 @cli.command(name='get')
@@ -100,8 +100,7 @@ def config_get(ctx, prop):
     This should be a deep reach of the section/value. For example to get
     the username value: \n
     `cray config get auth.login.username` """
-    configuration = ctx.obj['globals'].get('configuration')
-    config = Config(ctx.obj['config_dir'], configuration, True)
+    config = ctx.obj['config']
     try:
         keys = prop.split('.')
         data = config[keys.pop(0)]
@@ -122,8 +121,7 @@ def config_set(ctx, section, values):
     Example: `cray config set cmd.subcmd foo=bar bars=foos` \n
     To update login user:
      `cray config set auth.login username=janedoe`"""
-    configuration = ctx.obj['globals'].get('configuration')
-    config = Config(ctx.obj['config_dir'], configuration, True)
+    config = ctx.obj['config']
     try:
         data = {v[0]: v[1] for v in [value.split('=') for value in values]}
         keys = section.split('.')[::-1]
@@ -143,8 +141,7 @@ def config_unset(ctx, props):
     """ Unset configuration parameters. \n
     Example: `cray config unset cmd.subcmd.foo`
     """
-    configuration = ctx.obj['globals'].get('configuration')
-    config = Config(ctx.obj['config_dir'], configuration, True)
+    config = ctx.obj['config']
     for prop in props:
         try:
             keys = prop.split('.')
@@ -31,10 +31,21 @@ import click
 from cray import core
 from cray.echo import echo
 from cray.echo import LOG_WARN
+from cray.ensemble import Ensemble
+from cray.ensemble import ENSEMBLE_LIMIT
+from cray.env import filter_environ
+from cray.env import set_launch_env
+from cray.hosts import dedup_hosts
+from cray.hosts import set_launch_hosts
+from cray.output import get_output_sink
+from cray.output import OUTPUT_PATTERN
 from cray.pals import get_resource_limits
 from cray.pals import PALSApp
+from cray.pals import PROCINFO_FORMATS
+from cray.pals import STDIO_ENGINES
 from cray.pals import parse_hostfile
 from cray.pals import split_mpmd_args
+from cray.timing import PhaseTimer
 
 SIGNAL_RECEIVED = 0  # Last signal number received
 PING_INTERVAL = 20  # WebSocket ping interval
@@ -130,7 +141,7 @@ def get_hostlist(hosts, hostfile):
     return hostlist
 
 
-def get_launch_env(envlist, envall, env, path):
+def get_launch_env(envlist, envall, env, path, include=None, exclude=None):
     """Given command line arguments, build up the environment array"""
 
     # First handle the arguments that export existing environment
@@ -147,6 +158,10 @@ def get_launch_env(envlist, envall, env, path):
         # Otherwise start from scratch
         environ = {}
 
+    # Filter the exported environment by name
+    if include or exclude:
+        environ = filter_environ(environ, include, exclude)
+
     # Next add environment variables explicitly called out
     # Overrides anything already set
     if env:
@@ -189,8 +204,9 @@ def posint(val):
     return ival
 
 
-def parse_mpmd_args(argv, soft, def_depth, def_ppn):
-    """Parse MPMD command arguments into a command dictionary"""
+def make_mpmd_parser(def_depth, def_ppn):
+    """Create a parser for MPMD command arguments. The working directory
+    and umask defaults are looked up once here rather than for each command"""
     parser = argparse.ArgumentParser(
         prog="",
         description="MPMD Command Definition"
@@ -231,6 +247,14 @@ def parse_mpmd_args(argv, soft, def_depth, def_ppn):
     parser.add_argument(
         "args", nargs=argparse.REMAINDER, help="arguments to executable"
     )
+    return parser
+
+
+def parse_mpmd_args(argv, soft, def_depth, def_ppn, parser=None):
+    """Parse MPMD command arguments into a command dictionary. Pass a
+    parser from make_mpmd_parser() when parsing more than one command."""
+    if parser is None:
+        parser = make_mpmd_parser(def_depth, def_ppn)
 
     # Parse arguments
     args = parser.parse_args(argv)
@@ -248,34 +272,75 @@ def parse_mpmd_args(argv, soft, def_depth, def_ppn):
     }
 
 
-def parse_mpmd_file(configfile, soft, def_depth, def_ppn):
-    """Read an MPMD config file and return a list of commands"""
+def iter_mpmd_lines(config):
+    """Generate the lines of an MPMD config file, joining lines that end
+    with a backslash to the line after them"""
+    continued = []
+    for line in config:
+        if line.endswith("\\\n"):
+            continued.append(line[:-2])
+            continue
+        if continued:
+            continued.append(line)
+            line = "".join(continued)
+            continued = []
+        yield line
+    if continued:
+        yield "".join(continued)
+
+
+def iter_config_argvs(configfile):
+    """Generate the split lines of a config file, skipping empty lines and
+    comment lines"""
     try:
-        cmds = []
         with open(configfile, encoding="utf-8") as config:
-            content = config.read().replace("\\\n", "")
-            for line in content.splitlines():
+            for line in iter_mpmd_lines(config):
                 line = line.strip()
 
                 # Ignore empty lines and comment lines
-                if not line or line[0] == "#":
-                    continue
-
-                cmds.append(
-                    parse_mpmd_args(line.split(), soft, def_depth, def_ppn)
-                )
-
-        # Make sure we got at least one command
-        if not cmds:
-            raise click.ClickException(f"No commands found in {configfile}")
-
-        return cmds
+                if line and line[0] != "#":
+                    yield line.split()
     except (IOError, OSError) as err:
         raise click.ClickException(
             f"Couldn't read config file {configfile}: {str(err)}"
         )
 
 
+def parse_mpmd_file(configfile, soft, def_depth, def_ppn):
+    """Read an MPMD config file and return a list of commands"""
+    parser = make_mpmd_parser(def_depth, def_ppn)
+    cmds = [
+        parse_mpmd_args(argv, soft, def_depth, def_ppn, parser)
+        for argv in iter_config_argvs(configfile)
+    ]
+
+    # Make sure we got at least one command
+    if not cmds:
+        raise click.ClickException(f"No commands found in {configfile}")
+
+    return cmds
+
+
+def parse_ensemble_file(manifest, soft, def_depth, def_ppn):
+    """Read an ensemble manifest and return each application's list of
+    commands. Each line is an application, with MPMD commands separated
+    by :"""
+    parser = make_mpmd_parser(def_depth, def_ppn)
+    apps = [
+        [
+            parse_mpmd_args(cmdargv, soft, def_depth, def_ppn, parser)
+            for cmdargv in split_mpmd_args(argv)
+        ]
+        for argv in iter_config_argvs(manifest)
+    ]
+
+    # Make sure we got at least one application
+    if not apps:
+        raise click.ClickException(f"No applications found in {manifest}")
+
+    return apps
+
+
 def parse_mpmd(executable, args, nranks, soft, wdir, umask, depth, ppn):
     """Parse MPMD commands from the given arguments"""
 
@@ -297,8 +362,10 @@ def parse_mpmd(executable, args, nranks, soft, wdir, umask, depth, ppn):
     ]
 
     # Add other commands
-    for cmdargv in cmdargvs[1:]:
-        cmds.append(parse_mpmd_args(cmdargv, soft, depth, ppn))
+    if len(cmdargvs) > 1:
+        parser = make_mpmd_parser(depth, ppn)
+        for cmdargv in cmdargvs[1:]:
+            cmds.append(parse_mpmd_args(cmdargv, soft, depth, ppn, parser))
 
     return cmds
 
@@ -332,6 +399,67 @@ def get_rlimits(rlimits):
     return get_resource_limits(limitnames)
 
 
+def set_launch_options(
+        launchreq, cpu_bind, mem_bind, include_tasks, exclude_tasks,
+        exclusive, line_buffer, sstartup
+):
+    # pylint: disable=too-many-arguments
+    """Add the optional settings that were given to a launch request"""
+    if "PBS_JOBID" in os.environ:
+        launchreq["jobid"] = os.environ["PBS_JOBID"]
+    if cpu_bind:
+        launchreq["cpubind"] = cpu_bind
+    if mem_bind:
+        launchreq["membind"] = mem_bind
+    if include_tasks:
+        launchreq["include_tasks"] = include_tasks.split(",")
+    if exclude_tasks:
+        launchreq["exclude_tasks"] = exclude_tasks.split(",")
+    if exclusive:
+        launchreq["exclusive"] = exclusive
+    if line_buffer:
+        launchreq["line_buffered"] = True
+    if sstartup:
+        launchreq["sstartup"] = True
+
+
+def make_ensemble_app(idx, output_opts, timing_opts, procinfo_format=None):
+    """Create the idx'th application of an ensemble, keeping its output
+    files and timing apart from the others"""
+    line_ordered, output_dir, output_pattern, output_gzip = output_opts
+    timing, timing_file = timing_opts
+    output = get_output_sink(
+        line_ordered, output_dir,
+        f"app{idx}/{output_pattern or OUTPUT_PATTERN}", output_gzip
+    )
+    timer = None
+    if timing or timing_file:
+        timer = PhaseTimer(timing, timing_file and f"{timing_file}.app{idx}")
+    return PALSApp(output=output, timer=timer, procinfo_format=procinfo_format)
+
+
+def run_ensemble(
+        ensemble_cmds, launchreq, limit, transfer, label, output_opts,
+        timing_opts, procinfo_opts
+):
+    # pylint: disable=too-many-arguments
+    """Run an ensemble of applications, each from its own copy of the launch
+    request, and return their exit codes by name. Each application writes
+    its own procinfo file, named like the timing files."""
+    ensemble = Ensemble(limit, transfer, label)
+    procinfo_file, procinfo_format = procinfo_opts
+    for idx, cmds in enumerate(ensemble_cmds, 1):
+        appreq = dict(launchreq, cmds=cmds)
+        appreq["environment"] = list(launchreq["environment"])
+        ensemble.add(
+            f"app {idx}",
+            make_ensemble_app(idx, output_opts, timing_opts, procinfo_format),
+            appreq, procinfo_file and f"{procinfo_file}.app{idx}"
+        )
+
+    return ensemble.run()
+
+
 @core.command(
     name="mpiexec",
     context_settings={
@@ -385,6 +513,12 @@ def get_rlimits(rlimits):
     type=click.File(),
     help="file containing hostnames to run processes on",
 )
+@core.option(
+    "--compress-hosts/--no-compress-hosts",
+    default=False,
+    envvar="PALS_COMPRESS_HOSTS",
+    help="send the host list as a hostlist expression, e.g. nid[000001-000004]",
+)
 @core.option(
     "-arch",
     "--arch",
@@ -414,6 +548,18 @@ def get_rlimits(rlimits):
     is_flag=True,
     help="file with MPMD specifications, one per line",
 )
+@core.option(
+    "--ensemble",
+    is_flag=True,
+    help="file with applications to run at once, one per line",
+)
+@core.option(
+    "--ensemble-limit",
+    default=ENSEMBLE_LIMIT,
+    envvar="PALS_ENSEMBLE_LIMIT",
+    type=click.IntRange(1),
+    help="most ensemble applications to run at once",
+)
 @core.option(
     "-umask",
     "--umask",
@@ -442,6 +588,22 @@ def get_rlimits(rlimits):
     envvar="PALS_ENVALL",
     help="export environment variables to application",
 )
+@core.option(
+    "--env-include",
+    envvar="PALS_ENV_INCLUDE",
+    help="comma-separated globs of exported environment variables to keep",
+)
+@core.option(
+    "--env-exclude",
+    envvar="PALS_ENV_EXCLUDE",
+    help="comma-separated globs of exported environment variables to drop",
+)
+@core.option(
+    "--env-baseline",
+    envvar="PALS_ENV_BASELINE",
+    type=click.Path(exists=True, dir_okay=False),
+    help="only send environment variables that differ from this baseline file",
+)
 @core.option(
     "--transfer/--no-transfer",
     default=True,
@@ -491,10 +653,42 @@ def get_rlimits(rlimits):
     envvar="PALS_LINE_BUFFER",
     help="enable/disable line buffered mode for stdio",
 )
+@core.option(
+    "--line-ordered/--no-line-ordered",
+    default=False,
+    envvar="PALS_LINE_ORDERED",
+    help="hold partial output lines so lines from different ranks don't mix",
+)
+@core.option(
+    "--output-dir",
+    envvar="PALS_OUTPUT_DIR",
+    help="write each rank's stdout and stderr to files in the given directory",
+)
+@core.option(
+    "--output-pattern",
+    envvar="PALS_OUTPUT_PATTERN",
+    default=OUTPUT_PATTERN,
+    help="output file name pattern, using {rank}, {host} and {stream}",
+)
+@core.option(
+    "--output-gzip/--no-output-gzip",
+    default=False,
+    envvar="PALS_OUTPUT_GZIP",
+    help="compress output files with gzip",
+)
 @core.option(
     "--procinfo-file",
     envvar="PALS_PROCINFO_FILE",
-    help="write application process information to the given file",
+    help="write application process information to the given file "
+    "(one per application with --ensemble, ending in .appN)",
+)
+@core.option(
+    "--procinfo-format",
+    envvar="PALS_PROCINFO_FORMAT",
+    type=click.Choice(PROCINFO_FORMATS),
+    default=PROCINFO_FORMATS[0],
+    help="procinfo file format, 'binary' is compact and can be mmapped "
+    "('json' default)",
 )
 @core.option(
     "--abort-on-failure/--no-abort-on-failure",
@@ -522,6 +716,22 @@ def get_rlimits(rlimits):
     envvar="PALS_SSTARTUP",
     help="enable/disable scalable start up",
 )
+@core.option(
+    "--stdio-engine",
+    envvar="PALS_STDIO_ENGINE",
+    type=click.Choice(STDIO_ENGINES),
+    default=STDIO_ENGINES[0],
+    help="Method used to handle application stdio ('threads' default)",
+)
+@core.option(
+    "--timing",
+    is_flag=True,
+    help="report how long each launch phase takes as JSON on stderr",
+)
+@core.option(
+    "--timing-file",
+    help="write the launch phase timing report to the given file",
+)
 @core.argument("executable")
 @core.argument("args", nargs=-1)
 def cli(
@@ -530,15 +740,21 @@ def cli(
         soft,
         hostlist,
         hostfile,
+        compress_hosts,
         arch,
         wdir,
         path,
         file,
         configfile,
+        ensemble,
+        ensemble_limit,
         umask,
         env,
         envlist,
         envall,
+        env_include,
+        env_exclude,
+        env_baseline,
         transfer,
         cpu_bind,
         mem_bind,
@@ -548,11 +764,19 @@ def cli(
         exclude_tasks,
         exclusive,
         line_buffer,
+        line_ordered,
+        output_dir,
+        output_pattern,
+        output_gzip,
         procinfo_file,
+        procinfo_format,
         abort_on_failure,
         pmi,
         rlimits,
         sstartup,
+        stdio_engine,
+        timing,
+        timing_file,
         executable,
         args,
 ):
@@ -567,6 +791,14 @@ def cli(
     For example, use 'cray mpiexec -n 4 -- a.out -n 2' to launch 4 copies of
     'a.out -n 2'.
 
+    ENSEMBLES
+
+    With --ensemble, EXECUTABLE is a manifest with one application per line,
+    written like a -configfile line, with MPMD commands separated by ':'.
+    The applications share the other options and run at once, at most
+    --ensemble-limit at a time, and stdin isn't forwarded to them. Each
+    application's exit code is reported, and mpiexec exits with the highest.
+
     CPU BINDING
 
     The --cpu-bind option is formatted as [verbose,]<keyword>[:arguments]
@@ -599,12 +831,19 @@ def cli(
     * PALS_SOFT - default soft number of ranks
     * PALS_HOSTLIST - default host list
     * PALS_HOSTFILE - default host file
+    * PALS_COMPRESS_HOSTS - whether to send the host list as a hostlist expression
     * PALS_WDIR - default working directory
+    * PALS_ENSEMBLE_LIMIT - most ensemble applications to run at once
     * PALS_PATH - default executable search path
     * PALS_UMASK - default file creation mask
     * PALS_ENVLIST - default list of exported environment variables
     * PALS_ENVALL - default export of all environment variables
+    * PALS_ENV_INCLUDE - globs of exported environment variables to keep
+    * PALS_ENV_EXCLUDE - globs of exported environment variables to drop
+    * PALS_ENV_BASELINE - baseline environment file to send differences from
     * PALS_TRANSFER - default executable transfer
+    * PALS_TRANSFER_CHECKSUM - skip transferring executables the service has
+    * PALS_TRANSFER_MANIFEST - whether to remember executable checksums
     * PALS_CPU_BIND - default CPU binding
     * PALS_MEM_BIND - default memory binding
     * PALS_DEPTH - default CPUs per rank
@@ -613,25 +852,50 @@ def cli(
     * PALS_EXCLUDE_TASKS - comma-separated list of ATOM tasks to not execute
     * PALS_EXCLUSIVE - if set, request exclusive access to all app nodes
     * PALS_LINE_BUFFER - whether to enable line buffered mode
+    * PALS_LINE_ORDERED - whether to hold partial output lines
+    * PALS_OUTPUT_DIR - write each rank's stdout and stderr to this directory
+    * PALS_OUTPUT_PATTERN - output file name pattern
+    * PALS_OUTPUT_GZIP - whether to compress output files with gzip
     * PALS_PROCINFO_FILE - write application process information to the given file
+    * PALS_PROCINFO_FORMAT - procinfo file format (json, binary)
+    * PALS_MPIR - MPIR debugger support (auto, 1, 0)
+    * PALS_EXIT_REPORT - write each rank's exit status to the given JSON file
+    * PALS_TIMING - whether to report launch phase timing as JSON on stderr
+    * PALS_TIMING_FILE - write the launch phase timing report to the given file
     * PALS_ABORT_ON_FAILURE - whether to abort application on non-zero rank exit
     * PALS_PMI - default PMI wire-up setting (cray, pmix, none)
     * PALS_RLIMITS - default application resource limits
     * PALS_SSTARTUP - whether to enable Scalable Start Up
+    * PALS_STDIO_ENGINE - method used to handle stdio (threads, asyncio)
+    * PALS_STDIN_READ_SIZE - bytes of stdin to read and send at a time
+    * PALS_STDIN_BINARY - whether to send stdin in binary websocket frames
+    * PALS_WS_DEFLATE - whether to ask for compressed websocket messages
     """
 
+    # Host files list each host once per slot, so fold the duplicates into
+    # the ppn before it's used for the commands
+    hosts = get_hostlist(hostlist, hostfile)
+    if not hostlist and hostfile:
+        hosts, ppn = dedup_hosts(hosts, ppn)
+
     # Create a launch request from arguments
     launchreq = {
-        "hosts": get_hostlist(hostlist, hostfile),
         "ppn": ppn,
-        "environment": get_launch_env(envlist, envall, env, path),
         "abort_on_failure": abort_on_failure,
         "pmi": pmi,
         "rlimits": get_rlimits(rlimits),
     }
+    set_launch_hosts(launchreq, hosts, compress_hosts)
+    set_launch_env(
+        launchreq,
+        get_launch_env(envlist, envall, env, path, env_include, env_exclude),
+        env_baseline
+    )
 
     # Parse commands
-    if configfile:
+    if ensemble:
+        ensemble_cmds = parse_ensemble_file(executable, soft, depth, ppn)
+    elif configfile:
         launchreq["cmds"] = parse_mpmd_file(executable, soft, depth, ppn)
     else:
         launchreq["cmds"] = parse_mpmd(
@@ -639,26 +903,31 @@ def cli(
         )
 
     # Add optional settings
-    if "PBS_JOBID" in os.environ:
-        launchreq["jobid"] = os.environ["PBS_JOBID"]
-    if cpu_bind:
-        launchreq["cpubind"] = cpu_bind
-    if mem_bind:
-        launchreq["membind"] = mem_bind
-    if include_tasks:
-        launchreq["include_tasks"] = include_tasks.split(",")
-    if exclude_tasks:
-        launchreq["exclude_tasks"] = exclude_tasks.split(",")
-    if exclusive:
-        launchreq["exclusive"] = exclusive
-    if line_buffer:
-        launchreq["line_buffered"] = True
-    if sstartup:
-        launchreq["sstartup"] = True
+    set_launch_options(
+        launchreq, cpu_bind, mem_bind, include_tasks, exclude_tasks,
+        exclusive, line_buffer, sstartup
+    )
+
+    if ensemble:
+        exit_codes = run_ensemble(
+            ensemble_cmds, launchreq, ensemble_limit, transfer, label,
+            (line_ordered, output_dir, output_pattern, output_gzip),
+            (timing, timing_file), (procinfo_file, procinfo_format)
+        )
+        sys.exit(max(exit_codes.values()))
+
+    output = get_output_sink(
+        line_ordered, output_dir, output_pattern, output_gzip
+    )
+
+    # Time the launch if requested, otherwise PALS_TIMING decides
+    timer = None
+    if timing or timing_file:
+        timer = PhaseTimer(timing, timing_file)
 
     # Make the launch request
     try:
-        app = PALSApp()
+        app = PALSApp(stdio_engine, output, timer, procinfo_format)
         exit_codes = app.launch(launchreq, transfer, label, procinfo_file)
     except click.UsageError as err:
         echo(
@@ -23,9 +23,146 @@
 #
 """ Cray Parallel Application Launch Service """
 # pylint: disable=invalid-name
+import concurrent.futures
+import json
+import time
+import click
+
+from cray.core import argument
+from cray.core import option
+from cray.core import pass_context
+from cray.echo import echo
+from cray.echo import LOG_WARN
+from cray.errors import BadResponseError
 from cray.generator import generate
+from cray.rest import request
+
+APPS = 'apis/pals/v1/apps'
+WATCH_INTERVAL = 5  # Seconds between app list polls
+PROCINFO_WORKERS = 8  # Procinfo requests made at once
 
 cli = generate(__file__)
 
 # Since this API/CLI is deprecated, hide from the main help message
 cli.hidden = True
+
+apps = cli.commands['apps']
+
+
+def get_apps(params, etag=None):
+    """ Get the app list keyed by apid, and its ETag. The apps are None if
+    they haven't changed since the list with the given ETag. """
+    headers = {'If-None-Match': etag} if etag else None
+    resp = request('GET', APPS, params=params, headers=headers)
+    if resp.status_code == 304:
+        return None, etag
+
+    result = resp.json()
+    if isinstance(result, dict):
+        result = result.get('applications', [])
+    return {app['apid']: app for app in result}, resp.headers.get('ETag')
+
+
+def diff_apps(old, new):
+    """ Get the events that turn the old app list into the new one """
+    events = []
+    for apid, app in new.items():
+        prev = old.get(apid)
+        if prev is None:
+            events.append({'event': 'added', 'apid': apid, 'app': app})
+        elif prev != app:
+            changes = {
+                key: app.get(key) for key in prev.keys() | app.keys()
+                if prev.get(key) != app.get(key)
+            }
+            events.append({'event': 'changed', 'apid': apid,
+                           'changes': changes})
+    for apid in old.keys() - new.keys():
+        events.append({'event': 'removed', 'apid': apid})
+    return events
+
+
+###########################################################################
+# cray pals apps watch
+###########################################################################
+@apps.command(name='watch')
+@option(
+    '--usernames', help='A comma separated list of usernames to use as a filter.'
+)
+@option(
+    '--nodes', help='A comma separated list of nodes to use as a filter.'
+)
+@option(
+    '--interval', type=click.FloatRange(min=0), default=WATCH_INTERVAL,
+    show_default=True, help='Seconds between polls of the app list.'
+)
+@option(
+    '--count', type=click.IntRange(min=0), default=0,
+    help='Stop after this many polls (default: keep watching).'
+)
+@pass_context
+def apps_watch(ctx, usernames, nodes, interval, count):
+    """ Watch applications, writing a JSON line for each one added,
+    changed or removed. The list is revalidated with its ETag, so polls
+    where nothing changed are cheap. """
+    params = {'usernames': usernames, 'nodes': nodes}
+    known = {}
+    etag = None
+    polls = 0
+    while True:
+        current, etag = get_apps(params, etag)
+        if current is not None:
+            for event in diff_apps(known, current):
+                click.echo(json.dumps(event))
+            known = current
+        # Let readers of a pipe see each poll's changes right away
+        click.get_text_stream('stdout').flush()
+
+        polls += 1
+        if polls == count:
+            break
+        time.sleep(interval)
+    ctx.exit()
+
+
+###########################################################################
+# cray pals apps procinfo bulk
+###########################################################################
+@apps.commands['procinfo'].command(name='bulk')
+@argument('apids', nargs=-1)
+@option(
+    '--usernames',
+    help='Without APIDS, get the apps of these comma separated usernames.'
+)
+@option(
+    '--nodes',
+    help='Without APIDS, get the apps on these comma separated nodes.'
+)
+@option(
+    '--workers', type=click.IntRange(min=1), default=PROCINFO_WORKERS,
+    show_default=True, help='Procinfo requests to make at once.'
+)
+@pass_context
+def procinfo_bulk(ctx, apids, usernames, nodes, workers):
+    """ Get procinfo for many applications at once, keyed by apid. Without
+    APIDS, every application in the app list is included. Apps that can't
+    be queried (e.g. they've exited) are left out with a warning. """
+    if not apids:
+        apids, _ = get_apps({'usernames': usernames, 'nodes': nodes})
+
+    # Each thread needs the context to make requests, and they all share
+    # the authenticated session (and so its connection pool)
+    def get_procinfo(apid):
+        with ctx:
+            return request('GET', f'{APPS}/{apid}/procinfo').json()
+
+    result = {}
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        futures = {apid: pool.submit(get_procinfo, apid) for apid in apids}
+        for apid, future in futures.items():
+            try:
+                result[apid] = future.result()
+            except BadResponseError as err:
+                echo(f"Couldn't get procinfo for {apid}: {err}",
+                     level=LOG_WARN)
+    return result
@@ -108,6 +108,24 @@ def init_libMpirAttach_functions():
         libMpirAttach = None
 
 
+def get_tracer_pid():
+    """ Get the pid of the process tracing this one, 0 if there isn't one """
+    try:
+        with open("/proc/self/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("TracerPid:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def debugger_detected():
+    """ Check whether a debugger is attached, e.g. one that started this
+    process to launch an application under MPIR """
+    return get_tracer_pid() != 0
+
+
 def get_MPIR_being_debugged():
     """ Get C variable MPIR_being_debugged """
 
@@ -134,64 +152,78 @@ def MPIR_proctable_filled():
 
 def fill_MPIR_proctable(proctable_elems):
     """ Use proctable element array to fill C MPIR_proctable """
-    # pylint: disable=too-many-locals,too-many-branches
-
-    # Load MPIR initialization functions from shared library
-    if libMpirAttach is None:
-        init_libMpirAttach_functions()
-        if libMpirAttach is None:
-            return
 
     if not proctable_elems:
         raise Exception("proctable is empty")
 
-    hostnames = []
+    # Index hosts and executables in order of first appearance
     hostname_indices = {}
-
-    executables = []
     executable_indices = {}
-
+    host_idxs = []
+    exe_idxs = []
+    pids = []
     for (hostname, executable, pid) in proctable_elems:
-        if hostname not in hostnames:
-            hostname_indices[hostname] = len(hostnames)
-            hostnames.append(hostname)
-        if executable not in executables:
-            executable_indices[executable] = len(executables)
-            executables.append(executable)
-
-    hostname_cstr_arr = (ctypes.c_char_p * (len(hostnames) + 1))()
-    hostname_cstr_storage = [
-        ctypes.create_string_buffer(host.encode('utf-8')) for host in hostnames
-    ]
-    for (i, host_cstr) in enumerate(hostname_cstr_storage):
-        hostname_cstr_arr[i] = ctypes.cast(host_cstr, ctypes.c_char_p)
-    hostname_cstr_arr[len(hostname_cstr_storage)] = None
+        host_idxs.append(
+            hostname_indices.setdefault(hostname, len(hostname_indices))
+        )
+        exe_idxs.append(
+            executable_indices.setdefault(executable, len(executable_indices))
+        )
+        pids.append(pid)
+
+    fill_MPIR_proctable_indexed(
+        list(hostname_indices), list(executable_indices),
+        host_idxs, exe_idxs, pids
+    )
 
-    executable_cstr_arr = (ctypes.c_char_p * (len(executables) + 1))()
-    executable_cstr_storage = [
-        ctypes.create_string_buffer(exe.encode('utf-8')) for exe in executables
+
+def _make_cstr_array(strings):
+    """ Make a NULL-terminated C string array. The buffers backing it are
+    returned too and must be kept alive while the array is in use. """
+    cstr_arr = (ctypes.c_char_p * (len(strings) + 1))()
+    cstr_storage = [
+        ctypes.create_string_buffer(string.encode('utf-8'))
+        for string in strings
     ]
-    for (i, exe_cstr) in enumerate(executable_cstr_storage):
-        executable_cstr_arr[i] = ctypes.cast(exe_cstr, ctypes.c_char_p)
-    executable_cstr_arr[len(executable_cstr_storage)] = None
+    for (i, cstr) in enumerate(cstr_storage):
+        cstr_arr[i] = ctypes.cast(cstr, ctypes.c_char_p)
+    cstr_arr[len(cstr_storage)] = None
+    return cstr_arr, cstr_storage
+
+
+def fill_MPIR_proctable_indexed(
+        hostnames, executables, host_idxs, exe_idxs, pids
+):
+    """ Fill C MPIR_proctable from per-rank indices into the hostname and
+    executable lists, as given by procinfo placement and cmdidxs """
+    # pylint: disable=too-many-arguments
+
+    # Load MPIR initialization functions from shared library
+    if libMpirAttach is None:
+        init_libMpirAttach_functions()
+        if libMpirAttach is None:
+            return
+
+    size = len(pids)
+    if not size:
+        raise Exception("proctable is empty")
+
+    hostname_cstr_arr, _hostname_storage = _make_cstr_array(hostnames)
+    executable_cstr_arr, _executable_storage = _make_cstr_array(executables)
 
     if libMpirAttach.allocate_MPIR_proctable(
-            len(proctable_elems),
+            size,
             hostname_cstr_arr, len(hostnames),
             executable_cstr_arr, len(executables)
     ):
         raise Exception("failed: allocate_MPIR_proctable")
 
-    for (idx, (hostname, executable, pid)) in enumerate(proctable_elems):
-        if libMpirAttach.set_MPIR_proctable_elem(
-                idx,
-                hostname_indices[hostname],
-                executable_indices[executable],
-                pid
-        ):
+    set_elem = libMpirAttach.set_MPIR_proctable_elem
+    for (idx, elem) in enumerate(zip(host_idxs, exe_idxs, pids)):
+        if set_elem(idx, *elem):
             raise Exception("failed: set_MPIR_proctable_elem")
 
-    if libMpirAttach.finalize_MPIR_proctable(len(proctable_elems)):
+    if libMpirAttach.finalize_MPIR_proctable(size):
         raise Exception("failed: finalize_MPIR_proctable")
 
     # Set debug state to spawned / proctable filled
@@ -25,10 +25,8 @@
 import os
 import click
 
-from cray.auth import AuthFile
-from cray.auth import AuthUsername
 from cray.config import Config
-from cray.constants import ACTIVE_CONFIG
+from cray.config import get_active_config
 from cray.constants import CONFIG_DIR_ENVVAR
 from cray.constants import CONFIG_ENVVAR
 from cray.constants import DEFAULT_CONFIG
@@ -37,7 +35,6 @@ from cray.constants import FORMAT_ENVVAR
 from cray.constants import NAME
 from cray.constants import QUIET_ENVVAR
 from cray.constants import TOKEN_ENVVAR
-from cray.utils import get_hostname
 
 
 def _has_changed(ctx, param, value):
@@ -52,14 +49,7 @@ def _set_config(ctx, param, value):
 
     ctx.obj['config_dir'] = config_dir
     if _has_changed(ctx, param, value) and value is not None:
-        active_config_path = os.path.join(config_dir, ACTIVE_CONFIG)
-        active_config = DEFAULT_CONFIG
-        if os.path.isfile(active_config_path):
-            with open(
-                    active_config_path,
-                    encoding='utf-8'
-            ) as active_config_fp:
-                active_config = active_config_fp.read()
+        active_config = get_active_config(config_dir)
         ctx.obj['globals']['active_config'] = active_config
         # If user hasn't passed in configuration, use active
         if value == EMPTY_CONFIG:
@@ -88,17 +78,11 @@ def _set_token(ctx, param, value):
     # pylint: disable=unused-argument
     token = ctx.obj['globals'].get(param.name)
     if ctx.info_name != 'init' and _has_changed(ctx, param, value):
-        hostname = get_hostname(ctx)
-        auth = None
-        if value:
-            auth = AuthFile(value, hostname, ctx=ctx)
-        else:
-            username = ctx.obj['config'].get('auth.login.username')
-            if username:
-                auth = AuthUsername(username, hostname, ctx=ctx)
-        ctx.obj['auth'] = auth
-        if auth:
-            token = auth.load()
+        # Credentials are loaded by cray.auth.get_auth the first time a
+        # request needs them, local-only commands never touch them.
+        ctx.obj['auth'] = None
+        ctx.obj['auth_pending'] = {'token_file': value}
+        token = value
     ctx.obj['globals'][param.name] = token
     return token
 
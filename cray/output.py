@@ -0,0 +1,293 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+""" output.py - Application output handling for PALS. """
+import base64
+import collections
+import gzip
+import os
+import queue
+import select
+import sys
+import threading
+import time
+import click
+
+OUTPUT_BUFFER_SIZE = 1 << 20  # Buffered output size that forces a write
+OUTPUT_FLUSH_INTERVAL = 0.2  # Longest time output is held while busy
+OUTPUT_PATTERN = "rank{rank}.{stream}"  # Default per-rank output file name
+OUTPUT_FILE_LIMIT = 256  # Per-rank output files kept open at once
+OUTPUT_FILE_BUFFER_SIZE = 1 << 16  # Per-rank output file buffer size
+OUTPUT_GZIP_LEVEL = 6  # Per-rank output file compression level
+OUTPUT_QUEUE_SIZE = 4096  # Rank output chunks waiting for the file writer
+
+
+class OutputBuffer(object):
+    """ Buffer output for a file and write it out with os.write """
+
+    def __init__(self, a_file):
+        self.file = a_file
+        self.data = bytearray()
+        try:
+            self.fileno = a_file.fileno()
+        except (AttributeError, OSError, ValueError):
+            # Not backed by a file descriptor (e.g. captured by tests)
+            self.fileno = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def write(self, data):
+        """ Add data to the buffer """
+        self.data += data
+
+    def flush(self):
+        """ Write out all buffered data """
+        if not self.data:
+            return
+
+        if self.fileno is None:
+            click.echo(bytes(self.data), nl=False, file=self.file)
+            del self.data[:]
+            return
+
+        # Anything already written through the file object goes first
+        self.file.flush()
+        written = 0
+        with memoryview(self.data) as view:
+            while written < len(view):
+                try:
+                    written += os.write(self.fileno, view[written:])
+                except BlockingIOError:
+                    select.select([], [self.fileno], [])
+        del self.data[:]
+
+
+class OutputSink(object):
+    """ Collect application stdout/stderr and write it out in large chunks.
+    In line-ordered mode, partial lines are held until they're complete so
+    lines from different ranks are never mixed together. """
+
+    def __init__(self, line_ordered=False):
+        self.line_ordered = line_ordered
+        self.buffers = {}
+        self.partial = {}
+        self.last_flush = time.monotonic()
+
+    def write(self, name, params, label=False):
+        """ Add output from a stdout/stderr RPC for the named sys stream """
+        content = params.get("content")
+        if not content:
+            return
+
+        rank = None
+        if "host" in params and "rankid" in params:
+            rank = (params["host"], int(params["rankid"]))
+        else:
+            label = False
+
+        encoding = params.get("encoding")
+        if encoding == "base64":
+            # Decode base64 content, it isn't labeled
+            content = base64.b64decode(content)
+            label = False
+
+        if self.line_ordered and rank:
+            # Hold on to anything after the last newline
+            key = (name, rank, encoding)
+            content = self.partial.pop(key, (content[:0], label))[0] + content
+            newline = "\n" if isinstance(content, str) else b"\n"
+            end = content.rfind(newline) + 1
+            if end < len(content):
+                self.partial[key] = (content[end:], label)
+                content = content[:end]
+
+        self.append(name, rank, content, label)
+
+    def append(self, name, rank, content, label):
+        """ Format content and add it to the named stream's buffer """
+        if label:
+            # Label each line
+            prefix = f"{rank[0]} {rank[1]:d}: "
+            lines = content.splitlines()
+            if len(lines) == 1:
+                content = f"{prefix}{lines[0]}\n"
+            else:
+                content = "".join(f"{prefix}{line}\n" for line in lines)
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+
+        if name not in self.buffers:
+            self.buffers[name] = OutputBuffer(getattr(sys, name))
+        self.buffers[name].write(content)
+
+        # Write out when there's a lot buffered or it's been held too long
+        if (
+                len(self.buffers[name]) >= OUTPUT_BUFFER_SIZE or
+                time.monotonic() - self.last_flush >= OUTPUT_FLUSH_INTERVAL
+        ):
+            self.flush()
+
+    def end_rank(self, host, rankid):
+        """ Add held partial lines once a rank has exited """
+        for key in list(self.partial):
+            # A shepherd exit means all of its ranks have exited
+            if key[1] == (host, rankid) or (rankid == -1 and key[1][0] == host):
+                self.append(key[0], key[1], *self.partial.pop(key))
+
+    def flush(self):
+        """ Write out all buffered output """
+        for buf in self.buffers.values():
+            buf.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        """ Write out everything, including held partial lines """
+        for key in list(self.partial):
+            self.append(key[0], key[1], *self.partial.pop(key))
+        self.flush()
+
+
+class RankFileSink(OutputSink):
+    """ Write each rank's stdout and stderr to its own file. Files are written
+    by a separate thread so receiving RPCs only waits on the disk once the
+    queue to it is full, and only a bounded number are kept open at a time. """
+
+    def __init__(
+            self, output_dir, pattern=OUTPUT_PATTERN, compress=False,
+            line_ordered=False
+    ):
+        super().__init__(line_ordered)
+        self.output_dir = output_dir
+        self.pattern = pattern
+        if compress and not pattern.endswith(".gz"):
+            self.pattern += ".gz"
+        self.compress = compress
+        self.queue = queue.Queue(maxsize=OUTPUT_QUEUE_SIZE)
+        self.error = None
+        self.writer = None
+
+    def append(self, name, rank, content, label):
+        """ Queue rank output for its file, other output goes to the terminal """
+        if rank is None:
+            super().append(name, rank, content, label)
+            return
+
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.write_files)
+            self.writer.daemon = True
+            self.writer.start()
+        self.queue.put((name, rank, content))
+
+    def end_rank(self, host, rankid):
+        """ Add held partial lines and close files once a rank has exited """
+        super().end_rank(host, rankid)
+        if self.writer is not None:
+            self.queue.put((None, (host, rankid), None))
+
+    def close(self):
+        """ Write out everything and close all files """
+        super().close()
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        if self.error:
+            raise click.ClickException(
+                f"Couldn't write application output: {str(self.error)}"
+            )
+
+    def get_path(self, name, rank):
+        """ Get the output file path for a rank's stream """
+        filename = self.pattern.format(host=rank[0], rank=rank[1], stream=name)
+        return os.path.join(self.output_dir, filename)
+
+    def open_file(self, path, created):
+        """ Open an output file, truncating it the first time """
+        mode = "ab" if path in created else "wb"
+        if path not in created:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            created.add(path)
+        if self.compress:
+            # Reopened files get a new gzip member, which gunzip handles
+            return gzip.open(path, mode, compresslevel=OUTPUT_GZIP_LEVEL)
+        return open(path, mode, buffering=OUTPUT_FILE_BUFFER_SIZE)
+
+    def write_files(self):
+        """ Write queued output to rank files until closed """
+        files = collections.OrderedDict()
+        created = set()
+        try:
+            for item in iter(self.queue.get, None):
+                if self.error:
+                    continue
+                try:
+                    self.write_item(files, created, *item)
+                except (IOError, OSError) as err:
+                    self.error = err
+        finally:
+            for a_file in files.values():
+                try:
+                    a_file.close()
+                except (IOError, OSError) as err:
+                    self.error = self.error or err
+
+    def write_item(self, files, created, name, rank, content):
+        """ Write one queued item, given the open files by path. A name of
+        None means the rank exited and its files can be closed. """
+        if name is None:
+            for stream in ("stdout", "stderr"):
+                path = self.get_path(stream, rank)
+                if path in files:
+                    files.pop(path).close()
+            return
+
+        path = self.get_path(name, rank)
+        if path in files:
+            files.move_to_end(path)
+        else:
+            if len(files) >= OUTPUT_FILE_LIMIT:
+                # Close the least recently used file
+                files.popitem(last=False)[1].close()
+            files[path] = self.open_file(path, created)
+        files[path].write(content)
+
+
+def get_output_sink(
+        line_ordered=False, output_dir=None, output_pattern=None,
+        compress=False
+):
+    """ Get the sink for application output given output options """
+    if not output_dir:
+        return OutputSink(line_ordered)
+
+    pattern = output_pattern or OUTPUT_PATTERN
+    try:
+        pattern.format(host="", rank=0, stream="")
+    except (KeyError, IndexError, ValueError) as err:
+        raise click.BadParameter(
+            f"Invalid output pattern {pattern}: {str(err)}"
+        )
+    return RankFileSink(output_dir, pattern, compress, line_ordered)
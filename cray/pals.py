@@ -23,39 +23,52 @@
 #
 """ pals.py - Common functions for launching applications with PALS. """
 # pylint: disable=fixme
-import base64
+import asyncio
+import concurrent.futures
+import contextlib
 import errno
-import fcntl
 import json
 import os
 import resource
-import signal
+import select
 import socket
-import ssl
 import stat
-import sys
 import threading
 import time
 import uuid
 import websocket
 import click
-from six.moves import urllib
 
 from cray import atp
 from cray import mpir
 from cray.echo import echo
+from cray.echo import is_echoed
 from cray.echo import LOG_DEBUG
 from cray.echo import LOG_INFO
 from cray.echo import LOG_RAW
 from cray.echo import LOG_WARN
 from cray.errors import BadResponseError
+from cray.exits import ExitSummary
+from cray.output import OutputSink
+from cray.procinfo import write_procinfo
 from cray.rest import request
-from cray.utils import get_hostname
+from cray.stdio import connect_websock
+from cray.stdio import mpir_intervals
+from cray.stdio import reconnect_delays
+from cray.stdio import send_rpc
+from cray.stdio import spawn_threads
+from cray.stdio import StdioLoop
+from cray.stdio import websock_pending
+from cray.stdio import WebSocketSlot
+from cray.timing import PhaseTimer
+from cray.transfer import get_transfer_manifest
+from cray.transfer import TransferProgress
+from cray.transfer import TransferReader
 from cray.utils import open_atomic
 
-SIGNAL_RECEIVED = 0  # Last signal number received
-PING_INTERVAL = 20  # WebSocket ping interval
-MPIR_ATTACH_INTERVAL = 1  # Check for MPIR attach variable
+STDIO_ENGINES = ("threads", "asyncio")  # Available stdio handling engines
+TRANSFER_WORKERS = 4  # Executables transferred at once
+PROCINFO_FORMATS = ("json", "binary")  # Procinfo file formats, see procinfo.py
 
 
 def split_mpmd_args(args):
@@ -71,49 +84,6 @@ def split_mpmd_args(args):
     return cmdargs
 
 
-def make_ws_url(route: str, url: str = '') -> urllib.parse.ParseResult:
-    """ Make a websocket URL (using wss scheme). Based on make_url in rest.py """
-    # If no URL given, use the configured hostname
-    if not url:
-        url = get_hostname()
-
-    # If no protocol/scheme is set, urllib will confuse anything before the
-    # port number as the scheme, and set the path to the port. To prevent
-    # this ensure that `//` is at the beginning of the string if none is
-    # set, this way urllib can work without us paying concession to a
-    # protocol (e.g. // is agnostic to http|https|etc).
-    if '//' not in url:
-        url = f'//{url}'
-
-    # Split into components
-    scheme, netloc, path, query, fragment = urllib.parse.urlsplit(url)
-
-    # Override scheme with secure WebSocket protocol
-    scheme = "wss"
-
-    # If URL didn't start with a scheme, set netloc to the first part of the path
-    if not netloc and path:
-        netloc, _, path = path.partition("/")
-
-    # Append route to path
-    path = urllib.parse.urljoin(path, route)
-
-    # Join everything back together
-    return urllib.parse.urlunsplit((scheme, netloc, path, query, fragment))
-
-
-def get_ws_headers() -> list:
-    """ Get a list of HTTP headers to send in WebSocket request """
-    ctx = click.get_current_context()
-    auth = ctx.obj["auth"]
-
-    # If we have an access token in the session, use it
-    if auth and auth.session and auth.session.access_token:
-        return ["Authorization: Bearer " + auth.session.access_token]
-
-    return []
-
-
 def find_executable(executable):
     """ Get a path to an executable file """
     # Use given file if it contains a slash or no PATH set
@@ -132,172 +102,56 @@ def find_executable(executable):
 
 def parse_hostfile(hostfile):
     """ Parse a host list from a host file """
-    hostlist = []
+    hosts = []
     for line in hostfile:
         # Ignore leading/trailing whitespace
         line = line.strip()
 
         # Ignore empty lines, and lines that start with #
         if line and line[0] != "#":
-            hostlist.append(line)
-
-    return hostlist
-
-
-def signal_handler(signum, *_):
-    # pylint: disable=global-statement
-    """ Signal handler that stores the signal value in a global """
-    global SIGNAL_RECEIVED
-    SIGNAL_RECEIVED = signum
-
-
-def setup_signals():
-    # pylint: disable=c-extension-no-member
-    """ Set up signal handlers and return a signal wakeup read fd """
-    # Create a pipe that we can use to determine when we've got a signal
-    sig_read, sig_write = os.pipe()
-
-    # Make the write end non-blocking (required for set_wakeup_fd)
-    flags = fcntl.fcntl(sig_write, fcntl.F_GETFL)
-    fcntl.fcntl(sig_write, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-
-    signal.set_wakeup_fd(sig_write)
-
-    # Set up signal handlers
-    for signum in [signal.SIGHUP, signal.SIGINT, signal.SIGQUIT,
-                   signal.SIGABRT, signal.SIGALRM, signal.SIGTERM,
-                   signal.SIGUSR1,
-                   signal.SIGUSR2, ]:
-        signal.signal(signum, signal_handler)
-
-    # Ignore SIGTTIN so we don't stop in the background
-    signal.signal(signal.SIGTTIN, signal.SIG_IGN)
-
-    return sig_read
-
-
-def get_rpc(method, rpcid=None, **params):
-    """ Create a JSONRPC request """
-    rpc = {"jsonrpc": "2.0", "method": method}
-    if params:
-        rpc["params"] = params
-    if rpcid:
-        rpc["id"] = rpcid
-    return json.dumps(rpc)
-
-
-def send_rpc(websock, method, reqid=None, **params):
-    """ Send an RPC over the socket """
-    req = get_rpc(method, reqid, **params)
-    echo(f"Sending RPC {req}", level=LOG_RAW)
-    websock.send(req)
-
-
-def forward_stdin(websock, stdin=sys.stdin):
-    """ Read stdin content and write to application """
-    try:
-        while True:
-            try:
-                # Wait for content on stdin
-                content = os.read(stdin.fileno(), 4096)
-
-                # Empty read signifies EOF
-                if not content:
-                    send_rpc(websock, "stdin", eof=True)
-                    break
-
-                # Attempt to decode UTF-8
-                content = content.decode("utf-8")
-                send_rpc(websock, "stdin", content=content, encoding="UTF-8")
-            except OSError:
-                # I/O error, send EOF
-                send_rpc(websock, "stdin", eof=True)
-                break
-            except UnicodeError:
-                # Fall back on base64
-                content = base64.b64encode(content).decode("utf-8")
-                send_rpc(websock, "stdin", content=content, encoding="base64")
-    except websocket.WebSocketException:
-        pass
-
-
-def forward_signals(websock, sig_pipe):
-    """ Forward signals to the application """
-    try:
-        while True:
-            # Block until a signal arrives
-            os.read(sig_pipe, 4096)
-
-            # Send it to the app
-            send_rpc(
-                websock, "signal", str(uuid.uuid4()), signum=SIGNAL_RECEIVED
-            )
-    except (OSError, websocket.WebSocketException):
-        pass
-
-
-def send_pings(websock):
-    """ Avoid connection drops by sending periodic pings """
-    try:
-        while True:
-            time.sleep(PING_INTERVAL)
-            echo("Sending keepalive ping", level=LOG_RAW)
-            websock.ping()
-    except websocket.WebSocketException:
-        pass
-
-
-def spawn_threads(websock):
-    """ Spawn threads to handle stdin, signals, and pings """
-    sig_read = setup_signals()
-
-    stdin_thread = threading.Thread(target=forward_stdin, args=(websock,))
-    stdin_thread.daemon = True
-    stdin_thread.start()
-
-    signal_thread = threading.Thread(
-        target=forward_signals, args=(websock, sig_read)
+            hosts.append(line)
+
+    return hosts
+
+
+def mpir_wanted():
+    """ Check whether to watch for an MPIR debugger. PALS_MPIR=1 always
+    does and PALS_MPIR=0 never does. By default it is only done when a
+    debugger is detected, so set PALS_MPIR=1 to attach one later. """
+    setting = os.environ.get("PALS_MPIR", "auto")
+    if setting == "auto":
+        return mpir.debugger_detected()
+    return setting != "0"
+
+
+def attach_mpir(ctx, apid, procinfo=None):
+    """ Fill in the MPIR proctable from procinfo and notify the debugger.
+    procinfo is requested from the service if not given. """
+    if procinfo is None:
+        with ctx:
+            resp = request("GET", "apis/pals/v1/apps/" + apid + "/procinfo")
+        procinfo = resp.json()
+    # procinfo already indexes nodes and executables per rank, so the
+    # proctable can be filled straight from it
+    mpir.fill_MPIR_proctable_indexed(
+        procinfo["nodes"], procinfo["executables"],
+        procinfo["placement"], procinfo["cmdidxs"], procinfo["pids"]
     )
-    signal_thread.daemon = True
-    signal_thread.start()
-
-    ping_thread = threading.Thread(target=send_pings, args=(websock,))
-    ping_thread.daemon = True
-    ping_thread.start()
+    mpir.call_MPIR_Breakpoint()
 
 
-def monitor_mpir(ctx, apid):
+def monitor_mpir(ctx, app):
     """ Wait on MPIR variable to fill in proctable """
-    while True:
-        # Look for MPIR debug flag
-        if mpir.get_MPIR_being_debugged():
-            # If proctable is not already filled, use procinfo to fill
-            if not mpir.MPIR_proctable_filled():
-                # Make request to procinfo endpoint
-                with ctx:
-                    resp = request(
-                        "GET", "apis/pals/v1/apps/" + apid + "/procinfo"
-                    )
-                procinfo = resp.json()
-                # Extract MPIR information
-                proctable_elems = []
-                for rank in range(len(procinfo["cmdidxs"])):
-                    hostname = procinfo["nodes"][procinfo["placement"][rank]]
-                    executable = procinfo["executables"][
-                        procinfo["cmdidxs"][rank]]
-                    pid = procinfo["pids"][rank]
-                    proctable_elems.append((hostname, executable, pid))
-                # Call C library to set C MPIR variables
-                mpir.fill_MPIR_proctable(proctable_elems)
-                mpir.call_MPIR_Breakpoint()
-                # Now that MPIR proctable is set, exit the monitoring thread
-                return
-        time.sleep(MPIR_ATTACH_INTERVAL)
+    for interval in mpir_intervals():
+        # Once the proctable is set, exit the monitoring thread
+        if app.check_mpir(ctx):
+            return
+        time.sleep(interval)
 
 
-def spawn_mpir_thread(ctx, apid):
+def spawn_mpir_thread(ctx, app):
     """ Create MPIR watcher thread """
-    mpir_thread = threading.Thread(target=monitor_mpir, args=(ctx, apid))
+    mpir_thread = threading.Thread(target=monitor_mpir, args=(ctx, app))
     mpir_thread.daemon = True
     mpir_thread.start()
 
@@ -311,59 +165,16 @@ def get_exit_code(status):
     return 255
 
 
-def print_output(params, a_file, label):
-    """ Print output from a stdout/stderr RPC to the given file """
-    content = params.get("content")
-    if not content:
-        return
-
-    encoding = params.get("encoding")
-    if encoding == "base64":
-        # Decode and output base64 content
-        click.echo(base64.b64decode(content), nl=False, file=a_file)
-    elif label and "host" in params and "rankid" in params:
-        # Label each line if requested and host/rank available
-        host = params["host"]
-        rankid = int(params["rankid"])
-        for line in content.splitlines():
-            click.echo(f"{host} {rankid:d}: {line}", file=a_file)
-    else:
-        # Otherwise, print without processing
-        click.echo(content, nl=False, file=a_file)
-
-
-def log_rank_exit(rankid, host, status):
-    """ Log a rank exit """
-    if rankid == -1:
-        rank = "shepherd"
-    else:
-        rank = f"rank {rankid:d}"
-
-    extra = ""
-    level = LOG_INFO
-    if os.WIFEXITED(status):
-        action = "exited with code"
-        code = os.WEXITSTATUS(status)
-        if code == 0:
-            level = LOG_RAW
-    elif os.WIFSIGNALED(status):
-        action = "died from signal"
-        code = os.WTERMSIG(status)
-        if os.WCOREDUMP(status):
-            extra = " and dumped core"
-    else:
-        action = "invalid status"
-        code = status
-
-    echo(f"{host}: {rank} {action} {code:d}{extra}", level=level)
-
-
-def write_procinfo_file(result, procinfo_file):
+def write_procinfo_file(result, procinfo_file, procinfo_format="json"):
     """ Dump the procinfo result to the given file """
     try:
-        with open_atomic(procinfo_file) as procinfo_fp:
-            json.dump(result, procinfo_fp)
-    except (IOError, OSError) as err:
+        if procinfo_format == "binary":
+            with open_atomic(procinfo_file, mode="wb") as procinfo_fp:
+                write_procinfo(result, procinfo_fp)
+        else:
+            with open_atomic(procinfo_file) as procinfo_fp:
+                json.dump(result, procinfo_fp)
+    except (IOError, OSError, ValueError) as err:
         echo(
             f"Couldn't write {procinfo_file}: {str(err)}", level=LOG_WARN
         )
@@ -397,27 +208,30 @@ def get_resource_limits(limitnames):
     return limits
 
 
-def connect_websock(apid):
-    # pylint: disable=no-member
-    """ Connect to the application websocket """
-    try:
-        url = make_ws_url(f"apis/pals/v1/apps/{apid}/stdio")
-        headers = get_ws_headers()
-        # TODO: enable SSL verification
-        sslopt = {"cert_reqs": ssl.CERT_NONE}
-        echo(f"Connecting to {url}", level=LOG_DEBUG)
-        return websocket.create_connection(
-            url, header=headers, sslopt=sslopt, enable_multithread=True
-        )
-    except (websocket.WebSocketException, socket.error) as err:
-        raise click.ClickException(f"Connection error: {str(err)}")
-
-
-class PALSApp(object):
+class PALSApp(object):  # pylint: disable=too-many-instance-attributes
     """ Class representing a running PALS application """
 
-    def __init__(self):
+    def __init__(self, stdio_engine=None, output=None, timer=None,
+                 procinfo_format=None):
         """ Initialize this application """
+        if not stdio_engine:
+            stdio_engine = os.environ.get("PALS_STDIO_ENGINE", "threads")
+        if stdio_engine not in STDIO_ENGINES:
+            raise click.ClickException(
+                f"Unknown stdio engine {stdio_engine}, must be one of "
+                f"{', '.join(STDIO_ENGINES)}"
+            )
+        if not procinfo_format:
+            procinfo_format = os.environ.get("PALS_PROCINFO_FORMAT", "json")
+        if procinfo_format not in PROCINFO_FORMATS:
+            raise click.ClickException(
+                f"Unknown procinfo format {procinfo_format}, must be one of "
+                f"{', '.join(PROCINFO_FORMATS)}"
+            )
+        self.stdio_engine = stdio_engine
+        self.procinfo_format = procinfo_format
+        self.procinfo_writer = None
+        self.output = output or OutputSink()
         self.apid = ""
         self.exit_codes = set()
         self.stream_rpcid = str(uuid.uuid4())
@@ -425,21 +239,47 @@ class PALSApp(object):
         self.procinfo_rpcid = str(uuid.uuid4())
         self.complete = False
         self.started = False
+        self.mpir = mpir_wanted()
+        self.mpir_lock = threading.Lock()
+        self.procinfo = None
+        self.next_seq = 0
+        self.stdio = None
+        self.exit_summary = ExitSummary(
+            self.output, os.environ.get("PALS_EXIT_REPORT")
+        )
+        self.timer = timer or PhaseTimer(
+            os.environ.get("PALS_TIMING", "0") != "0",
+            os.environ.get("PALS_TIMING_FILE")
+        )
 
     def launch(
             self, launchreq, transfer=False, label=False, procinfo_file=None
     ):
         """ Launch this application, transfer binaries, and run """
         executables = get_executables(launchreq, transfer)
-
-        # Launch ATP frontend if enabled
-        # returns list of environment variables to set for job
-        (atp_frontend_handle, atp_envlist) = atp.launch_atp_frontend(
-            executables
-        )
+        atp_frontend_handle = self.launch_atp(launchreq, executables)
+        try:
+            self.submit(launchreq, executables, transfer, atp_frontend_handle)
+            return self.run(label, procinfo_file)
+        finally:
+            self.teardown(atp_frontend_handle)
+
+    def launch_atp(self, launchreq, executables):
+        """ Launch the ATP frontend if enabled, adding the environment it
+        needs to the launch request. Returns the frontend handle. """
+        with self.timer.phase("atp_frontend"):
+            (atp_frontend_handle, atp_envlist) = atp.launch_atp_frontend(
+                executables
+            )
         if atp_envlist:
             launchreq["environment"] += atp_envlist
+        return atp_frontend_handle
 
+    def submit(
+            self, launchreq, executables, transfer=False,
+            atp_frontend_handle=None
+    ):
+        """ Send the launch request and transfer executables """
         # Set custom fanout if requested
         if "PALS_FANOUT" in os.environ:
             launchreq["fanout"] = int(os.environ["PALS_FANOUT"])
@@ -448,24 +288,26 @@ class PALSApp(object):
         if "PALS_RPC_TIMEOUT" in os.environ:
             launchreq["rpc_timeout"] = int(os.environ["PALS_RPC_TIMEOUT"])
 
-        try:
-            # Send launch request
+        # Send launch request
+        with self.timer.phase("launch_request"):
             resp = request("POST", "apis/pals/v1/apps", json=launchreq)
             self.apid = resp.json().get("apid")
+        if self.mpir:
             mpir.set_current_apid(self.apid)
-            echo(f"Launched application {self.apid}", level=LOG_INFO)
+        echo(f"Launched application {self.apid}", level=LOG_INFO)
 
-            # Send newly-launched apid to ATP frontend to monitor
-            if atp_frontend_handle:
-                atp.send_launched_apid(atp_frontend_handle, self.apid)
+        # Send newly-launched apid to ATP frontend to monitor
+        if atp_frontend_handle:
+            atp.send_launched_apid(atp_frontend_handle, self.apid)
 
-            # Transfer executables
-            if transfer:
-                for executable in executables:
-                    self.transfer(executable)
+        # Transfer executables
+        if transfer:
+            with self.timer.phase("transfer"):
+                self.transfer_all(executables)
 
-            return self.run(label, procinfo_file)
-        finally:
+    def teardown(self, atp_frontend_handle=None):
+        """ Stop the ATP frontend and delete the application """
+        with self.timer.phase("teardown"):
             # Terminate frontend on error and rethrow exception
             if atp_frontend_handle:
                 atp.terminate_frontend(atp_frontend_handle)
@@ -477,45 +319,170 @@ class PALSApp(object):
                 except BadResponseError:
                     # Ignore 404 errors
                     pass
+        self.timer.report(self.apid)
 
-    def transfer(self, executable):
-        """ Transfer a file to application compute nodes """
+    def transfer_all(self, executables):
+        """ Transfer executables to application compute nodes concurrently """
         try:
-            mode: int = stat.S_IMODE(os.stat(executable).st_mode)
-            params = {
-                "mode": f"0{mode:o}", "name": os.path.basename(executable)
+            sizes = {
+                executable: os.stat(executable).st_size
+                for executable in executables
             }
-            headers = {"Content-Type": "application/octet-stream"}
-            with open(executable, "rb") as a_execfile:
-                resp = request(
-                    "POST",
-                    f"apis/pals/v1/apps/{self.apid}/files",
-                    params=params,
-                    headers=headers,
-                    data=a_execfile, )
-                path = resp.json().get("path")
-                echo(f"Transferred executable to {path}", level=LOG_DEBUG)
+        except OSError as err:
+            raise click.ClickException(
+                f"Couldn't transfer binary: {str(err)}"
+            )
+
+        ctx = click.get_current_context()
+        manifest = None
+        if os.environ.get("PALS_TRANSFER_CHECKSUM", "0") != "0":
+            manifest = get_transfer_manifest(ctx)
+        progress = TransferProgress(sum(sizes.values()))
+
+        def transfer_with_ctx(executable):
+            with ctx:
+                self.transfer(executable, progress, manifest)
+
+        with concurrent.futures.ThreadPoolExecutor(TRANSFER_WORKERS) as pool:
+            futures = [
+                pool.submit(transfer_with_ctx, executable)
+                for executable in sorted(sizes, key=sizes.get, reverse=True)
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+                if manifest is not None:
+                    manifest.save()
+
+    def has_file(self, name, digest):
+        """ Ask whether the service already has a file with this checksum,
+        e.g. from an earlier launch. If it does, the service makes the file
+        available to this application and it doesn't need to be sent. """
+        try:
+            request(
+                "GET", f"apis/pals/v1/apps/{self.apid}/files/{name}",
+                params={"sha256": digest}
+            )
+        except BadResponseError as err:
+            if err.response.status_code in (404, 405, 501):
+                return False
+            raise
+        return True
+
+    def transfer(self, executable, progress=None, manifest=None):
+        """ Transfer a file to application compute nodes. If a manifest is
+        given, files the service already has aren't sent again. """
+        try:
+            stat_result = os.stat(executable)
+            mode: int = stat.S_IMODE(stat_result.st_mode)
+            name = os.path.basename(executable)
+            params = {"mode": f"0{mode:o}", "name": name}
+
+            # Skip the upload if the service already has this file
+            if manifest is not None:
+                params["sha256"] = manifest.digest(executable, stat_result)
+                if self.has_file(name, params["sha256"]):
+                    echo(
+                        f"Skipped transfer of unchanged executable {name}",
+                        level=LOG_DEBUG
+                    )
+                    if progress:
+                        progress.update(stat_result.st_size)
+                    return
+
+            try:
+                resp = self.upload(
+                    executable, params, stat_result.st_size, progress
+                )
+            except BadResponseError as err:
+                # Send it again uncompressed if compression was refused
+                if err.response.status_code != 415 or \
+                        not err.response.request.headers.get(
+                            "Content-Encoding"
+                        ):
+                    raise
+                resp = self.upload(executable, params, stat_result.st_size)
+            path = resp.json().get("path")
+            echo(f"Transferred executable to {path}", level=LOG_DEBUG)
         except (OSError, IOError) as err:
             raise click.ClickException(
                 f"Couldn't transfer binary: {str(err)}"
             )
 
+    def upload(self, executable, params, size, progress=None):
+        """ Stream a file to the application's files. It is compressed on
+        the fly when core.compression is set. """
+        headers = {"Content-Type": "application/octet-stream"}
+        with open(executable, "rb") as a_execfile:
+            return request(
+                "POST",
+                f"apis/pals/v1/apps/{self.apid}/files",
+                params=params,
+                headers=headers,
+                data=TransferReader(a_execfile, size, progress),
+            )
+
+    def get_stream_params(self):
+        """ Get stream RPC parameters. After a reconnect, ask the service to
+        resume from the first sequenced notification not yet received. """
+        if self.next_seq:
+            return {"offset": self.next_seq}
+        return {}
+
+    def handle_message(self, websock, message, label=False,
+                       procinfo_file=None):
+        """ Handle a received websocket message, which is either one RPC or
+        a batch (JSON array) of them. Raises ValueError if it can't be
+        decoded. """
+        rpcs = json.loads(message)
+        if isinstance(rpcs, dict):
+            rpcs = (rpcs,)
+        elif not isinstance(rpcs, list):
+            raise ValueError(f"Unexpected message type {type(rpcs).__name__}")
+
+        log_rpcs = is_echoed(LOG_RAW)
+        for rpc in rpcs:
+            if not isinstance(rpc, dict):
+                raise ValueError(f"Unexpected RPC type {type(rpc).__name__}")
+            if log_rpcs:
+                echo(f"Received RPC {rpc}", level=LOG_RAW)
+            self.handle_rpc(websock, rpc, label, procinfo_file)
+
     def handle_rpc(self, websock, rpc, label=False, procinfo_file=None):
-        """ Handle a received RPC. Return True if complete. """
+        """ Handle a received RPC """
         # Parse the RPC
         method = rpc.get("method")
         params = rpc.get("params", {})
         errmsg = rpc.get("error", {}).get("message")
-        rpcid = rpc.get("id")
-        result = rpc.get("result")
 
-        # Handle stdout notification
-        if method == "stdout":
-            print_output(params, sys.stdout, label)
+        # Skip notifications replayed after a reconnect
+        seq = params.get("seq")
+        if seq is not None:
+            if seq < self.next_seq:
+                return
+            self.next_seq = seq + 1
+
+        if method:
+            self.handle_notification(method, params, label)
 
-        # Handle stderr notification
-        elif method == "stderr":
-            print_output(params, sys.stderr, label)
+        # Handle error responses
+        elif errmsg:
+            raise click.ClickException(errmsg)
+
+        else:
+            self.handle_response(
+                websock, rpc.get("id"), rpc.get("result"), procinfo_file
+            )
+
+    def handle_notification(self, method, params, label=False):
+        """ Handle a received notification """
+        # Handle stdout notification
+        if method in ("stdout", "stderr"):
+            self.timer.mark("first_output")
+            self.output.write(method, params, label)
 
         # Handle exit notification
         elif method == "exit":
@@ -523,78 +490,200 @@ class PALSApp(object):
             host = params.get("host", "unknown")
             status = int(params.get("status", 0))
             self.exit_codes.add(get_exit_code(status))
-            log_rank_exit(rankid, host, status)
+            self.output.end_rank(host, rankid)
+            self.exit_summary.add(rankid, host, status)
 
         # Handle complete notification
         elif method == "complete":
+            self.timer.mark("complete")
             self.complete = True
 
         # Handle unknown RPC method
-        elif method:
+        else:
             echo(f"Received unknown {method} RPC", level=LOG_WARN)
 
-        # Handle error responses
-        elif errmsg:
-            raise click.ClickException(errmsg)
-
+    def handle_response(self, websock, rpcid, result, procinfo_file=None):
+        """ Handle a received RPC response """
         # Handle stream response
-        elif rpcid == self.stream_rpcid:
+        if rpcid == self.stream_rpcid:
+            self.timer.mark("streaming")
             if not self.started:
-                send_rpc(websock, "start", self.start_rpcid)
+                if self.stdio:
+                    # Don't block the event loop on a full send buffer
+                    self.stdio.send("start", self.start_rpcid)
+                else:
+                    send_rpc(websock, "start", self.start_rpcid)
 
         # Handle start response
         elif rpcid == self.start_rpcid:
+            self.timer.mark("started")
             self.started = True
-            if procinfo_file:
-                # Add delay before procinfo if requested
-                # This is needed until the startup barrier works correctly
-                if "PALS_PROCINFO_DELAY" in os.environ:
-                    time.sleep(float(os.environ["PALS_PROCINFO_DELAY"]))
-                send_rpc(websock, "procinfo", self.procinfo_rpcid)
+            # Fetch procinfo ahead of time so a debugger attaches quickly
+            if procinfo_file or self.mpir:
+                self.request_procinfo(websock)
 
         # Handle procinfo response
-        elif rpcid == self.procinfo_rpcid and procinfo_file:
-            write_procinfo_file(result, procinfo_file)
+        elif rpcid == self.procinfo_rpcid:
+            self.timer.mark("procinfo")
+            self.procinfo = result
+            if procinfo_file:
+                self.save_procinfo(procinfo_file)
+            if self.mpir:
+                self.check_mpir()
+
+    def request_procinfo(self, websock):
+        """ Request procinfo, after PALS_PROCINFO_DELAY seconds if set. The
+        delay is needed until the startup barrier works correctly. """
+        delay = float(os.environ.get("PALS_PROCINFO_DELAY", 0))
+        stdio = self.stdio
+        if stdio:
+            # Other applications may share the event loop, don't block it
+            async def send_later():
+                await asyncio.sleep(delay)
+                stdio.send("procinfo", self.procinfo_rpcid)
+
+            stdio.spawn(send_later())
+            return
+        if delay:
+            time.sleep(delay)
+        send_rpc(websock, "procinfo", self.procinfo_rpcid)
+
+    def save_procinfo(self, procinfo_file):
+        """ Write the procinfo file from another thread, so a large one
+        doesn't hold up application output """
+        ctx = click.get_current_context(silent=True)
+        procinfo = self.procinfo
+        if self.procinfo_writer:
+            self.procinfo_writer.join()
+
+        def write_with_ctx():
+            with ctx or contextlib.nullcontext():
+                write_procinfo_file(
+                    procinfo, procinfo_file, self.procinfo_format
+                )
+
+        self.procinfo_writer = threading.Thread(target=write_with_ctx)
+        self.procinfo_writer.start()
+
+    def check_mpir(self, ctx=None):
+        """ Fill in the MPIR proctable if a debugger is waiting for it.
+        Return True once it's been filled in. """
+        with self.mpir_lock:
+            if not mpir.get_MPIR_being_debugged():
+                return False
+            if not mpir.MPIR_proctable_filled():
+                try:
+                    attach_mpir(ctx, self.apid, self.procinfo)
+                except Exception as err:  # pylint: disable=broad-except
+                    echo(f"MPIR attach failed: {str(err)}", level=LOG_WARN)
+            return True
 
     def run(self, label=False, procinfo_file=None):
         """ Run this application """
+        try:
+            with self.timer.phase("run"):
+                if self.stdio_engine == "asyncio":
+                    StdioLoop(self, label, procinfo_file).run()
+                else:
+                    self.run_threads(label, procinfo_file)
+        finally:
+            self.finish()
 
-        connected = False
-        spawn_mpir_thread(click.get_current_context(), self.apid)
+        return self.exit_codes
 
+    def finish(self):
+        """ Write out the remaining output and exits once the application
+        is done """
+        try:
+            self.output.close()
+        finally:
+            self.exit_summary.close()
+
+        # Make sure the procinfo file is there once the launcher exits
+        if self.procinfo_writer:
+            self.procinfo_writer.join()
+
+        if self.mpir:
+            # Wait for an attach still running on the stdio loop's executor
+            with self.mpir_lock:
+                mpir.free_MPIR_proctable()
+
+    def run_threads(self, label=False, procinfo_file=None):
+        """ Handle application stdio with a thread per concern """
+        if self.mpir:
+            spawn_mpir_thread(click.get_current_context(), self)
+
+        # Spawn threads to handle signals, stdin, and pings. They send over
+        # whichever connection is current, so they outlive each one.
+        slot = WebSocketSlot()
+        spawn_threads(slot)
+        try:
+            self.receive_threads(slot, label, procinfo_file)
+        finally:
+            slot.close()
+
+    def receive_threads(self, slot, label=False, procinfo_file=None):
+        """ Receive and handle application messages for the threads
+        engine, reconnecting as needed """
+        connected = False
+        websock = None
+        # Waits before each reconnect attempt while reconnecting
+        delays = None
         while not self.complete:
             try:
                 if not connected:
+                    if delays is not None:
+                        delay = next(delays, None)
+                        if delay is None:
+                            raise click.ClickException(
+                                "Couldn't reconnect to the application"
+                            )
+                        time.sleep(delay)
+
                     # Connect to stdio websocket endpoint
-                    websock = connect_websock(self.apid)
+                    with self.timer.phase("connect"):
+                        websock = connect_websock(
+                            self.apid, raise_errors=delays is not None
+                        )
+                    poller = select.poll()
+                    poller.register(websock.sock.fileno(), select.POLLIN)
                     connected = True
-
-                    # Spawn threads to handle signals, stdin, and pings
-                    spawn_threads(websock)
+                    slot.connect(websock)
 
                     # Send the stream RPC to start things off
-                    send_rpc(websock, "stream", self.stream_rpcid)
+                    send_rpc(
+                        websock, "stream", self.stream_rpcid,
+                        **self.get_stream_params()
+                    )
 
-                # Read an RPC off the socket
-                rpc = json.loads(websock.recv())
-                echo(f"Received RPC {rpc}", level=LOG_RAW)
+                # Write out buffered output before waiting for more
+                if not websock_pending(websock, poller):
+                    self.output.flush()
 
-                # Handle the RPC
-                self.handle_rpc(websock, rpc, label, procinfo_file)
+                # Read a message off the socket
+                message = websock.recv()
+                delays = None
 
-            except websocket.WebSocketException as err:
-                echo(
-                    f"Lost application connection ({str(err)}), reconnecting",
-                    level=LOG_WARN, )
-                websock.close()
+                # Handle the RPC(s) it holds
+                self.handle_message(websock, message, label, procinfo_file)
+
+            except (websocket.WebSocketException, socket.error) as err:
+                # pylint: disable=no-member
+                if isinstance(err, socket.error) and err.errno == errno.EINTR:
+                    continue
+                if websock:
+                    slot.disconnect(websock)
+                    websock.close()
                 connected = False
-            except socket.error as err:  # pylint: disable=no-member
-                if err.errno != errno.EINTR:
+                if delays is None:
+                    self.output.flush()
                     echo(
-                        f"Lost application connection ({str(err)}), reconnecting",
-                        level=LOG_WARN, )
-                    websock.close()
-                    connected = False
+                        f"Lost application connection ({str(err)}), "
+                        "reconnecting", level=LOG_WARN
+                    )
+                    delays = reconnect_delays()
+                else:
+                    echo(f"Couldn't reconnect ({str(err)})", level=LOG_DEBUG)
             except ValueError as err:
                 echo(
                     f"Error decoding application message: {str(err)}",
@@ -603,6 +692,3 @@ class PALSApp(object):
 
         # Clean up after ourselves
         websock.close()
-        mpir.free_MPIR_proctable()
-
-        return self.exit_codes
@@ -0,0 +1,208 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+""" procinfo.py - Compact binary procinfo files.
+
+Written as JSON, the procinfo of a job with millions of ranks is a lot of
+text to build and parse. It can instead be written in this columnar form,
+which tools can map into memory with ProcinfoFile rather than parse. All
+integers are little-endian, and each section starts on an 8 byte boundary:
+
+    header      see HEADER
+    pids        int32 per rank
+    placement   uint32 per rank, an index into nodes
+    cmdidxs     uint32 per rank, an index into executables
+    offsets     uint64 per string plus one, where each string starts in the
+                string table (the last is the table's size)
+    strings     UTF-8 string table: the apid, the nodes, then the executables
+"""
+import array
+import collections
+import itertools
+import json
+import mmap
+import struct
+import sys
+
+MAGIC = b"PALSPROC"
+VERSION = 1
+# magic, version, executable count, rank count, node count, string table size
+HEADER = struct.Struct("<8sIIQQQ")
+ALIGNMENT = 8
+
+# The string table, split up
+Strings = collections.namedtuple("Strings", ["apid", "nodes", "executables"])
+
+
+def _write_section(fileobj, data):
+    """ Write a section and pad it to the alignment """
+    if isinstance(data, array.array) and sys.byteorder != "little":
+        data = array.array(data.typecode, data)
+        data.byteswap()
+    fileobj.write(data)
+    fileobj.write(bytes(-len(memoryview(data).cast("B")) % ALIGNMENT))
+
+
+def write_procinfo(procinfo, fileobj):
+    """ Write a procinfo result, as returned by the service, to a binary
+    file. Raises ValueError if the per-rank lists don't all match. """
+    nodes = procinfo.get("nodes", [])
+    executables = procinfo.get("executables", [])
+    pids = array.array("i", procinfo.get("pids", []))
+    nranks = len(pids)
+    placement = array.array("I", procinfo.get("placement", []))
+    cmdidxs = procinfo.get("cmdidxs")
+    cmdidxs = array.array("I", [0]) * nranks if cmdidxs is None else \
+        array.array("I", cmdidxs)
+    if len(placement) != nranks or len(cmdidxs) != nranks:
+        raise ValueError("procinfo lists have different lengths")
+
+    strings = [
+        string.encode("utf-8")
+        for string in itertools.chain(
+            [procinfo.get("apid", "")], nodes, executables
+        )
+    ]
+    offsets = array.array(
+        "Q", itertools.accumulate(map(len, strings), initial=0)
+    )
+    strtab = b"".join(strings)
+
+    fileobj.write(HEADER.pack(
+        MAGIC, VERSION, len(executables), nranks, len(nodes), len(strtab)
+    ))
+    for section in (pids, placement, cmdidxs, offsets, strtab):
+        _write_section(fileobj, section)
+
+
+class ProcinfoFile(object):
+    """ A binary procinfo file mapped into memory. pids, placement and
+    cmdidxs are read-only sequences backed by the file, so ranks are only
+    read when they're used. Close the file (or use it as a context manager)
+    once done with them. """
+
+    def __init__(self, path):
+        with open(path, "rb") as procinfo_fp:
+            self._mmap = mmap.mmap(
+                procinfo_fp.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        self._views = [memoryview(self._mmap)]
+        self._offset = HEADER.size
+        try:
+            self._load()
+        except ValueError:
+            self.close()
+            raise
+
+    def _load(self):
+        if len(self._mmap) < HEADER.size:
+            raise ValueError("Not a procinfo file")
+        magic, version, nexecutables, nranks, nnodes, strtab_size = \
+            HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError("Not a procinfo file")
+        if version != VERSION:
+            raise ValueError(f"Unsupported procinfo file version {version}")
+
+        self.pids = self._section("i", nranks)
+        self.placement = self._section("I", nranks)
+        self.cmdidxs = self._section("I", nranks)
+        offsets = self._section("Q", 1 + nnodes + nexecutables + 1).tolist()
+        strtab = bytes(self._section("B", strtab_size))
+        if offsets[-1] != strtab_size:
+            raise ValueError("Corrupt procinfo string table")
+
+        strings = [
+            strtab[start:end].decode("utf-8")
+            for start, end in zip(offsets, offsets[1:])
+        ]
+        self._strings = Strings(
+            strings[0], strings[1:1 + nnodes], strings[1 + nnodes:]
+        )
+
+    def _section(self, typecode, count):
+        """ Get the next section, count items of typecode """
+        itemsize = struct.calcsize(typecode)
+        end = self._offset + count * itemsize
+        if end > len(self._mmap):
+            raise ValueError("Truncated procinfo file")
+        section = self._views[0][self._offset:end].cast(typecode)
+        self._views.append(section)
+        self._offset = end + -end % ALIGNMENT
+        if itemsize > 1 and sys.byteorder != "little":
+            section = array.array(typecode, section)
+            section.byteswap()
+        return section
+
+    @property
+    def apid(self):
+        """ The application ID """
+        return self._strings.apid
+
+    @property
+    def nodes(self):
+        """ The node names, indexed by placement """
+        return self._strings.nodes
+
+    @property
+    def executables(self):
+        """ The executable paths, indexed by cmdidxs """
+        return self._strings.executables
+
+    def __len__(self):
+        return len(self.pids)
+
+    def to_dict(self):
+        """ Get the procinfo as the service returned it """
+        return {
+            "apid": self.apid,
+            "pids": self.pids.tolist(),
+            "placement": self.placement.tolist(),
+            "cmdidxs": self.cmdidxs.tolist(),
+            "nodes": list(self.nodes),
+            "executables": list(self.executables),
+        }
+
+    def close(self):
+        """ Unmap the file. The rank sequences can't be used after this. """
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def read_procinfo(path):
+    """ Read a procinfo file written in either format, as a dict """
+    with open(path, "rb") as procinfo_fp:
+        is_binary = procinfo_fp.read(len(MAGIC)) == MAGIC
+    if is_binary:
+        with ProcinfoFile(path) as procinfo:
+            return procinfo.to_dict()
+    with open(path, encoding="utf-8") as procinfo_fp:
+        return json.load(procinfo_fp)
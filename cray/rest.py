@@ -24,7 +24,10 @@
 """Functions for making REST Calls. """
 # pylint: disable=fixme
 
+import gzip
+import json
 import warnings
+import zlib
 
 import requests
 import click
@@ -45,6 +48,15 @@ from cray.errors import UnauthorizedError
 from cray.utils import get_hostname
 from cray.utils import get_tenant
 
+# Request body encodings that can be set with core.compression
+COMPRESSIONS = ('gzip', 'zstd')
+COMPRESS_MIN_SIZE = 1 << 10  # Smaller bodies are sent as is
+COMPRESS_CHUNK_SIZE = 1 << 20  # Read size when compressing file bodies
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_ZSTD_LEVEL = 3
+# Hostnames that rejected a compressed body, see request()
+_NO_COMPRESSION = set()
+
 
 def make_url(route, url=None, default_scheme='https', ctx=None):
     """Normalize url parts and join them with a slash."""
@@ -63,6 +75,108 @@ def make_url(route, url=None, default_scheme='https', ctx=None):
     return urllib.parse.urlunsplit((scheme, netloc, path, query, fragment))
 
 
+def get_compression(ctx=None):
+    """ Get the configured request body encoding, None if compression is off
+    or the server has already rejected a compressed body """
+    ctx = ctx or click.get_current_context()
+    config = ctx.obj.get('config') or {}
+    encoding = config.get('core.compression')
+    if not encoding or encoding == 'none':
+        return None
+    if encoding not in COMPRESSIONS:
+        raise click.UsageError(
+            f'Invalid core.compression {encoding}, expected one of: '
+            f'{", ".join(COMPRESSIONS)}, none'
+        )
+    if get_hostname(ctx=ctx) in _NO_COMPRESSION:
+        return None
+    return encoding
+
+
+def _zstandard():
+    # pylint: disable=import-outside-toplevel
+    try:
+        import zstandard
+    except ImportError:
+        # pylint: disable=raise-missing-from
+        raise click.UsageError(
+            'zstd compression requires the zstandard package'
+        )
+    return zstandard
+
+
+def compress(data, encoding):
+    """ Compress bytes with the given encoding """
+    if encoding == 'zstd':
+        return _zstandard().ZstdCompressor(COMPRESS_ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+def compress_stream(a_file, encoding):
+    """ Compress a file-like object with the given encoding, yielding
+    compressed chunks as it is read """
+    if encoding == 'zstd':
+        compressor = _zstandard().ZstdCompressor(
+            COMPRESS_ZSTD_LEVEL
+        ).compressobj()
+    else:
+        compressor = zlib.compressobj(
+            COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
+    for chunk in iter(lambda: a_file.read(COMPRESS_CHUNK_SIZE), b''):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _compress_body(opts, encoding):
+    """ Replace the json or data body in opts with a compressed one. Return
+    whether it was compressed, and the original body if it can be sent
+    again uncompressed. """
+    headers = dict(opts.get(HEADERS_ORIGIN) or {})
+    if 'json' in opts:
+        body = json.dumps(opts.pop('json')).encode('utf-8')
+        headers.setdefault('Content-Type', 'application/json')
+        opts['data'] = body
+    body = opts.get('data')
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    if isinstance(body, bytes):
+        if len(body) < COMPRESS_MIN_SIZE:
+            opts[HEADERS_ORIGIN] = headers
+            return False, None
+        opts['data'] = compress(body, encoding)
+    elif hasattr(body, 'read'):
+        opts['data'] = compress_stream(body, encoding)
+        body = None
+    else:
+        return False, None
+    headers['Content-Encoding'] = encoding
+    opts[HEADERS_ORIGIN] = headers
+    return True, body
+
+
+def _send(requester, method, url, opts, ctx):
+    """ Send a request, compressing the body when configured. A server that
+    rejects the compressed body is sent it again uncompressed, if it wasn't
+    streamed from a file. """
+    compressed, uncompressed = False, None
+    if opts.pop('compress', True) and ('json' in opts or 'data' in opts):
+        encoding = get_compression(ctx)
+        if encoding:
+            compressed, uncompressed = _compress_body(opts, encoding)
+    response = requester.request(method, url, **opts)
+    if compressed and response.status_code == 415:
+        # Don't compress for this server again
+        _NO_COMPRESSION.add(get_hostname(ctx=ctx))
+        if uncompressed is not None:
+            del opts[HEADERS_ORIGIN]['Content-Encoding']
+            opts['data'] = uncompressed
+            response = requester.request(method, url, **opts)
+    return response
+
+
 def _default_cb(response):
     """ Default callback in case the user doesn't pass one"""
     return response
@@ -73,19 +187,20 @@ def _log_request_error(err, ctx):
 
 
 def request(method, route, callback=None, **kwargs):
-    """ This is our REST caller. Will call endpoint and return response """
+    """ This is our REST caller. Will call endpoint and return response.
+    Request bodies are compressed when core.compression is set, unless
+    compress=False is passed. """
     # pylint: disable=unused-argument
+    # pylint: disable=cyclic-import,import-outside-toplevel
     # NOTE: This has not been tested against a Shasta API Gateway.
+    from cray.auth import get_auth
     if callback is None:
         callback = _default_cb
     ctx = click.get_current_context()
     requester = requests
-    session = None
-    auth = ctx.obj['auth']
-    if auth:
-        session = auth.session
-        if session:
-            requester = session
+    auth = get_auth(ctx)
+    if auth and auth.session:
+        requester = auth.session
     # TODO Get Real Certs
     kwargs.setdefault('verify', False)
 
@@ -101,7 +216,7 @@ def request(method, route, callback=None, **kwargs):
         # TODO: Find solution for this.
         with warnings.catch_warnings():
             warnings.filterwarnings("ignore", category=InsecureRequestWarning)
-            response = requester.request(method, url, **opts)
+            response = _send(requester, method, url, opts, ctx)
             if not response.ok:
                 _log_request_error(response.text, ctx)
                 raise BadResponseError(response, ctx=ctx)
@@ -0,0 +1,869 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+""" stdio.py - Application stdio, signal and keepalive handling for PALS.
+
+The threads engine handles each concern on its own thread, and the asyncio
+engine (StdioLoop) handles them all on one event loop. """
+# pylint: disable=fixme
+import asyncio
+import base64
+import codecs
+import collections
+import errno
+import fcntl
+import json
+import os
+import queue
+import random
+import signal
+import socket
+import ssl
+import sys
+import threading
+import time
+import uuid
+import zlib
+import websocket
+import click
+from six.moves import urllib
+from websocket import ABNF
+
+from cray import mpir
+from cray.auth import get_auth
+from cray.echo import echo
+from cray.echo import LOG_DEBUG
+from cray.echo import LOG_RAW
+from cray.echo import LOG_WARN
+from cray.utils import get_hostname
+
+SIGNAL_RECEIVED = 0  # Last signal number received
+PING_INTERVAL = 20  # WebSocket ping interval
+MPIR_ATTACH_INTERVAL = 1  # Longest wait between MPIR attach checks
+MPIR_ATTACH_MIN_INTERVAL = 0.01  # First wait between MPIR attach checks
+RECONNECT_MIN_INTERVAL = 0.1  # Longest wait before the first reconnect
+RECONNECT_MAX_INTERVAL = 10  # Longest wait between reconnect attempts
+RECONNECT_ATTEMPTS = 20  # Reconnect attempts before giving up
+RECONNECT_TIMEOUT = 120  # Seconds spent reconnecting before giving up
+STDIN_READ_SIZE = 1 << 16  # Default stdin read size
+WS_DEFLATE_OFFER = "permessage-deflate; client_max_window_bits"
+WS_DEFLATE_TAIL = b"\x00\x00\xff\xff"  # Removed from each deflated message
+
+
+def make_ws_url(route: str, url: str = '') -> urllib.parse.ParseResult:
+    """ Make a websocket URL (using wss scheme). Based on make_url in rest.py """
+    # If no URL given, use the configured hostname
+    if not url:
+        url = get_hostname()
+
+    # If no protocol/scheme is set, urllib will confuse anything before the
+    # port number as the scheme, and set the path to the port. To prevent
+    # this ensure that `//` is at the beginning of the string if none is
+    # set, this way urllib can work without us paying concession to a
+    # protocol (e.g. // is agnostic to http|https|etc).
+    if '//' not in url:
+        url = f'//{url}'
+
+    # Split into components
+    scheme, netloc, path, query, fragment = urllib.parse.urlsplit(url)
+
+    # Override scheme with secure WebSocket protocol
+    scheme = "wss"
+
+    # If URL didn't start with a scheme, set netloc to the first part of the path
+    if not netloc and path:
+        netloc, _, path = path.partition("/")
+
+    # Append route to path
+    path = urllib.parse.urljoin(path, route)
+
+    # Join everything back together
+    return urllib.parse.urlunsplit((scheme, netloc, path, query, fragment))
+
+
+def get_ws_headers() -> list:
+    """ Get a list of HTTP headers to send in WebSocket request """
+    auth = get_auth()
+
+    # If we have an access token in the session, use it
+    if auth and auth.session and auth.session.access_token:
+        return ["Authorization: Bearer " + auth.session.access_token]
+
+    return []
+
+
+def signal_handler(signum, *_):
+    # pylint: disable=global-statement
+    """ Signal handler that stores the signal value in a global """
+    global SIGNAL_RECEIVED
+    SIGNAL_RECEIVED = signum
+
+
+def setup_signals():
+    # pylint: disable=c-extension-no-member
+    """ Set up signal handlers and return a signal wakeup read fd """
+    # Create a pipe that we can use to determine when we've got a signal
+    sig_read, sig_write = os.pipe()
+
+    # Make the write end non-blocking (required for set_wakeup_fd)
+    flags = fcntl.fcntl(sig_write, fcntl.F_GETFL)
+    fcntl.fcntl(sig_write, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    signal.set_wakeup_fd(sig_write)
+
+    # Set up signal handlers
+    for signum in [signal.SIGHUP, signal.SIGINT, signal.SIGQUIT,
+                   signal.SIGABRT, signal.SIGALRM, signal.SIGTERM,
+                   signal.SIGUSR1,
+                   signal.SIGUSR2, ]:
+        signal.signal(signum, signal_handler)
+
+    # Ignore SIGTTIN so we don't stop in the background
+    signal.signal(signal.SIGTTIN, signal.SIG_IGN)
+
+    return sig_read
+
+
+def get_rpc(method, rpcid=None, **params):
+    """ Create a JSONRPC request """
+    rpc = {"jsonrpc": "2.0", "method": method}
+    if params:
+        rpc["params"] = params
+    if rpcid:
+        rpc["id"] = rpcid
+    return json.dumps(rpc)
+
+
+def send_rpc(websock, method, reqid=None, **params):
+    """ Send an RPC over the socket """
+    req = get_rpc(method, reqid, **params)
+    echo(f"Sending RPC {req}", level=LOG_RAW)
+    websock.send(req)
+
+
+def reconnect_delay(attempt):
+    """ Get a random wait before a reconnect attempt (counting from 0). The
+    longest wait doubles with each attempt up to RECONNECT_MAX_INTERVAL, and
+    the jitter keeps many launchers from reconnecting all at once. """
+    longest = RECONNECT_MIN_INTERVAL * 2 ** min(attempt, 16)
+    return random.uniform(0, min(longest, RECONNECT_MAX_INTERVAL))
+
+
+def reconnect_delays():
+    """ Generate the waits before each reconnect attempt, stopping after
+    RECONNECT_ATTEMPTS attempts or RECONNECT_TIMEOUT seconds """
+    deadline = time.monotonic() + RECONNECT_TIMEOUT
+    for attempt in range(RECONNECT_ATTEMPTS):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        yield min(reconnect_delay(attempt), remaining)
+
+
+def stdin_read_size():
+    """ Get the stdin read size, see PALS_STDIN_READ_SIZE """
+    try:
+        return max(1, int(os.environ["PALS_STDIN_READ_SIZE"]))
+    except (KeyError, ValueError):
+        return STDIN_READ_SIZE
+
+
+class StdinEncoder(object):
+    """ Send stdin content to the application. UTF-8 is decoded
+    incrementally, so characters split between reads arrive whole. Once
+    content turns out not to be UTF-8, it and everything after it is sent
+    as base64. With binary set (see PALS_STDIN_BINARY), content is sent
+    as is in binary websocket frames instead. """
+
+    def __init__(self, binary=None):
+        if binary is None:
+            binary = os.environ.get("PALS_STDIN_BINARY", "0") != "0"
+        self.binary = binary
+        self.text = True
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        # Binary frames and stdin RPC parameters waiting to be sent
+        self.pending = collections.deque()
+
+    def encode(self, content, final=False):
+        """ Queue a chunk of stdin content to be sent """
+        if self.binary:
+            if content:
+                self.pending.append(content)
+            return
+
+        if self.text:
+            held = self.decoder.getstate()[0]
+            try:
+                text = self.decoder.decode(content, final)
+                if text:
+                    self.pending.append({"content": text, "encoding": "UTF-8"})
+                return
+            except UnicodeError:
+                # Send what the decoder was holding on to as well
+                self.text = False
+                content = held + content
+
+        if content:
+            text = base64.b64encode(content).decode("ascii")
+            self.pending.append({"content": text, "encoding": "base64"})
+
+    def flush(self, websock):
+        """ Send queued content. Content only leaves the queue once it has
+        been sent, so after a failed send it can go on a new connection. """
+        while self.pending:
+            message = self.pending[0]
+            if isinstance(message, bytes):
+                websock.send_binary(message)
+            else:
+                send_rpc(websock, "stdin", **message)
+            self.pending.popleft()
+
+    def send(self, websock, content, final=False):
+        """ Send a chunk of stdin content """
+        self.encode(content, final)
+        self.flush(websock)
+
+    def finish(self):
+        """ Queue any content held back and then EOF """
+        self.encode(b"", final=True)
+        self.pending.append({"eof": True})
+
+    def close(self, websock):
+        """ Send any content held back and then EOF """
+        self.finish()
+        self.flush(websock)
+
+
+def forward_stdin(websock, stdin=sys.stdin):
+    """ Read stdin content and write to application. Sends block while the
+    socket's send buffer is full, so stdin is only read as fast as the
+    application takes it. """
+    encoder = StdinEncoder()
+    read_size = stdin_read_size()
+    try:
+        while True:
+            try:
+                # Wait for content on stdin
+                content = os.read(stdin.fileno(), read_size)
+            except OSError:
+                # I/O error, send EOF
+                content = b""
+
+            # Empty read signifies EOF
+            if not content:
+                encoder.close(websock)
+                break
+
+            encoder.send(websock, content)
+    except websocket.WebSocketException:
+        pass
+
+
+def forward_signals(websock, sig_pipe):
+    """ Forward signals to the application """
+    try:
+        while True:
+            # Block until a signal arrives
+            os.read(sig_pipe, 4096)
+
+            # Send it to the app
+            send_rpc(
+                websock, "signal", str(uuid.uuid4()), signum=SIGNAL_RECEIVED
+            )
+    except (OSError, websocket.WebSocketException):
+        pass
+
+
+def send_pings(websock):
+    """ Avoid connection drops by sending periodic pings """
+    try:
+        while True:
+            time.sleep(PING_INTERVAL)
+            echo("Sending keepalive ping", level=LOG_RAW)
+            websock.ping()
+    except websocket.WebSocketException:
+        pass
+
+
+class WebSocketSlot(object):
+    """ Stand-in for the application websocket that the threads engine's
+    stdin, signal and ping threads send through, so they can keep going
+    across reconnects. Sends go over the current connection. While there
+    isn't one they wait for the next, and a send that failed is made again
+    on it. """
+
+    def __init__(self):
+        self.websock = None
+        self.closed = False
+        self.changed = threading.Condition()
+
+    def connect(self, websock):
+        """ Send over a new connection from now on """
+        with self.changed:
+            self.websock = websock
+            self.changed.notify_all()
+
+    def disconnect(self, websock):
+        """ Stop sending over a lost connection, until the next connect """
+        with self.changed:
+            if self.websock is websock:
+                self.websock = None
+
+    def close(self):
+        """ Stop sending for good. Waiting sends raise. """
+        with self.changed:
+            self.websock = None
+            self.closed = True
+            self.changed.notify_all()
+
+    def call(self, method, *args):
+        """ Call a websocket send method on the current connection """
+        while True:
+            with self.changed:
+                while self.websock is None and not self.closed:
+                    self.changed.wait()
+                if self.closed:
+                    raise websocket.WebSocketConnectionClosedException(
+                        "Application connection closed"
+                    )
+                websock = self.websock
+            try:
+                return getattr(websock, method)(*args)
+            except (websocket.WebSocketException, socket.error):
+                self.disconnect(websock)
+                # Make sure the receiving thread notices and reconnects
+                sock = websock.sock
+                if sock:
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+    def send(self, data):
+        """ Send a text message """
+        return self.call("send", data)
+
+    def send_binary(self, data):
+        """ Send a binary message """
+        return self.call("send_binary", data)
+
+    def ping(self):
+        """ Send a ping """
+        return self.call("ping")
+
+
+def spawn_threads(websock):
+    """ Spawn threads to handle stdin, signals, and pings. Given a
+    WebSocketSlot, they carry on across reconnects. """
+    sig_read = setup_signals()
+
+    stdin_thread = threading.Thread(
+        target=forward_stdin, args=(websock, sys.stdin)
+    )
+    stdin_thread.daemon = True
+    stdin_thread.start()
+
+    signal_thread = threading.Thread(
+        target=forward_signals, args=(websock, sig_read)
+    )
+    signal_thread.daemon = True
+    signal_thread.start()
+
+    ping_thread = threading.Thread(target=send_pings, args=(websock,))
+    ping_thread.daemon = True
+    ping_thread.start()
+
+
+def mpir_intervals():
+    """ Generate waits between MPIR attach checks, doubling from
+    MPIR_ATTACH_MIN_INTERVAL up to MPIR_ATTACH_INTERVAL """
+    interval = MPIR_ATTACH_MIN_INTERVAL
+    while True:
+        yield interval
+        interval = min(interval * 2, MPIR_ATTACH_INTERVAL)
+
+
+class DeflateFrameBuffer(websocket.frame_buffer):
+    """ Frame reader that accepts the RSV1 bit once permessage-deflate is
+    in use, and keeps it for DeflateWebSocket to check """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.header = None
+        self.deflate = False
+        self.rsv1 = 0
+
+    def recv_header(self):
+        super().recv_header()
+        if self.deflate:
+            # Clear the bit so the frame passes validation
+            fin, self.rsv1, rsv2, rsv3, opcode, mask, length = self.header
+            self.header = (fin, 0, rsv2, rsv3, opcode, mask, length)
+
+    def recv_frame(self):
+        frame = super().recv_frame()
+        frame.rsv1, self.rsv1 = self.rsv1, 0
+        return frame
+
+
+class DeflateWebSocket(websocket.WebSocket):
+    """ WebSocket that inflates messages compressed with permessage-deflate
+    (RFC 7692) when the server agrees to it. Sent messages are small and
+    left uncompressed, which the extension allows. """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frame_buffer = DeflateFrameBuffer(
+            self._recv, kwargs.get("skip_utf8_validation", False)
+        )
+        self.inflater = None
+        self.inflating = False
+
+    def connect(self, url, **options):
+        super().connect(url, **options)
+        extensions = (self.headers or {}).get("sec-websocket-extensions", "")
+        deflate = "permessage-deflate" in (
+            ext.split(";")[0].strip() for ext in extensions.split(",")
+        )
+        # A full size window inflates whatever window the server uses, and
+        # keeping the context works whether or not the server resets its own
+        self.inflater = zlib.decompressobj(-zlib.MAX_WBITS) if deflate else None
+        self.frame_buffer.deflate = deflate
+
+    def recv_frame(self):
+        frame = super().recv_frame()
+        if self.inflater is None or frame.opcode not in (
+                ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY, ABNF.OPCODE_CONT):
+            return frame
+
+        # Only the first frame of a message says whether it's compressed
+        if frame.opcode != ABNF.OPCODE_CONT:
+            self.inflating = bool(frame.rsv1)
+        frame.rsv1 = 0
+        if self.inflating:
+            data = self.inflater.decompress(frame.data)
+            if frame.fin:
+                if self.inflater.eof:
+                    # The message ended with a final block, which ends the
+                    # context and leaves any padding in unused_data. The
+                    # next message starts a new one.
+                    self.inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+                else:
+                    data += self.inflater.decompress(WS_DEFLATE_TAIL)
+                self.inflating = False
+            frame.data = data
+        return frame
+
+
+def connect_websock(apid, multithread=True, raise_errors=False):
+    # pylint: disable=no-member
+    """ Connect to the application websocket. Connection errors are raised
+    as a ClickException, or as they are with raise_errors set so that
+    callers can retry. """
+    try:
+        url = make_ws_url(f"apis/pals/v1/apps/{apid}/stdio")
+        headers = get_ws_headers()
+        # Application output is mostly text, so ask for it compressed
+        if os.environ.get("PALS_WS_DEFLATE", "1") != "0":
+            headers.append(f"Sec-WebSocket-Extensions: {WS_DEFLATE_OFFER}")
+        # TODO: enable SSL verification
+        sslopt = {"cert_reqs": ssl.CERT_NONE}
+        echo(f"Connecting to {url}", level=LOG_DEBUG)
+        # Received text is decoded (and so validated) when it's returned,
+        # skip the much slower per-frame validation
+        return websocket.create_connection(
+            url, header=headers, sslopt=sslopt, class_=DeflateWebSocket,
+            enable_multithread=multithread, skip_utf8_validation=True
+        )
+    except (websocket.WebSocketException, socket.error) as err:
+        if raise_errors:
+            raise
+        raise click.ClickException(f"Connection error: {str(err)}")
+
+
+def websock_pending(websock, poller):
+    """ Check for received websocket data without blocking """
+    sock = websock.sock
+    # Data already decrypted by SSL isn't seen by poll
+    if isinstance(sock, ssl.SSLSocket) and sock.pending():
+        return True
+    return bool(poller.poll(0))
+
+
+class StdioLoop(object):
+    # pylint: disable=too-many-instance-attributes
+    """ Handle application stdio, signals, keepalives and MPIR attach on a
+    single asyncio event loop instead of one thread per concern. Only
+    receiving has a thread of its own, see read_messages, and sends are
+    made from the executor, see send_queued. """
+
+    RECV_BATCH = 64  # Maximum messages handled per loop callback
+    RECV_QUEUE = 256  # Received messages waiting for the loop at most
+
+    def __init__(self, app, label=False, procinfo_file=None, stdin=None):
+        self.app = app
+        self.label = label
+        self.procinfo_file = procinfo_file
+        self.stdin = sys.stdin if stdin is None else stdin
+        self.ctx = None
+        self.loop = None
+        self.done = None
+        self.websock = None
+        self.timers = {}
+        self.mpir_intervals = mpir_intervals()
+        self.stdin_encoder = StdinEncoder()
+        self.stdin_read_size = stdin_read_size()
+        self.stdin_sent = None
+        self.tasks = set()
+        # Sends waiting to be made, each called with the websocket
+        self.unsent = collections.deque()
+        self.sender = None
+
+    def run(self):
+        """ Run the event loop until the application completes """
+        loop = asyncio.new_event_loop()
+        sig_read = setup_signals()
+        try:
+            self.start(loop)
+            loop.add_reader(
+                sig_read, self.guard, self.forward_signal, sig_read
+            )
+            loop.run_until_complete(self.done)
+        finally:
+            loop.remove_reader(sig_read)
+            tasks = list(self.tasks)
+            self.stop()
+            # Let cancelled connects finish before closing the loop
+            if tasks:
+                loop.run_until_complete(asyncio.wait(tasks))
+            loop.close()
+
+    def start(self, loop):
+        """ Start handling the application on the given loop. The done
+        future is set once it completes. """
+        self.ctx = click.get_current_context()
+        self.loop = loop
+        self.done = loop.create_future()
+        self.app.stdio = self
+        self.spawn(self.open())
+        self.timers["ping"] = loop.call_later(
+            PING_INTERVAL, self.guard, self.send_ping
+        )
+        if self.app.mpir:
+            self.timers["mpir"] = loop.call_soon(self.guard, self.check_mpir)
+
+    def stop(self):
+        """ Stop handling the application and close its websocket """
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers = {}
+        for task in self.tasks:
+            task.cancel()
+        if self.loop:
+            self.app.stdio = None
+            self.disconnect()
+
+    def guard(self, callback, *args):
+        """ Run a loop callback, finishing the loop if it raises """
+        try:
+            callback(*args)
+        except Exception as err:  # pylint: disable=broad-except
+            if not self.done.done():
+                self.done.set_exception(err)
+
+    def spawn(self, awaitable):
+        """ Run a coroutine (or wait for a future) on the loop, finishing
+        the loop if it raises. It's cancelled when the loop stops. Returns
+        its task. """
+        def task_done(task):
+            self.tasks.discard(task)
+            if not task.cancelled() and task.exception():
+                if not self.done.done():
+                    self.done.set_exception(task.exception())
+
+        task = asyncio.ensure_future(awaitable, loop=self.loop)
+        task.add_done_callback(task_done)
+        self.tasks.add(task)
+        return task
+
+    async def open(self):
+        """ Connect, then start forwarding stdin """
+        await self.connect()
+        try:
+            fileno = self.stdin.fileno()
+        except (OSError, ValueError):
+            self.send("stdin", eof=True)
+            return
+        await self.forward_stdin(fileno)
+
+    async def connect(self, raise_errors=False):
+        """ Connect to the stdio websocket and start streaming. The
+        handshake runs in a thread so other applications sharing the loop
+        keep going. """
+        def connect_with_ctx():
+            with self.ctx:
+                websock = connect_websock(
+                    self.app.apid, raise_errors=raise_errors
+                )
+                send_rpc(
+                    websock, "stream", self.app.stream_rpcid,
+                    **self.app.get_stream_params()
+                )
+                return websock
+
+        with self.app.timer.phase("connect"):
+            self.websock = await self.loop.run_in_executor(
+                None, connect_with_ctx
+            )
+        reader = threading.Thread(
+            target=self.read_messages,
+            args=(self.websock, queue.Queue(self.RECV_QUEUE))
+        )
+        reader.daemon = True
+        reader.start()
+        # Send what waited for the connection, including stdin content
+        # that didn't make it over a lost one
+        self.start_sender()
+
+    def disconnect(self):
+        """ Stop using the stdio websocket. Shutting the socket down wakes
+        its reader thread, which closes it. """
+        if self.websock:
+            sock = self.websock.sock
+            self.websock = None
+            if sock:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def reconnect(self, err):
+        """ Replace a failed websocket connection in the background. Stdin
+        and RPCs wait until it's back. """
+        self.app.output.flush()
+        echo(
+            f"Lost application connection ({str(err)}), reconnecting",
+            level=LOG_WARN,
+        )
+        self.disconnect()
+        self.spawn(self.retry_connect())
+
+    async def retry_connect(self):
+        """ Connect again, backing off between attempts until one succeeds
+        or it gives up """
+        for delay in reconnect_delays():
+            await asyncio.sleep(delay)
+            try:
+                await self.connect(raise_errors=True)
+                return
+            except (websocket.WebSocketException, socket.error) as conn_err:
+                echo(f"Couldn't reconnect ({str(conn_err)})", level=LOG_DEBUG)
+                self.disconnect()
+        raise click.ClickException("Couldn't reconnect to the application")
+
+    def send(self, method, reqid=None, **params):
+        """ Send an RPC. Until connected, RPCs wait for the connection. """
+        self.unsent.append(
+            lambda websock: send_rpc(websock, method, reqid, **params)
+        )
+        self.start_sender()
+
+    def start_sender(self):
+        """ Start sending what's queued, unless it's already being sent or
+        there's no connection to send it on """
+        if self.websock and not self.sender and (
+                self.unsent or self.stdin_encoder.pending):
+            self.sender = self.spawn(self.send_queued(self.websock))
+
+    async def send_queued(self, websock):
+        """ Send queued RPCs, pings and stdin content, reconnecting if the
+        connection was lost. A full send buffer blocks until the
+        application takes more, so the sends are made from the executor. """
+        def send_with_ctx():
+            with self.ctx:
+                # Sends only leave their queue once they've been made
+                while self.unsent:
+                    self.unsent[0](websock)
+                    self.unsent.popleft()
+                self.stdin_encoder.flush(websock)
+
+        try:
+            while websock is self.websock and (
+                    self.unsent or self.stdin_encoder.pending):
+                await self.loop.run_in_executor(None, send_with_ctx)
+        except (websocket.WebSocketException, socket.error) as err:
+            if websock is self.websock:
+                self.reconnect(err)
+        finally:
+            self.sender = None
+            if self.stdin_sent and not self.stdin_sent.done():
+                self.stdin_sent.set_result(None)
+            # Sends queued for a new connection while this one finished up
+            self.start_sender()
+
+    def read_messages(self, websock, received):
+        """ Receive messages from the websocket and hand them to the loop.
+        A message that arrives in pieces blocks until the rest of it comes,
+        so this runs on a thread of its own. A full queue stops it reading
+        until the loop catches up. """
+        # pylint: disable=no-member
+        while True:
+            try:
+                message = websock.recv()
+            except (websocket.WebSocketException, socket.error) as err:
+                if isinstance(err, socket.error) and err.errno == errno.EINTR:
+                    continue
+                message = err
+
+            # Give up on a connection the loop has moved on from
+            while websock is self.websock:
+                try:
+                    received.put(message, timeout=1)
+                    break
+                except queue.Full:
+                    pass
+            else:
+                break
+            try:
+                self.loop.call_soon_threadsafe(
+                    self.guard, self.receive, websock, received
+                )
+            except RuntimeError:
+                # The loop has closed
+                break
+            if isinstance(message, Exception):
+                break
+        websock.shutdown()
+
+    def receive(self, websock, received):
+        """ Handle messages the reader thread has received """
+        for _ in range(self.RECV_BATCH):
+            if websock is not self.websock:
+                # Disconnected since they were received
+                return
+            try:
+                message = received.get_nowait()
+            except queue.Empty:
+                # Write out buffered output before waiting for more
+                self.app.output.flush()
+                return
+
+            if isinstance(message, Exception):
+                self.reconnect(message)
+                return
+            try:
+                self.app.handle_message(
+                    websock, message, self.label, self.procinfo_file
+                )
+            except ValueError as err:
+                echo(
+                    f"Error decoding application message: {str(err)}",
+                    level=LOG_WARN
+                )
+
+            if self.app.complete:
+                if not self.done.done():
+                    self.done.set_result(None)
+                return
+
+        # Let other callbacks run before handling the rest
+        self.loop.call_soon(self.guard, self.receive, websock, received)
+
+    async def forward_stdin(self, fileno):
+        """ Forward stdin content to the application. The next chunk is
+        only read once the last has been sent, so stdin is read as fast as
+        the application takes it. """
+        async def readable():
+            ready = self.loop.create_future()
+            self.loop.add_reader(
+                fileno, lambda: ready.done() or ready.set_result(None)
+            )
+            try:
+                await ready
+            finally:
+                self.loop.remove_reader(fileno)
+
+        pollable = True
+        while True:
+            if pollable:
+                try:
+                    await readable()
+                except PermissionError:
+                    # Regular files can't be polled but are always readable
+                    pollable = False
+
+            try:
+                content = os.read(fileno, self.stdin_read_size)
+            except OSError:
+                # I/O error, send EOF
+                content = b""
+
+            if content:
+                self.stdin_encoder.encode(content)
+            else:
+                self.stdin_encoder.finish()
+            # Sent content leaves the encoder, what wasn't sent over a lost
+            # connection goes on the new one
+            while self.stdin_encoder.pending:
+                self.stdin_sent = self.loop.create_future()
+                self.start_sender()
+                await self.stdin_sent
+            if not content:
+                return
+            # Let other callbacks run between chunks of a regular file
+            await asyncio.sleep(0)
+
+    def forward_signal(self, sig_read):
+        """ Forward a received signal to the application """
+        os.read(sig_read, 4096)
+        self.send_signal()
+
+    def send_signal(self):
+        """ Send the last received signal to the application """
+        self.send("signal", str(uuid.uuid4()), signum=SIGNAL_RECEIVED)
+
+    def send_ping(self):
+        """ Avoid connection drops by sending periodic pings """
+        echo("Sending keepalive ping", level=LOG_RAW)
+        if self.websock:
+            self.unsent.append(lambda websock: websock.ping())
+            self.start_sender()
+        self.timers["ping"] = self.loop.call_later(
+            PING_INTERVAL, self.guard, self.send_ping
+        )
+
+    def check_mpir(self):
+        """ Fill in the MPIR proctable once a debugger attaches """
+        if self.app.procinfo is not None:
+            if self.app.check_mpir():
+                return
+        elif mpir.get_MPIR_being_debugged():
+            # The procinfo request blocks, so keep it off the loop
+            self.spawn(self.loop.run_in_executor(
+                None, self.app.check_mpir, self.ctx
+            ))
+            return
+
+        self.timers["mpir"] = self.loop.call_later(
+            next(self.mpir_intervals), self.guard, self.check_mpir
+        )
@@ -372,3 +372,65 @@ def test_cray_pals_apps_procinfo_list(cli_runner, rest_mock):
     assert data['method'] == 'GET'
     url = urllib.parse.urlparse(data['url'])
     assert url.path == f'/apis/pals/v1/apps/{apid}/procinfo'
+
+
+def test_cray_pals_apps_watch(cli_runner, requests_mock):
+    """ Test watching the app list for changes """
+    runner, cli, opts = cli_runner
+    apps_url = f"{opts['default']['hostname']}/apis/pals/v1/apps"
+    app1 = {"apid": "app1", "nodes": ["nid000001"], "state": "starting"}
+    app2 = {"apid": "app2", "nodes": ["nid000002"], "state": "running"}
+    requests_mock.get(apps_url, [
+        {"json": [app1], "headers": {"ETag": '"1"'}},
+        {"status_code": 304},
+        {"json": {"applications": [dict(app1, state="running"), app2]},
+         "headers": {"ETag": '"2"'}},
+        {"json": [app2], "headers": {"ETag": '"3"'}},
+    ])
+
+    result = runner.invoke(
+        cli, ['pals', 'apps', 'watch', '--interval', '0', '--count', '4',
+              '--usernames', 'root']
+    )
+    assert result.exit_code == 0
+    events = [json.loads(line) for line in result.output.splitlines()]
+    assert events == [
+        {"event": "added", "apid": "app1", "app": app1},
+        {"event": "changed", "apid": "app1", "changes": {"state": "running"}},
+        {"event": "added", "apid": "app2", "app": app2},
+        {"event": "removed", "apid": "app1"},
+    ]
+
+    # Each poll revalidates the last list it got
+    history = requests_mock.request_history
+    assert [req.headers.get("If-None-Match") for req in history] == [
+        None, '"1"', '"1"', '"2"'
+    ]
+    assert all(req.qs == {"usernames": ["root"]} for req in history)
+
+
+def test_cray_pals_apps_procinfo_bulk(cli_runner, requests_mock):
+    """ Test getting procinfo for many apps at once """
+    runner, cli, opts = cli_runner
+    apps_url = f"{opts['default']['hostname']}/apis/pals/v1/apps"
+    apids = [str(uuid.uuid4()) for _ in range(20)]
+    for apid in apids:
+        requests_mock.get(
+            f"{apps_url}/{apid}/procinfo", json={"apid": apid, "pids": [1]}
+        )
+    requests_mock.get(f"{apps_url}/gone/procinfo", status_code=404)
+
+    result = runner.invoke(
+        cli, ['pals', 'apps', 'procinfo', 'bulk', '--workers', '4', 'gone']
+        + apids
+    )
+    assert result.exit_code == 0
+    data = json.loads(result.output[result.output.index("{"):])
+    assert list(data) == apids
+    assert all(data[apid]["apid"] == apid for apid in apids)
+
+    # Without apids, every app in the list is included
+    requests_mock.get(apps_url, json=[{"apid": apid} for apid in apids[:3]])
+    result = runner.invoke(cli, ['pals', 'apps', 'procinfo', 'bulk'])
+    assert result.exit_code == 0
+    assert list(json.loads(result.output)) == apids[:3]
@@ -105,6 +105,37 @@ def test_get_hostlist():
     del os.environ["PBS_NODEFILE"]
 
 
+def test_get_hostlist_exclusion():
+    """ Test excluding nodes from large and descending node lists """
+    assert aprun.get_hostlist("5-1", None, "2-3", None) == [
+        "nid000005", "nid000004", "nid000001"
+    ]
+    assert aprun.get_hostlist("1-3,10-8", None, "9,1-2", None) == [
+        "nid000003", "nid000010", "nid000008"
+    ]
+    hosts = aprun.get_hostlist("1-100000", None, "2-99999", None)
+    assert hosts == ["nid000001", "nid100000"]
+    hosts = aprun.get_hostlist("1-100000", None, "1-50000", None)
+    assert len(hosts) == 50000 and hosts[0] == "nid050001"
+
+    # Only nid hostnames are excluded from PBS_NODEFILE host lists
+    assert aprun.host_to_nid("nid000012") == 12
+    assert aprun.host_to_nid("nid1234567") == 1234567
+    assert aprun.host_to_nid("nid12") is None
+    assert aprun.host_to_nid("nid000012.local") is None
+    assert aprun.host_to_nid("login1") is None
+    with tempfile.NamedTemporaryFile("w") as nodefile:
+        nodefile.write("nid000001\nnid000002\nnid000002.local\nnid000003\n")
+        nodefile.flush()
+        os.environ["PBS_NODEFILE"] = nodefile.name
+        try:
+            assert aprun.get_hostlist(None, None, "2-3", None) == [
+                "nid000001", "nid000002.local"
+            ]
+        finally:
+            del os.environ["PBS_NODEFILE"]
+
+
 def test_get_launch_env():
     """ Test launch environment """
     environ = {"foo": "bar", "baz": "bat"}
@@ -131,6 +162,12 @@ def test_get_launch_env():
         ["foo=bar", "baz=bat", "too=two"]
     )
 
+    # Test filters, which don't apply to overrides
+    assert aprun.get_launch_env(["too=two"], environ, "f*") == [
+        "foo=bar", "too=two"
+    ]
+    assert aprun.get_launch_env(None, environ, exclude="f*,x") == ["baz=bat"]
+
 
 def test_get_umask():
     """ Test getting the current umask """
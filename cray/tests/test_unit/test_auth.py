@@ -24,8 +24,10 @@
 """ Test the main CLI command (`cray`) and options. """
 # pylint: disable=invalid-name
 # pylint: disable=protected-access
+import fcntl
 import json
 import os
+import time
 import click
 
 from cray import auth
@@ -175,3 +177,154 @@ def test_auth_existing(cli_runner):
     result = runner.invoke(cli, ['test'])
     print(result.output)
     assert result.exit_code == 0
+
+
+def test_auth_deferred(cli_runner):
+    """ Test credentials aren't loaded until a request needs them """
+    runner, cli, opts = cli_runner
+    username = opts['default']['username']
+    hostname = opts['default']['hostname']
+
+    @cli.command('test')
+    @click.pass_context
+    def cli_obj(ctx):
+        """ Sub cli """
+        assert ctx.obj['auth'] is None
+        assert 'auth_pending' in ctx.obj
+
+        # Write a token for the configured user, then load on first use
+        auth_obj = auth.AuthUsername(username, hostname, ctx=ctx)
+        with open(auth_obj._token_path, 'w', encoding='utf-8') as token_file:
+            json.dump(get_token(), token_file)
+        loaded = auth.get_auth(ctx)
+        assert loaded.name == auth_obj.name
+        assert loaded.session.access_token == get_token()['access_token']
+        assert 'auth_pending' not in ctx.obj
+        assert auth.get_auth(ctx) is loaded
+
+    result = runner.invoke(cli, ['test'])
+    print(result.output)
+    assert result.exit_code == 0
+
+
+def test_auth_deferred_bad_token_file(cli_runner):
+    """ Test a bad token file is only reported once credentials are used """
+    runner, cli, _ = cli_runner
+    with open('bad_token', 'w', encoding='utf-8') as token_file:
+        token_file.write('not json')
+
+    result = runner.invoke(cli, ['config', 'list', '--token', 'bad_token'])
+    assert result.exit_code == 0
+
+    @cli.command('test')
+    @click.pass_context
+    def cli_obj(ctx):
+        """ Sub cli """
+        auth.get_auth(ctx)
+
+    result = runner.invoke(cli, ['test', '--token', 'bad_token'])
+    assert result.exit_code == 2
+    assert 'Unable to open token file' in result.output
+
+
+def test_auth_read_token_cache(cli_runner):
+    """ Test parsed tokens are reused until the file changes """
+    # pylint: disable=unused-argument
+    token = get_token()
+    with open('token', 'w', encoding='utf-8') as token_file:
+        json.dump(token, token_file)
+
+    first = auth._read_token('token')
+    first['client_id'] = 'modified'
+    second = auth._read_token('token')
+    assert second == token
+    assert second is not first
+
+    token['access_token'] = 'changed'
+    with open('token', 'w', encoding='utf-8') as token_file:
+        json.dump(token, token_file)
+    os.utime('token', ns=(0, 0))
+    assert auth._read_token('token')['access_token'] == 'changed'
+
+    # A replaced file of the same size and mtime is still a new token
+    token['access_token'] = 'renewed'
+    with open('token.new', 'w', encoding='utf-8') as token_file:
+        json.dump(token, token_file)
+    os.utime('token.new', ns=(0, 0))
+    os.replace('token.new', 'token')
+    assert auth._read_token('token')['access_token'] == 'renewed'
+
+
+def _write_expiring_token(auth_obj, expires_in):
+    token = get_token()
+    token['expires_at'] = time.time() + expires_in
+    with open(auth_obj._token_path, 'w', encoding='utf-8') as token_file:
+        json.dump(token, token_file)
+    auth_obj.load()
+    return token
+
+
+def test_auth_refresh_if_expiring(cli_runner, requests_mock):
+    """ Test tokens are refreshed ahead of expiry """
+    runner, cli, opts = cli_runner
+    username = opts['default']['username']
+    hostname = opts['default']['hostname']
+
+    @cli.command('test')
+    @click.pass_context
+    def cli_obj(ctx):
+        """ Sub cli """
+        auth_obj = auth.AuthUsername(username, hostname, ctx=ctx)
+        refreshed = dict(get_token(), access_token='refreshed', expires_in=300)
+        requests_mock.post(auth_obj.url, json=refreshed)
+
+        # Not close to expiring, nothing to do
+        _write_expiring_token(auth_obj, 3600)
+        auth_obj.refresh_if_expiring()
+        assert not requests_mock.called
+
+        # Inside the refresh margin, refresh and save for other processes
+        _write_expiring_token(auth_obj, auth_obj.refresh_margin - 1)
+        auth_obj.refresh_if_expiring()
+        assert requests_mock.call_count == 1
+        assert auth_obj.session.access_token == 'refreshed'
+        with open(auth_obj._token_path, encoding='utf-8') as token_file:
+            assert json.load(token_file)['access_token'] == 'refreshed'
+
+    result = runner.invoke(cli, ['test'])
+    print(result.output)
+    assert result.exit_code == 0
+
+
+def test_auth_refresh_waits_for_lock(cli_runner, requests_mock, monkeypatch):
+    """ Test a process waiting on another's refresh re-reads the token """
+    runner, cli, opts = cli_runner
+    monkeypatch.setattr(auth.Auth, 'REFRESH_LOCK_TIMEOUT', 0.2)
+    username = opts['default']['username']
+    hostname = opts['default']['hostname']
+
+    @cli.command('test')
+    @click.pass_context
+    def cli_obj(ctx):
+        """ Sub cli """
+        auth_obj = auth.AuthUsername(username, hostname, ctx=ctx)
+        requests_mock.post(auth_obj.url, json=get_token())
+        _write_expiring_token(auth_obj, 0)
+
+        with open(f'{auth_obj._token_path}.lock', 'a', encoding='utf-8') as lock:
+            # Another process holds the lock and saves a fresh token
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            token = get_token()
+            token['access_token'] = 'other-process'
+            token['expires_at'] = time.time() + 300
+            with open(auth_obj._token_path, 'w', encoding='utf-8') as token_file:
+                json.dump(token, token_file)
+
+            auth_obj.refresh_if_expiring()
+
+        assert not requests_mock.called
+        assert auth_obj.session.access_token == 'other-process'
+
+    result = runner.invoke(cli, ['test'])
+    print(result.output)
+    assert result.exit_code == 0
@@ -0,0 +1,106 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+""" Test configuration file loading. """
+# pylint: disable=protected-access
+
+import os
+import toml
+
+from cray import config
+from cray.constants import CONFIG_CACHE_ENVVAR
+
+
+def _write_config(path, data):
+    with open(path, 'w', encoding='utf-8') as config_file:
+        toml.dump(data, config_file)
+
+
+def test_read_file_memoized(tmp_path, monkeypatch):
+    """ Test config files are only parsed again when they change """
+    path = str(tmp_path / 'default')
+    _write_config(path, {'core': {'hostname': 'https://a'}})
+
+    loads = []
+    real_load = toml.load
+
+    def counting_load(config_file):
+        loads.append(config_file.name)
+        return real_load(config_file)
+
+    monkeypatch.setattr(toml, 'load', counting_load)
+
+    data = config._read_file(path)
+    assert data == {'core': {'hostname': 'https://a'}}
+    # Modifying the returned data must not modify the cache
+    data['core']['hostname'] = 'https://modified'
+    assert config._read_file(path) == {'core': {'hostname': 'https://a'}}
+    assert len(loads) == 1
+
+    _write_config(path, {'core': {'hostname': 'https://bb'}})
+    os.utime(path, ns=(0, 0))
+    assert config._read_file(path) == {'core': {'hostname': 'https://bb'}}
+    assert len(loads) == 2
+
+    assert config._read_file(str(tmp_path / 'missing')) is None
+    assert config._read_file(str(tmp_path)) is None
+
+
+def test_read_file_side_cache(tmp_path, monkeypatch):
+    """ Test the pickled side cache is used by other processes """
+    path = str(tmp_path / 'default')
+    cache_dir = str(tmp_path / 'cache')
+    _write_config(path, {'core': {'hostname': 'https://a'}})
+    data = config._read_file(path, cache_dir=cache_dir)
+    assert os.path.isfile(os.path.join(cache_dir, 'default.pickle'))
+
+    # Simulate a new process with an empty in-memory cache
+    monkeypatch.setattr(config, '_FILE_CACHE', {})
+    monkeypatch.setattr(toml, 'load', None)
+    assert config._read_file(path, cache_dir=cache_dir) == data
+
+
+def test_config_side_cache_envvar(tmp_path, monkeypatch):
+    """ Test the side cache is only kept when enabled """
+    config.initialize_dirs(str(tmp_path))
+    _write_config(
+        str(tmp_path / 'configurations' / 'default'),
+        {'core': {'hostname': 'https://a'}}
+    )
+    monkeypatch.delenv(CONFIG_CACHE_ENVVAR, raising=False)
+    assert config.Config(str(tmp_path), 'default').get('core.hostname') == \
+        'https://a'
+    assert not os.path.exists(tmp_path / 'cache')
+
+    monkeypatch.setenv(CONFIG_CACHE_ENVVAR, '1')
+    monkeypatch.setattr(config, '_FILE_CACHE', {})
+    config.Config(str(tmp_path), 'default')
+    assert os.path.isfile(tmp_path / 'cache' / 'default.pickle')
+
+
+def test_get_active_config(tmp_path):
+    """ Test reading the active configuration name """
+    assert config.get_active_config(str(tmp_path)) == 'default'
+    with open(tmp_path / 'active_config', 'w', encoding='utf-8') as active:
+        active.write('other')
+    assert config.get_active_config(str(tmp_path)) == 'other'
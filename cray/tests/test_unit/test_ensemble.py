@@ -0,0 +1,244 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+"""
+test_ensemble.py - Unit tests for the ensemble module
+"""
+# pylint: disable=too-many-locals
+
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from websocket import ABNF
+
+import cray.modules.mpiexec.cli as mpiexec
+from cray import pals
+from cray import stdio
+from cray.ensemble import Ensemble
+from cray.procinfo import read_procinfo
+from cray.tests.utils import WebSocketServer
+
+
+def test_ensemble(cli_runner, requests_mock, monkeypatch):
+    """ Test running many applications at once on one event loop """
+    runner, cli, opts = cli_runner
+    apps_url = f"{opts['default']['hostname']}/apis/pals/v1/apps"
+    napps = 12
+    launched = []
+    deleted = []
+    active = {"now": 0, "most": 0}
+
+    def launch(request, _):
+        active["now"] += 1
+        active["most"] = max(active["most"], active["now"])
+        launched.append(request.json()["cmds"][0]["argv"])
+        return {"apid": f"app{len(launched) - 1}"}
+
+    def delete(request, _):
+        active["now"] -= 1
+        deleted.append(request.path.rsplit("/", 1)[1])
+        return {}
+
+    def handler(server, conn, message):
+        rpc = json.loads(message)
+        if rpc["method"] == "stream":
+            server.send(conn, json.dumps({"result": None, "id": rpc["id"]}))
+        elif rpc["method"] == "start":
+            # Each application exits with its index
+            apid = server.paths[conn].split("/")[-2]
+            server.send(
+                conn, json.dumps({"result": None, "id": rpc["id"]}),
+                json.dumps({
+                    "method": "stdout",
+                    "params": {"content": f"output from {apid}\n",
+                               "encoding": "UTF-8", "host": "nid000001",
+                               "rankid": 0},
+                }),
+                json.dumps({
+                    "method": "exit",
+                    "params": {"rankid": 0, "host": "nid000001",
+                               "status": int(apid[3:]) << 8},
+                }),
+                json.dumps({"method": "complete"}),
+            )
+
+    @cli.command('test')
+    def _test():
+        requests_mock.post(apps_url, json=launch)
+        requests_mock.delete(re.compile(apps_url + "/app"), json=delete)
+        with tempfile.TemporaryFile() as stdin_fp, \
+                WebSocketServer(handler, threaded=True) as server:
+            monkeypatch.setattr(sys, "stdin", stdin_fp)
+            monkeypatch.setattr(
+                stdio, "make_ws_url", lambda route: server.url + route
+            )
+            monkeypatch.setattr(stdio, "get_ws_headers", lambda: [])
+
+            ensemble = Ensemble(limit=4)
+            for idx in range(napps):
+                launchreq = {"cmds": [{"argv": [f"/bin/app{idx}"]}],
+                             "environment": []}
+                ensemble.add(f"app {idx}", pals.PALSApp(), launchreq)
+            exit_codes = ensemble.run()
+
+        assert exit_codes == {f"app {idx}": idx for idx in range(napps)}
+        assert sorted(deleted) == sorted(f"app{idx}" for idx in range(napps))
+        assert 1 < active["most"] <= 4
+        # Every application got EOF on stdin instead of our stdin
+        stdin = [json.loads(msg) for msg in server.received]
+        stdin = [rpc["params"] for rpc in stdin if rpc["method"] == "stdin"]
+        assert stdin == [{"eof": True}] * napps
+
+    result = runner.invoke(cli, ['test'])
+    assert result.exit_code == 0, result.output
+    for idx in range(napps):
+        assert f"output from app{idx}\n" in result.output
+
+
+def test_ensemble_partial_message(cli_runner, requests_mock, monkeypatch):
+    """ Test a message that arrives in pieces doesn't hold up the other
+    applications on the event loop """
+    runner, cli, opts = cli_runner
+    apps_url = f"{opts['default']['hostname']}/apis/pals/v1/apps"
+    launched = []
+    deleted = []
+    partial_sent = threading.Event()
+    others_done = threading.Event()
+
+    def launch(request, _):
+        launched.append(request.json()["cmds"][0]["argv"])
+        return {"apid": f"app{len(launched) - 1}"}
+
+    def delete(request, _):
+        deleted.append(request.path.rsplit("/", 1)[1])
+        if deleted == ["app1"]:
+            others_done.set()
+        return {}
+
+    def handler(server, conn, message):
+        rpc = json.loads(message)
+        if rpc["method"] == "stream":
+            server.send(conn, json.dumps({"result": None, "id": rpc["id"]}))
+        elif rpc["method"] == "start":
+            frame = ABNF(1, 0, 0, 0, ABNF.OPCODE_TEXT, 0, json.dumps([
+                {"result": None, "id": rpc["id"]},
+                {"method": "complete"},
+            ]).encode()).format()
+            if server.paths[conn].split("/")[-2] == "app0":
+                # Send the first application's message in two pieces, the
+                # second only once the other application is done
+                conn.sendall(frame[:4])
+                partial_sent.set()
+                if not others_done.wait(5):
+                    deleted.append("timed out")
+                frame = frame[4:]
+            else:
+                partial_sent.wait(5)
+            conn.sendall(frame)
+
+    @cli.command('test')
+    def _test():
+        requests_mock.post(apps_url, json=launch)
+        requests_mock.delete(re.compile(apps_url + "/app"), json=delete)
+        with tempfile.TemporaryFile() as stdin_fp, \
+                WebSocketServer(handler, threaded=True) as server:
+            monkeypatch.setattr(sys, "stdin", stdin_fp)
+            monkeypatch.setattr(
+                stdio, "make_ws_url", lambda route: server.url + route
+            )
+            monkeypatch.setattr(stdio, "get_ws_headers", lambda: [])
+
+            ensemble = Ensemble(limit=2)
+            for idx in range(2):
+                launchreq = {"cmds": [{"argv": [f"/bin/app{idx}"]}],
+                             "environment": []}
+                ensemble.add(f"app {idx}", pals.PALSApp(), launchreq)
+            assert ensemble.run() == {"app 0": 0, "app 1": 0}
+
+        assert deleted == ["app1", "app0"]
+
+    result = runner.invoke(cli, ['test'])
+    assert result.exit_code == 0, result.output
+
+
+def test_ensemble_procinfo(cli_runner, requests_mock, monkeypatch):
+    """ Test each ensemble application writes its own procinfo file """
+    runner, cli, opts = cli_runner
+    apps_url = f"{opts['default']['hostname']}/apis/pals/v1/apps"
+    launched = []
+
+    def launch(request, _):
+        launched.append(request.json()["cmds"][0]["argv"])
+        return {"apid": f"app{len(launched) - 1}"}
+
+    def handler(server, conn, message):
+        rpc = json.loads(message)
+        apid = server.paths[conn].split("/")[-2]
+        if rpc["method"] in ("stream", "start"):
+            server.send(conn, json.dumps({"result": None, "id": rpc["id"]}))
+        elif rpc["method"] == "procinfo":
+            procinfo = {
+                "apid": apid, "pids": [123], "placement": [0],
+                "cmdidxs": [0], "nodes": ["nid000001"],
+                "executables": [f"/bin/{apid}"],
+            }
+            server.send(
+                conn, json.dumps({"result": procinfo, "id": rpc["id"]}),
+                json.dumps({"method": "complete"}),
+            )
+
+    @cli.command('test')
+    def _test():
+        requests_mock.post(apps_url, json=launch)
+        requests_mock.delete(re.compile(apps_url + "/app"), json={})
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                tempfile.TemporaryFile() as stdin_fp, \
+                WebSocketServer(handler, threaded=True) as server:
+            monkeypatch.setattr(sys, "stdin", stdin_fp)
+            monkeypatch.setattr(
+                stdio, "make_ws_url", lambda route: server.url + route
+            )
+            monkeypatch.setattr(stdio, "get_ws_headers", lambda: [])
+
+            ensemble_cmds = [[{"argv": [f"/bin/app{idx}"]}] for idx in range(2)]
+            procinfo_file = os.path.join(tmpdir, "procinfo")
+            exit_codes = mpiexec.run_ensemble(
+                ensemble_cmds, {"environment": []}, 2, False, False,
+                (False, None, None, False), (False, None),
+                (procinfo_file, "binary")
+            )
+            assert exit_codes == {"app 1": 0, "app 2": 0}
+
+            # Each file has the procinfo of the application it's named for
+            apids = {}
+            for idx in (1, 2):
+                procinfo = read_procinfo(f"{procinfo_file}.app{idx}")
+                apids[procinfo["executables"][0]] = procinfo["apid"]
+            assert apids == {"/bin/app0": "app0", "/bin/app1": "app1"}
+            assert not os.path.exists(procinfo_file)
+
+    result = runner.invoke(cli, ['test'])
+    assert result.exit_code == 0, result.output
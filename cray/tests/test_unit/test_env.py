@@ -0,0 +1,92 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+"""
+test_env.py - Unit tests for the env module
+"""
+
+import json
+import os
+import tempfile
+import click
+import pytest
+
+from cray import env
+
+
+def test_filter_environ():
+    """ Test filtering the exported environment by name globs """
+    environ = {"PBS_JOBID": "1", "PBS_O_HOME": "/", "LMOD_CMD": "x", "A": ""}
+    assert env.filter_environ(environ) == environ
+    assert env.filter_environ(environ, "PBS_*") == {
+        "PBS_JOBID": "1", "PBS_O_HOME": "/"
+    }
+    assert env.filter_environ(environ, "PBS_*,A", "PBS_O_*") == {
+        "PBS_JOBID": "1", "A": ""
+    }
+    assert env.filter_environ(environ, exclude="LMOD_*,PBS_*") == {"A": ""}
+    assert env.filter_environ(environ, "pbs_*") == {}
+
+
+def test_set_launch_env(cli_runner):
+    """ Test sending the environment relative to a baseline """
+    runner, cli, _ = cli_runner
+    environ = {f"MODULE_VAR{idx}": "x" * 100 for idx in range(200)}
+    environ["HOME"] = "/home/user"
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        newline_file = os.path.join(tmpdir, "baseline.env")
+        with open(newline_file, "w", encoding="utf-8") as baseline:
+            baseline.writelines(f"{key}={val}\n" for key, val in environ.items())
+            baseline.write("GONE=1\n")
+        nul_file = os.path.join(tmpdir, "baseline.env0")
+        with open(nul_file, "w", encoding="utf-8") as baseline:
+            baseline.write("GONE=1\0")
+            baseline.writelines(f"{key}={val}\0" for key, val in environ.items())
+
+        base, digest = env.read_env_baseline(newline_file)
+        assert base == dict(environ, GONE="1")
+        # The digest doesn't depend on the file format or order
+        assert env.read_env_baseline(nul_file) == (base, digest)
+
+        @cli.command('test')
+        def _test():
+            environment = [f"{key}={val}" for key, val in environ.items()]
+            environment.append("PATH=/bin:/usr/bin")
+            environment[0] = "MODULE_VAR0=y"
+            launchreq = env.set_launch_env({}, environment)
+            assert launchreq == {"environment": environment}
+
+            launchreq = env.set_launch_env({}, environment, newline_file)
+            assert launchreq == {
+                "environment": ["MODULE_VAR0=y", "PATH=/bin:/usr/bin"],
+                "environment_baseline": digest,
+                "environment_unset": ["GONE"],
+            }
+            assert len(json.dumps(launchreq)) < len(json.dumps(environment)) / 100
+
+            with pytest.raises(click.ClickException):
+                env.set_launch_env({}, environment, tmpdir + "/missing")
+
+        result = runner.invoke(cli, ['test'])
+        assert result.exit_code == 0, result.output
@@ -0,0 +1,118 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+"""
+test_exits.py - Unit tests for the exits module
+"""
+
+import json
+import os
+import tempfile
+import click
+
+from cray import exits
+from cray.output import OutputSink
+
+
+def test_log_rank_exit():
+    """ Test logging rank exits (mainly for coverage) """
+    # Log shepherd exits
+    exits.log_rank_exit(-1, "nid000001", 0x0000)
+    exits.log_rank_exit(-1, "nid000001", 0xFF00)
+    exits.log_rank_exit(-1, "nid000001", 0x0001)
+    exits.log_rank_exit(-1, "nid000001", 0x007F)
+    exits.log_rank_exit(-1, "nid000001", 0x0081)
+    exits.log_rank_exit(-1, "nid000001", 0x00FF)
+
+    # Log rank exits
+    exits.log_rank_exit(0, "nid000001", 0x0000)
+    exits.log_rank_exit(0, "nid000001", 0xFF00)
+    exits.log_rank_exit(0, "nid000001", 0x0001)
+    exits.log_rank_exit(0, "nid000001", 0x007F)
+    exits.log_rank_exit(0, "nid000001", 0x0081)
+    exits.log_rank_exit(0, "nid000001", 0x00FF)
+
+
+def test_format_ranks():
+    """ Test formatting rank ranges """
+    assert exits.format_ranks([0]) == "0"
+    assert exits.format_ranks([3, 0, 1, 2, 7, 9, 8]) == "0-3,7-9"
+    assert exits.format_ranks(range(100000)) == "0-99999"
+
+
+def test_exit_summary(capsys):
+    """ Test summarizing rank exits """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        report_file = os.path.join(tmpdir, "exits.json")
+        ctx = click.Context(
+            click.Command("mpiexec"), obj={"globals": {"verbose": 2}}
+        )
+        with ctx:
+            summary = exits.ExitSummary(OutputSink(), report_file)
+            for rank in range(100000):
+                summary.add(rank, f"nid{rank // 128 + 1:06d}", 0)
+            summary.add(100000, "nid001000", 0x0089)
+            summary.add(-1, "nid001000", 0x0100)
+            summary.close()
+
+        assert capsys.readouterr().out.splitlines() == [
+            "ranks 0-99999 on nid[000001-000782] exited with code 0",
+            "rank 100000 on nid001000 died from signal 9 and dumped core",
+            "shepherd on nid001000 exited with code 1",
+        ]
+        with open(report_file, encoding="utf-8") as report:
+            entries = json.load(report)["exits"]
+        assert len(entries) == 100002
+        assert entries[100000] == {
+            "rankid": 100000, "host": "nid001000", "status": 0x0089,
+            "action": "died from signal", "code": 9, "core": True,
+        }
+
+        # The first failure is logged right away, later ones wait
+        ctx.obj["globals"]["verbose"] = 1
+        with ctx:
+            summary = exits.ExitSummary(OutputSink())
+            summary.add(0, "nid000001", 0)
+            summary.add(1, "nid000002", 0x0100)
+            assert capsys.readouterr().out.splitlines() == [
+                "rank 1 on nid000002 exited with code 1",
+            ]
+            summary.add(2, "nid000002", 0x0100)
+            assert capsys.readouterr().out == ""
+            summary.close()
+        assert capsys.readouterr().out.splitlines() == [
+            "rank 2 on nid000002 exited with code 1",
+        ]
+
+        # Each rank is also logged at the most verbose level
+        ctx.obj["globals"]["verbose"] = 3
+        with ctx:
+            summary = exits.ExitSummary(OutputSink())
+            summary.add(0, "nid000001", 0x0100)
+            summary.add(1, "nid000001", 0x0100)
+            summary.close()
+        assert capsys.readouterr().out.splitlines() == [
+            "nid000001: rank 0 exited with code 1",
+            "nid000001: rank 1 exited with code 1",
+            "ranks 0-1 on nid000001 exited with code 1",
+        ]
@@ -23,13 +23,97 @@
 #
 """ Test the main CLI command (`cray`) and options. """
 # pylint: disable=invalid-name
+import io
 import json
 import click
 import pytest
 import toml
+from ruamel import yaml
 
 from cray import formatting
 
+# Representative responses from the generated modules
+MODULE_RESPONSES = [
+    {
+        'Components': [
+            {
+                'ID': 'x1000c0s0b0n0', 'Type': 'Node', 'State': 'Ready',
+                'Flag': 'OK', 'Enabled': True, 'Role': 'Compute',
+                'NID': 1000, 'NetType': 'Sling', 'Arch': 'X86',
+                'Class': 'Mountain', 'SoftwareStatus': None,
+            },
+            {
+                'ID': 'x1000c0s0b0n1', 'Type': 'Node', 'State': 'Off',
+                'Flag': 'Warning', 'Enabled': False, 'Role': 'Compute',
+                'NID': 1001, 'Locked': False, 'ReservationDisabled': False,
+            },
+        ]
+    },
+    [
+        {
+            'name': 'session-7d9f', 'operation': 'reboot',
+            'template_name': 'cos-2.5.0', 'limit': '',
+            'stage': False, 'components': '', 'include_disabled': False,
+            'status': {
+                'start_time': '2023-06-01T12:00:00', 'end_time': None,
+                'status': 'running', 'error': None,
+            },
+        },
+    ],
+    {
+        'name': 'ncn-personalization',
+        'lastUpdated': '2023-06-01T12:00:00Z',
+        'layers': [
+            {
+                'cloneUrl': 'https://api-gw-service-nmn.local/vcs/cray/'
+                            'csm-config-management.git',
+                'commit': '43ecfa8236bed625b54325ebb70916f55884b3a4',
+                'name': 'csm-ncn-1.6.28',
+                'playbook': 'site.yml',
+            },
+        ],
+        'additional_inventory': {},
+        'tags': [],
+    },
+    {
+        'apid': '5a2ecfa0-c99b-47f4-ae07-636da6dcc07e',
+        'pids': [123, 234, 345, 456],
+        'placement': [0, 0, 1, 2],
+        'nodes': ['nid000001', 'nid000002', 'nid000003'],
+        'executables': ['/home/users/seymour/a.out'],
+        'environment': ['PATH=/usr/bin:/bin', 'EMPTY=', 'MULTI=a\nb'],
+        'limits': {'CORE': '0 -1', 'CPU': '-1 -1'},
+    },
+    {
+        'description': 'Ünïcödé ☃ description ' * 8,
+        'script': '#!/bin/bash\nset -e\necho "hello: world"\n',
+        'numbers': {'int': 42, 'neg': -7, 'float': 1.5, 'big': 2 ** 64},
+        'strings': {
+            'bool-like': 'yes', 'null-like': 'null', 'int-like': '123',
+            'date-like': '2020-01-01', 'anchor': '*x', 'colon': 'a: b',
+            'empty': '', 'spaces': '  padded  ', 'hash': '# comment',
+        },
+        'nested': [[1, [2, [3, None]]], {'a': [{}]}, [], None],
+    },
+]
+
+
+def _roundtrip_yaml(data):
+    """ YAML output as produced by the original round-trip formatter """
+    output = []
+
+    class _NullStream:
+        """ Discard writes, output is captured through transform """
+
+        def write(self, *args, **kwargs):
+            """ Null writer """
+
+        def flush(self, *args, **kwargs):
+            """ Null flusher """
+
+    yaml.YAML().dump(data, _NullStream(), transform=output.append)
+    return output[0]
+
 
 def test_formatting_format_results():
     """ Test `cray init` for creating the default configuration """
@@ -60,6 +144,35 @@ def test_formatting_format_results_yaml():
     assert result == expect
 
 
+@pytest.mark.parametrize('response', MODULE_RESPONSES)
+def test_formatting_format_results_yaml_matches_roundtrip(response):
+    """ Test the shared YAML emitter matches the round-trip dumper output """
+    expect = _roundtrip_yaml(response)
+    assert formatting.format_result(response, 'yaml') == expect
+    # Formatting again must reuse the emitter without leaking state
+    assert formatting.format_result(response, 'yaml') == expect
+
+
+@pytest.mark.parametrize('response', MODULE_RESPONSES)
+def test_formatting_echo_result_yaml(response):
+    """ Test streaming YAML output is identical to the formatted string """
+    stream = io.StringIO()
+    formatting.echo_result(response, 'yaml', file=stream)
+    assert stream.getvalue() == _roundtrip_yaml(response) + '\n'
+
+
+def test_formatting_echo_result():
+    """ Test echoing results in the non-streaming formats """
+    d1 = {'foo': {'bar': {'oh': 'no'}}}
+    stream = io.StringIO()
+    formatting.echo_result(d1, 'json', file=stream)
+    assert stream.getvalue() == json.dumps(d1, indent=2) + '\n'
+
+    stream = io.StringIO()
+    formatting.echo_result('plain text', 'yaml', file=stream)
+    assert stream.getvalue() == 'plain text\n'
+
+
 def test_formatting_format_results_raises():
     """ Test `cray init` for creating the default configuration """
 
@@ -69,3 +182,14 @@ def test_formatting_format_results_raises():
     d1 = {'foo': {'bar': {'oh': temp}}}
     with pytest.raises(click.ClickException):
         formatting.format_result(d1, 'json')
+
+
+def test_formatting_echo_result_raises():
+    """ Test echoing results that cannot be formatted """
+
+    def temp():
+        return True
+
+    d1 = {'foo': {'bar': {'oh': temp}}}
+    with pytest.raises(click.ClickException):
+        formatting.echo_result(d1, 'yaml', file=io.StringIO())
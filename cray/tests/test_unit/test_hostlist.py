@@ -23,6 +23,8 @@
 #
 """ Test the main CLI command hostlist expansion. """
 
+import pytest
+
 from cray import hostlist
 
 
@@ -66,3 +68,125 @@ def test_expand_xname_complex():
     expected = 'x0c1,x0c3,x0c5,x0c7,x1c0,x1c1,x2c0,x2c1'
     output = hostlist.expand('x0c[1,3,5,7],x[1-2]c[0-1]')
     assert expected in output
+
+
+def test_expand_padded():
+    """ Test zero padding is kept when expanding """
+    expected = 'nid000008,nid000009,nid000010,nid000011'
+    assert hostlist.expand('nid[000008-000011]') == expected
+    assert list(hostlist.iter_expand('nid[08-10],nid[9-10]')) == [
+        'nid08', 'nid09', 'nid10', 'nid9', 'nid10'
+    ]
+
+
+def test_expand_multiple_brackets():
+    """ Test expanding several brackets with a suffix """
+    expected = ['x1c0a', 'x1c1a', 'x2c0a', 'x2c1a', 'login']
+    assert list(hostlist.iter_expand('x[1-2]c[0-1]a login')) == expected
+
+
+def test_expand_invalid():
+    """ Test invalid elements are passed through by expand only """
+    assert hostlist.expand('x[a-b],x[1-2]') == 'x[a-b],x1,x2'
+    for bad in ['x[a-b]', 'x[1-2', 'x1-2]']:
+        with pytest.raises(ValueError):
+            hostlist.HostList(bad)
+
+
+def test_expand_reversed_and_duplicates():
+    """ Test reversed ranges expand to nothing and duplicates are kept """
+    assert hostlist.expand('n[3-1]') == ''
+    assert hostlist.expand('n[3-1,5],m1') == 'n5,m1'
+    assert hostlist.expand('n[2,1-2]') == 'n1,n2,n2'
+    assert not hostlist.HostList('n[3-1]')
+    assert hostlist.HostList('n[2,1-2]').compress() == 'n[1-2]'
+
+
+def test_expand_large():
+    """ Test lazily expanding a large multi-dimensional host list """
+    hosts = hostlist.iter_expand('x[1000-3999]c[0-7]s[0-7]b[0-1]n[0-1]')
+    assert next(hosts) == 'x1000c0s0b0n0'
+    count = 1
+    last = None
+    for last in hosts:
+        count += 1
+    assert count == 3000 * 8 * 8 * 2 * 2
+    assert last == 'x3999c7s7b1n1'
+
+
+def test_compress():
+    """ Test compressing host names """
+    hosts = ['nid000003', 'nid000001', 'nid000002', 'nid000010', 'nid000002']
+    assert hostlist.compress(hosts) == 'nid[000001-000003,000010]'
+    assert hostlist.compress(['nid000001']) == 'nid000001'
+    assert hostlist.compress(['login']) == 'login'
+    assert hostlist.compress([]) == ''
+
+    # Padded and unpadded numbers that print the same are combined
+    assert hostlist.compress('nid[098-099],nid[100-101],nid5') == \
+        'nid5,nid[098-101]'
+
+    # Every number is compressed, with one element per distinct set of
+    # inner numbers
+    assert hostlist.compress('x[0-1]c[0-1]') == 'x[0-1]c[0-1]'
+    assert hostlist.compress('x0c[0-3],x1c[0-1],x2c[0-3]') == \
+        'x[0,2]c[0-3],x1c[0-1]'
+    assert hostlist.compress('n[1-3]0') == 'n[10,20,30]'
+
+
+def test_hostlist_large():
+    """ Test a large multi-dimensional host list is kept as ranges """
+    expr = 'x[1000-3999]c[0-7]s[0-7]b[0-1]n[0-1]'
+    hosts = hostlist.HostList(expr)
+    assert len(hosts) == 3000 * 8 * 8 * 2 * 2
+    assert hosts.compress() == expr
+    assert 'x2500c3s4b1n0' in hosts
+    assert 'x4000c3s4b1n0' not in hosts
+
+    # A hole in one dimension splits only the outer ranges around it
+    hosts -= hostlist.HostList('x[2000-2001]c7s7b1n1')
+    assert hosts.compress() == \
+        'x[1000-1999,2002-3999]c[0-7]s[0-7]b[0-1]n[0-1],' \
+        'x[2000-2001]c[0-6]s[0-7]b[0-1]n[0-1],' \
+        'x[2000-2001]c7s[0-6]b[0-1]n[0-1],' \
+        'x[2000-2001]c7s7b0n[0-1],x[2000-2001]c7s7b1n0'
+    assert len(hosts) == 3000 * 8 * 8 * 2 * 2 - 2
+
+
+def test_compress_roundtrip():
+    """ Test expanding a compressed host list gives the same hosts """
+    expr = 'nid[000001-004096],x[1000-1001]c[0-3]s0b0n[0-1],login[1-2],uan'
+    compressed = hostlist.compress(hostlist.iter_expand(expr))
+    assert sorted(hostlist.iter_expand(compressed)) == \
+        sorted(hostlist.iter_expand(expr))
+
+
+def test_hostlist_set_algebra():
+    """ Test union, intersection and difference of host lists """
+    hosts_a = hostlist.HostList('nid[000001-004096],login1')
+    hosts_b = hostlist.HostList('nid[000100-000199,004000-005000],login2')
+
+    assert (hosts_a | hosts_b).compress() == \
+        'nid[000001-005000],login[1-2]'
+    assert (hosts_a & hosts_b).compress() == \
+        'nid[000100-000199,004000-004096]'
+    assert (hosts_a - hosts_b).compress() == \
+        'nid[000001-000099,000200-003999],login1'
+    assert len(hosts_a - hosts_b) == 3900
+
+    # The same host given different ways is only counted once
+    hosts = hostlist.HostList(['x0c0', 'nid1', 'nid0001'])
+    assert hosts == hostlist.HostList('x[0]c0,nid[1],nid[0001]')
+    assert len(hosts | hostlist.HostList('x0c[0-1]')) == 4
+
+
+def test_hostlist_contains():
+    """ Test host membership """
+    hosts = hostlist.HostList('nid[000001-004096],x[0-1]c0,uan')
+    assert 'nid000050' in hosts
+    assert 'nid50' not in hosts
+    assert 'nid004097' not in hosts
+    assert 'x1c0' in hosts
+    assert 'uan' in hosts
+    assert 'login' not in hosts
+    assert list(hostlist.HostList('nid[3,1-2]')) == ['nid1', 'nid2', 'nid3']
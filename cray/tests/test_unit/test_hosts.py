@@ -0,0 +1,64 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+"""
+test_hosts.py - Unit tests for the hosts module
+"""
+
+import json
+
+from cray import hosts
+
+
+def test_dedup_hosts():
+    """ Test folding per-slot host file entries into the ppn """
+    assert hosts.dedup_hosts(["a", "b"]) == (["a", "b"], 0)
+    assert hosts.dedup_hosts(["a", "a", "b", "b"]) == (["a", "b"], 2)
+    assert hosts.dedup_hosts(["b", "a", "b", "a"], 4) == (["b", "a"], 4)
+    # Uneven slot counts can't be expressed as a ppn
+    assert hosts.dedup_hosts(["a", "a", "b"]) == (["a", "a", "b"], 0)
+    assert hosts.dedup_hosts([]) == ([], 0)
+
+
+def test_compress_hosts(cli_runner):
+    """ Test sending the host list as a hostlist expression """
+    runner, cli, _ = cli_runner
+
+    nids = [f"nid{nid:06d}" for nid in range(1, 10001)]
+    assert hosts.compress_hosts(nids) == "nid[000001-010000]"
+    # Host order decides placement, so reordered hosts aren't compressed
+    assert hosts.compress_hosts(["nid000002", "nid000001"]) is None
+    assert hosts.compress_hosts(["b", "a"]) == "b,a"
+
+    @cli.command('test')
+    def _test():
+        launchreq = hosts.set_launch_hosts({}, nids, True)
+        assert launchreq == {"hostlist": "nid[000001-010000]"}
+        assert len(json.dumps(launchreq)) < len(json.dumps(nids)) / 1000
+        launchreq = hosts.set_launch_hosts({}, nids[::-1], True)
+        assert launchreq == {"hosts": nids[::-1]}
+        launchreq = hosts.set_launch_hosts({}, nids)
+        assert launchreq == {"hosts": nids}
+
+    result = runner.invoke(cli, ['test'])
+    assert result.exit_code == 0, result.output
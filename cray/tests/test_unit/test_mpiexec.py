@@ -29,10 +29,12 @@ import io
 import os
 import socket
 import tempfile
+import time
 import click
 import pytest
 
 import cray.modules.mpiexec.cli as mpiexec
+from cray.tests.utils import benchmark
 
 
 def test_validate_soft():
@@ -160,6 +162,14 @@ def test_get_launch_env():
         ["PATH=/tmp", "foo=bar"]
     )
 
+    # Test filters, which don't apply to -env or -path
+    assert mpiexec.get_launch_env(None, True, [], "/tmp", "f*") == [
+        "foo=bar", "PATH=/tmp"
+    ]
+    assert mpiexec.get_launch_env(
+        "foo,baz", False, [("foo", "cat")], None, exclude="foo"
+    ) == ["baz=bat", "foo=cat"]
+
     os.environ = savedenv
 
 
@@ -283,3 +293,69 @@ def test_parse_mpmd_file():
     # Nonexistent file should produce a Click exception
     with pytest.raises(click.ClickException):
         mpiexec.parse_mpmd_file(tmpfname, None, 1, 0)
+
+
+def test_parse_mpmd_file_continuation():
+    """ Test joining MPMD config file lines that end with a backslash """
+    with tempfile.NamedTemporaryFile("w") as config:
+        config.write("-n 2 \\\nhostname \\\n-a\n-n 3 hostname\n")
+        config.flush()
+        cmds = mpiexec.parse_mpmd_file(config.name, None, 1, 0)
+    assert [(cmd["argv"], cmd["nranks"], cmd["depth"]) for cmd in cmds] == [
+        (["hostname", "-a"], 2, 1),
+        (["hostname"], 3, 1),
+    ]
+
+    # A backslash at the end of the file has nothing to join
+    lines = io.StringIO("a \\\nb\nc \\\n")
+    assert list(mpiexec.iter_mpmd_lines(lines)) == ["a b\n", "c "]
+
+
+@benchmark
+def test_parse_mpmd_file_benchmark():
+    """ Test parsing an MPMD config file with 10k commands takes well under
+    a second """
+    nsegments = 10000
+    with tempfile.NamedTemporaryFile("w") as config:
+        for idx in range(nsegments):
+            config.write(f"# component {idx}\n")
+            config.write(f"-n {idx % 64 + 1} -d 2 --ppn 64 \\\n")
+            config.write(f"  ./model -c component{idx}.nml\n")
+        config.flush()
+
+        start = time.perf_counter()
+        cmds = mpiexec.parse_mpmd_file(config.name, None, 1, 0)
+        elapsed = time.perf_counter() - start
+
+    assert len(cmds) == nsegments
+    assert cmds[-1] == {
+        'argv': ["./model", "-c", f"component{nsegments - 1}.nml"],
+        'nranks': 16,
+        'wdir': os.getcwd(),
+        'umask': mpiexec.get_umask(),
+        'depth': 2,
+        'ppn': 64
+    }
+    assert elapsed < 1.0
+
+
+def test_parse_ensemble_file():
+    """ Test parsing an ensemble manifest """
+    with tempfile.NamedTemporaryFile("w") as manifest:
+        with pytest.raises(click.ClickException):
+            mpiexec.parse_ensemble_file(manifest.name, None, 1, 0)
+
+        manifest.write("# ensemble\n-n 2 ./a.out 1\n\n")
+        manifest.write("-n 4 ./b.out : -n 1 -d 4 \\\n ./c.out\n")
+        manifest.flush()
+        apps = mpiexec.parse_ensemble_file(manifest.name, None, 2, 0)
+    assert [
+        [(cmd["argv"], cmd["nranks"], cmd["depth"]) for cmd in cmds]
+        for cmds in apps
+    ] == [
+        [(["./a.out", "1"], 2, 2)],
+        [(["./b.out"], 4, 2), (["./c.out"], 1, 4)],
+    ]
+
+    with pytest.raises(click.ClickException):
+        mpiexec.parse_ensemble_file(manifest.name, None, 1, 0)
@@ -0,0 +1,157 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+""" Unit tests for the mpir module """
+import ctypes
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import pytest
+
+from cray import mpir
+from cray.tests.utils import benchmark
+
+# Stand-in for libmpirattach that keeps the proctable where tests can see it
+STUB_SOURCE = r"""
+#include <stdlib.h>
+
+struct elem { int host; int exe; unsigned long pid; };
+static struct elem *table;
+static int table_size;
+static int debug_state;
+
+void MPIR_Breakpoint(void) {}
+int get_MPIR_being_debugged(void) { return 1; }
+int get_MPIR_proctable_size(void) { return table_size; }
+int get_MPIR_debug_state(void) { return debug_state; }
+int set_MPIR_debug_state(int state) { debug_state = state; return 0; }
+int set_current_apid(const char *apid) { return 0; }
+
+int free_MPIR_proctable(void)
+{
+    free(table);
+    table = NULL;
+    table_size = 0;
+    return 0;
+}
+
+int allocate_MPIR_proctable(int size, char **hosts, int nhosts,
+                            char **exes, int nexes)
+{
+    free_MPIR_proctable();
+    table = calloc(size, sizeof(*table));
+    return table == NULL;
+}
+
+int set_MPIR_proctable_elem(int idx, int host, int exe, unsigned long pid)
+{
+    table[idx].host = host;
+    table[idx].exe = exe;
+    table[idx].pid = pid;
+    return 0;
+}
+
+int finalize_MPIR_proctable(int size)
+{
+    table_size = size;
+    return 0;
+}
+
+unsigned long get_elem(int idx, int field)
+{
+    return field == 0 ? table[idx].host :
+           field == 1 ? table[idx].exe : table[idx].pid;
+}
+"""
+
+
+@pytest.fixture(name="stub_library")
+def fixture_stub_library(monkeypatch):
+    """ Build the stub library """
+    if not shutil.which("cc"):
+        pytest.skip("no C compiler to build the stub library")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "stub.c")
+        with open(source, "w", encoding="utf-8") as source_file:
+            source_file.write(STUB_SOURCE)
+        cmd = ["cc", "-O2", "-shared", "-fPIC", "-o",
+               os.path.join(tmpdir, "libmpirattach.so.0"), source]
+        subprocess.run(cmd, check=True)
+
+        monkeypatch.setenv("PALSD_INSTALL_DIR", tmpdir)
+        monkeypatch.setattr(mpir, "libMpirAttach", None)
+        mpir.init_libMpirAttach_functions()
+        lib = mpir.libMpirAttach
+        lib.get_elem.restype = ctypes.c_ulong
+        lib.get_elem.argtypes = [ctypes.c_int, ctypes.c_int]
+        yield lib
+        mpir.free_MPIR_proctable()
+
+
+def get_proctable(lib):
+    """ Read back the stub library's proctable """
+    return [
+        tuple(lib.get_elem(idx, field) for field in range(3))
+        for idx in range(lib.get_MPIR_proctable_size())
+    ]
+
+
+def test_fill_mpir_proctable(stub_library):
+    """ Test filling the proctable from (host, executable, pid) elements """
+    mpir.fill_MPIR_proctable([
+        ("nid000002", "a.out", 100),
+        ("nid000001", "a.out", 101),
+        ("nid000002", "b.out", 102),
+    ])
+    assert get_proctable(stub_library) == [(0, 0, 100), (1, 0, 101), (0, 1, 102)]
+    assert stub_library.get_MPIR_debug_state() == 1
+
+    with pytest.raises(Exception):
+        mpir.fill_MPIR_proctable([])
+
+
+@benchmark
+@pytest.mark.parametrize("nranks", [10000, 100000, 1000000])
+def test_fill_mpir_proctable_benchmark(stub_library, nranks):
+    """ Test filling the proctable for large jobs takes a few microseconds
+    per rank """
+    ppn = 128
+    nodes = [f"nid{i:06d}" for i in range(nranks // ppn + 1)]
+    placement = [rank // ppn for rank in range(nranks)]
+    cmdidxs = [rank % 2 for rank in range(nranks)]
+    pids = list(range(1000, 1000 + nranks))
+
+    start = time.perf_counter()
+    mpir.fill_MPIR_proctable_indexed(
+        nodes, ["a.out", "b.out"], placement, cmdidxs, pids
+    )
+    assert time.perf_counter() - start < nranks * 10e-6
+
+    assert stub_library.get_MPIR_proctable_size() == nranks
+    assert tuple(stub_library.get_elem(nranks - 1, field)
+                 for field in range(3)) == (
+        placement[-1], cmdidxs[-1], pids[-1]
+    )
@@ -0,0 +1,181 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+"""
+test_output.py - Unit tests for the output module
+"""
+
+import gzip
+import os
+import sys
+import tempfile
+import time
+import click
+import pytest
+
+from cray import output
+from cray import pals
+from cray.tests.utils import benchmark
+
+
+def rank_output(rankid, content, encoding="UTF-8"):
+    """ Make the params of a stdout RPC from a rank """
+    return {"content": content, "encoding": encoding,
+            "host": f"nid00000{rankid:d}", "rankid": rankid}
+
+
+def test_output_sink(monkeypatch):
+    """ Test buffering application output """
+    with tempfile.TemporaryFile("w+") as stdout:
+        monkeypatch.setattr(sys, "stdout", stdout)
+
+        sink = output.OutputSink()
+        sink.write("stdout", {"content": "plain\n"}, label=True)
+        sink.write("stdout", rank_output(0, "a\nb"), label=True)
+        sink.write("stdout", rank_output(1, "wA==", "base64"), label=True)
+        sink.write("stdout", rank_output(1, "c\n"))
+        sink.write("stdout", rank_output(1, ""))
+
+        # Nothing is written until flushed
+        stdout.seek(0)
+        assert stdout.read() == ""
+
+        sink.flush()
+        stdout.seek(0)
+        assert stdout.buffer.read() == (
+            b"plain\nnid000000 0: a\nnid000000 0: b\n\xc0c\n"
+        )
+
+
+def test_output_sink_line_ordered(capsysbinary):
+    """ Test holding partial lines so lines from ranks don't mix """
+    sink = output.OutputSink(line_ordered=True)
+    sink.write("stdout", rank_output(0, "hel"))
+    sink.write("stdout", rank_output(1, "world\nfoo"), label=True)
+    sink.write("stdout", rank_output(0, "lo\nagain"))
+    sink.write("stderr", rank_output(0, "err"))
+    sink.flush()
+    out, err = capsysbinary.readouterr()
+    assert out == b"nid000001 1: world\nhello\n"
+    assert err == b""
+
+    # Partial lines are written once the rank exits
+    sink.end_rank("nid000000", 0)
+    sink.flush()
+    out, err = capsysbinary.readouterr()
+    assert out == b"again"
+    assert err == b"err"
+
+    # And at the end
+    sink.close()
+    out, err = capsysbinary.readouterr()
+    assert out == b"nid000001 1: foo\n"
+    assert err == b""
+
+
+@benchmark
+def test_output_benchmark(monkeypatch):
+    """ Test buffered output takes less CPU time than unbuffered printing """
+    nrpcs = 20000
+    rpcs = [
+        {"method": "stdout",
+         "params": rank_output(rank % 64, f"step {rank:d} of {nrpcs:d}\n")}
+        for rank in range(nrpcs)
+    ]
+
+    def replay_unbuffered():
+        for rpc in rpcs:
+            params = rpc["params"]
+            for line in params["content"].splitlines():
+                click.echo(
+                    f"{params['host']} {params['rankid']:d}: {line}",
+                    file=sys.stdout
+                )
+                sys.stdout.flush()
+
+    def replay_buffered():
+        app = pals.PALSApp()
+        for rpc in rpcs:
+            app.handle_rpc(None, rpc, label=True)
+        app.output.close()
+
+    results = []
+    for replay in (replay_unbuffered, replay_buffered):
+        with tempfile.TemporaryFile("w+") as stdout:
+            monkeypatch.setattr(sys, "stdout", stdout)
+            start = time.process_time()
+            replay()
+            elapsed = time.process_time() - start
+            monkeypatch.undo()
+            stdout.seek(0)
+            results.append((stdout.read(), elapsed))
+
+    assert results[0][0] == results[1][0]
+    assert results[1][1] < results[0][1]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_rank_file_sink(monkeypatch, capsysbinary, compress):
+    """ Test writing rank output to per-rank files """
+    # Only keep two files open to make sure reopened files are appended,
+    # and only queue two chunks so writing output waits on the file writer
+    monkeypatch.setattr(output, "OUTPUT_FILE_LIMIT", 2)
+    monkeypatch.setattr(output, "OUTPUT_QUEUE_SIZE", 2)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sink = output.get_output_sink(
+            output_dir=tmpdir, output_pattern="{host}/{rank}.{stream}",
+            compress=compress
+        )
+        for step in range(3):
+            for rankid in range(3):
+                sink.write("stdout", rank_output(rankid, f"{step:d}\n"))
+        sink.write("stderr", rank_output(1, "wA==", "base64"), label=True)
+        sink.write("stdout", {"content": "unknown rank\n"})
+        sink.end_rank("nid000000", 0)
+        sink.close()
+
+        assert capsysbinary.readouterr().out == b"unknown rank\n"
+
+        suffix = ".gz" if compress else ""
+        open_file = gzip.open if compress else open
+        for rankid in range(3):
+            path = os.path.join(tmpdir, f"nid00000{rankid:d}",
+                                f"{rankid:d}.stdout{suffix}")
+            with open_file(path, "rb") as rankfile:
+                assert rankfile.read() == b"0\n1\n2\n"
+        path = os.path.join(tmpdir, "nid000001", f"1.stderr{suffix}")
+        with open_file(path, "rb") as rankfile:
+            assert rankfile.read() == b"\xc0"
+
+
+def test_get_output_sink():
+    """ Test choosing the output sink from options """
+    assert not isinstance(output.get_output_sink(), output.RankFileSink)
+    assert output.get_output_sink(True).line_ordered
+
+    sink = output.get_output_sink(output_dir="out", compress=True)
+    assert sink.get_path("stdout", ("nid000001", 3)) == \
+        os.path.join("out", "rank3.stdout.gz")
+
+    with pytest.raises(click.BadParameter):
+        output.get_output_sink(output_dir="out", output_pattern="{foo}")
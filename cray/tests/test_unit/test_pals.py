@@ -24,98 +24,28 @@
 """
 test_pals.py - Unit tests for the pals module
 """
-# pylint: disable=comparison-with-callable
 # pylint: disable=too-many-locals
 
+import gzip
 import io
 import json
 import os
+import re
 import resource
-import signal
+import sys
 import tempfile
 import click
 import pytest
 
 from cray import pals
+from cray import rest
+from cray import stdio
+from cray import transfer
+from cray.procinfo import ProcinfoFile
 from cray.tests.utils import compare_dicts
-
-
-def test_signals():
-
-    """ Test signal handling setup """
-    pals.signal_handler(signal.SIGTERM, None)
-    assert pals.SIGNAL_RECEIVED == signal.SIGTERM
-
-    assert pals.setup_signals() >= 0
-    for signum in [
-        signal.SIGHUP,
-        signal.SIGINT,
-        signal.SIGQUIT,
-        signal.SIGABRT,
-        signal.SIGALRM,
-        signal.SIGTERM,
-        signal.SIGUSR1,
-        signal.SIGUSR2,
-    ]:
-        assert signal.getsignal(signum) == pals.signal_handler
-
-
-def test_make_ws_url():
-    """ Test making a websocket URL from an API gateway URL """
-    wsurl = pals.make_ws_url("test", "https://api-gw-service-nmn.local:30443")
-    assert wsurl == "wss://api-gw-service-nmn.local:30443/test"
-
-    wsurl = pals.make_ws_url("test", "api-gw-service-nmn.local:30443")
-    assert wsurl == "wss://api-gw-service-nmn.local:30443/test"
-
-
-def test_get_rpc():
-    """ Test JSON-RPC request creation """
-    rpc = json.loads(pals.get_rpc("test"))
-    expected = {"jsonrpc": "2.0", "method": "test"}
-    compare_dicts(expected, rpc)
-    rpc = json.loads(pals.get_rpc("test", foo="bar"))
-    expected = {"jsonrpc": "2.0", "method": "test", "params": {"foo": "bar"}}
-    compare_dicts(expected, rpc)
-    rpc = json.loads(pals.get_rpc("test", "1234"))
-    expected = {"jsonrpc": "2.0", "method": "test", "id": "1234"}
-    compare_dicts(expected, rpc)
-
-
-class MockSocket(object):
-    """ Mock socket class that receives canned content """
-
-    def __init__(self, recv_queue=None):
-        self.recv_queue = recv_queue
-        self.send_queue = []
-
-    def recv(self):
-        """ Receive a message from the socket """
-        if self.recv_queue:
-            return self.recv_queue.pop(0)
-        return b""
-
-    def send(self, msg):
-        """ Send a message to the socket """
-        self.send_queue.append(msg)
-
-
-def test_send_rpc():
-    """ Test RPC sending """
-    sock = MockSocket()
-
-    pals.send_rpc(sock, "start")
-    pals.send_rpc(sock, "stream", "myrpc", foo="bar")
-
-    start = {"jsonrpc": "2.0", "method": "start"}
-    stream = {
-        "jsonrpc": "2.0",
-        "method": "stream",
-        "params": {"foo": "bar"},
-        "id": "myrpc",
-    }
-    compare_dicts(start, json.loads(sock.send_queue[0]))
-    compare_dicts(stream, json.loads(sock.send_queue[1]))
+from cray.tests.utils import MockSocket
+from cray.tests.utils import stdio_server
+from cray.timing import PhaseTimer
 
 
 def test_get_exit_code():
@@ -133,23 +63,73 @@ def test_get_exit_code():
     assert pals.get_exit_code(0x00FF) == 255
 
 
-def test_log_rank_exit():
-    """ Test logging rank exits (mainly for coverage) """
-    # Log shepherd exits
-    pals.log_rank_exit(-1, "nid000001", 0x0000)
-    pals.log_rank_exit(-1, "nid000001", 0xFF00)
-    pals.log_rank_exit(-1, "nid000001", 0x0001)
-    pals.log_rank_exit(-1, "nid000001", 0x007F)
-    pals.log_rank_exit(-1, "nid000001", 0x0081)
-    pals.log_rank_exit(-1, "nid000001", 0x00FF)
+def test_mpir_wanted(monkeypatch):
+    """ Test MPIR monitoring is only done for debuggers """
+    monkeypatch.setattr(pals.mpir, "get_tracer_pid", lambda: 0)
+    monkeypatch.delenv("PALS_MPIR", raising=False)
+    assert not pals.mpir_wanted()
+    assert not pals.PALSApp().mpir
+    monkeypatch.setattr(pals.mpir, "get_tracer_pid", lambda: 1234)
+    assert pals.mpir_wanted()
+    monkeypatch.setenv("PALS_MPIR", "0")
+    assert not pals.mpir_wanted()
+    monkeypatch.setenv("PALS_MPIR", "1")
+    monkeypatch.setattr(pals.mpir, "get_tracer_pid", lambda: 0)
+    assert pals.mpir_wanted()
+
+    assert pals.mpir.get_tracer_pid() == 0
+    intervals = stdio.mpir_intervals()
+    waits = [next(intervals) for _ in range(10)]
+    assert waits[0] == stdio.MPIR_ATTACH_MIN_INTERVAL
+    assert waits == sorted(waits)
+    assert waits[-1] == stdio.MPIR_ATTACH_INTERVAL
+
+
+def test_mpir_prefetch(monkeypatch):
+    """ Test attaching a waiting debugger from prefetched procinfo """
+    monkeypatch.setenv("PALS_MPIR", "1")
+    being_debugged = []
+    proctable = []
+    monkeypatch.setattr(
+        pals.mpir, "get_MPIR_being_debugged", lambda: bool(being_debugged)
+    )
+    monkeypatch.setattr(
+        pals.mpir, "MPIR_proctable_filled", lambda: bool(proctable)
+    )
+    monkeypatch.setattr(
+        pals.mpir, "fill_MPIR_proctable_indexed",
+        lambda hosts, exes, host_idxs, exe_idxs, pids: proctable.extend(
+            (hosts[h], exes[e], pid)
+            for h, e, pid in zip(host_idxs, exe_idxs, pids)
+        )
+    )
+    monkeypatch.setattr(pals.mpir, "call_MPIR_Breakpoint", lambda: None)
 
-    # Log rank exits
-    pals.log_rank_exit(0, "nid000001", 0x0000)
-    pals.log_rank_exit(0, "nid000001", 0xFF00)
-    pals.log_rank_exit(0, "nid000001", 0x0001)
-    pals.log_rank_exit(0, "nid000001", 0x007F)
-    pals.log_rank_exit(0, "nid000001", 0x0081)
-    pals.log_rank_exit(0, "nid000001", 0x00FF)
+    sock = MockSocket()
+    app = pals.PALSApp()
+    app.apid = "myapp"
+    app.handle_rpc(sock, {"result": None, "id": app.start_rpcid})
+    assert json.loads(sock.send_queue[0])["method"] == "procinfo"
+
+    # Nothing is filled in until a debugger is waiting
+    procinfo = {
+        "pids": [123, 234, 345],
+        "placement": [0, 0, 1],
+        "cmdidxs": [0, 0, 1],
+        "nodes": ["nid000001", "nid000002"],
+        "executables": ["a.out", "b.out"],
+    }
+    app.handle_rpc(sock, {"result": procinfo, "id": app.procinfo_rpcid})
+    assert not proctable and not app.check_mpir()
+
+    # No procinfo request is needed when one attaches
+    being_debugged.append(True)
+    assert app.check_mpir()
+    assert proctable == [
+        ("nid000001", "a.out", 123),
+        ("nid000001", "a.out", 234),
+        ("nid000002", "b.out", 345),
+    ]
 
 
 def test_handle_rpc():
@@ -194,6 +174,7 @@ def test_handle_rpc():
         "id": app.procinfo_rpcid
     }
     app.handle_rpc(sock, procinfo_response, procinfo_file=tmpfname)
+    app.procinfo_writer.join()
 
     with open(tmpfname, encoding='utf-8') as tmpfp:
         result = json.load(tmpfp)
@@ -234,48 +215,6 @@ def test_handle_rpc():
         app.handle_rpc(sock, error_rpc)
 
 
-def test_forward_stdin():
-    """ Test forwarding stdin to application """
-    sock = MockSocket()
-
-    # Send some UTF-8 content
-    tmpfd, tmpfname = tempfile.mkstemp()
-    os.write(tmpfd, b"test")
-    os.lseek(tmpfd, 0, os.SEEK_SET)
-    with os.fdopen(tmpfd) as tmpf:
-        pals.forward_stdin(sock, tmpf)
-    os.unlink(tmpfname)
-
-    expected = {
-        "jsonrpc": "2.0",
-        "method": "stdin",
-        "params": {"content": "test", "encoding": "UTF-8"},
-    }
-    compare_dicts(expected, json.loads(sock.send_queue[0]))
-
-    expected = {"jsonrpc": "2.0", "method": "stdin", "params": {"eof": True}}
-    compare_dicts(expected, json.loads(sock.send_queue[1]))
-
-    # Send some non-UTF-8 content
-    sock.send_queue = []
-    tmpfd, tmpfname = tempfile.mkstemp()
-    os.write(tmpfd, b"\xc0")
-    os.lseek(tmpfd, 0, os.SEEK_SET)
-    with os.fdopen(tmpfd) as tmpf:
-        pals.forward_stdin(sock, tmpf)
-    os.unlink(tmpfname)
-
-    expected = {
-        "jsonrpc": "2.0",
-        "method": "stdin",
-        "params": {"content": "wA==", "encoding": "base64"},
-    }
-    compare_dicts(expected, json.loads(sock.send_queue[0]))
-
-    expected = {"jsonrpc": "2.0", "method": "stdin", "params": {"eof": True}}
-    compare_dicts(expected, json.loads(sock.send_queue[1]))
-
-
 def test_find_executable():
     """ Test searching for executable files """
     oldpath = os.environ.get("PATH")
@@ -362,3 +301,273 @@ def test_parse_hostfile():
     hostfile = io.StringIO("\n# comment line\nhost1\n host1 \n")
     assert pals.parse_hostfile(hostfile) == ["host1", "host1"]
     hostfile.close()
+
+
+def test_stdio_engine(monkeypatch):
+    """ Test selecting the stdio engine """
+    assert pals.PALSApp().stdio_engine == "threads"
+    assert pals.PALSApp("asyncio").stdio_engine == "asyncio"
+
+    monkeypatch.setenv("PALS_STDIO_ENGINE", "asyncio")
+    assert pals.PALSApp().stdio_engine == "asyncio"
+    assert pals.PALSApp("threads").stdio_engine == "threads"
+    monkeypatch.delenv("PALS_STDIO_ENGINE")
+
+    with pytest.raises(click.ClickException):
+        pals.PALSApp("foo")
+
+
+def test_handle_message(monkeypatch):
+    """ Test handling single and batched RPCs in a message """
+    app = pals.PALSApp()
+    handled = []
+    monkeypatch.setattr(
+        app, "handle_rpc", lambda websock, rpc, *args: handled.append(rpc)
+    )
+    app.handle_message(None, '{"method": "complete"}')
+    app.handle_message(None, '[{"method": "stdout"}, {"method": "exit"}]')
+    assert [rpc["method"] for rpc in handled] == ["complete", "stdout", "exit"]
+    for message in ("not json", "3", "[1]"):
+        with pytest.raises(ValueError):
+            app.handle_message(None, message)
+
+
+def test_procinfo_format(monkeypatch):
+    """ Test writing the procinfo file in the binary format """
+    with pytest.raises(click.ClickException):
+        pals.PALSApp(procinfo_format="xml")
+    monkeypatch.setenv("PALS_PROCINFO_FORMAT", "binary")
+    app = pals.PALSApp()
+    assert app.procinfo_format == "binary"
+
+    procinfo = {
+        "apid": "5a2ecfa0-c99b-47f4-ae07-636da6dcc07e",
+        "pids": [123, 234], "placement": [0, 1], "cmdidxs": [0, 0],
+        "nodes": ["nid000001", "nid000002"], "executables": ["a.out"],
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        procinfo_file = os.path.join(tmpdir, "procinfo")
+        app.handle_rpc(
+            MockSocket(), {"result": procinfo, "id": app.procinfo_rpcid},
+            procinfo_file=procinfo_file
+        )
+        app.finish()
+        with ProcinfoFile(procinfo_file) as mapped:
+            assert mapped.to_dict() == procinfo
+
+
+def test_launch_timing(cli_runner, requests_mock, monkeypatch, capfd):
+    """ Test reporting how long each launch phase takes """
+    runner, cli, opts = cli_runner
+    apps_url = f"{opts['default']['hostname']}/apis/pals/v1/apps"
+    apid = "5a2ecfa0-c99b-47f4-ae07-636da6dcc07e"
+    launchreq = {"cmds": [{"argv": ["/bin/true"]}], "environment": []}
+
+    @cli.command('test')
+    def _test():
+        requests_mock.post(apps_url, json={"apid": apid})
+        requests_mock.delete(f"{apps_url}/{apid}", status_code=204)
+
+        # A disabled timer doesn't report anything
+        with tempfile.TemporaryFile() as stdin_fp, stdio_server(1) as server:
+            monkeypatch.setattr(sys, "stdin", stdin_fp)
+            monkeypatch.setattr(stdio, "make_ws_url", lambda route: server.url)
+            monkeypatch.setattr(stdio, "get_ws_headers", lambda: [])
+            assert pals.PALSApp().launch(dict(launchreq)) == {3}
+        assert "phases" not in capfd.readouterr().err
+
+        with tempfile.TemporaryFile() as stdin_fp, stdio_server(1) as server, \
+                tempfile.NamedTemporaryFile("r") as report:
+            monkeypatch.setattr(sys, "stdin", stdin_fp)
+            monkeypatch.setattr(stdio, "make_ws_url", lambda route: server.url)
+            app = pals.PALSApp(timer=PhaseTimer(report_file=report.name))
+            assert app.launch(dict(launchreq)) == {3}
+            timing = json.load(report)
+
+        assert timing["apid"] == apid
+        names = [phase["name"] for phase in timing["phases"]]
+        assert names == [
+            "atp_frontend", "launch_request", "connect", "run", "teardown"
+        ]
+        assert list(timing["events"]) == [
+            "streaming", "started", "first_output", "complete"
+        ]
+        # Each phase starts after the last one, and connecting is in run
+        phases = {phase["name"]: phase for phase in timing["phases"]}
+        assert phases["launch_request"]["start"] >= \
+            phases["atp_frontend"]["start"]
+        assert phases["run"]["start"] <= phases["connect"]["start"]
+        assert phases["teardown"]["start"] + \
+            phases["teardown"]["duration"] <= timing["total"]
+        assert timing["events"]["started"] >= timing["events"]["streaming"]
+
+    result = runner.invoke(cli, ['test'])
+    assert result.exit_code == 0, result.output
+
+    # PALS_TIMING=1 writes the report to stderr
+    monkeypatch.setenv("PALS_TIMING", "1")
+    timer = pals.PALSApp().timer
+    assert timer.enabled and timer.report_file is None
+    with timer.phase("launch_request"):
+        timer.mark("started")
+    timer.report("myapp")
+    timing = json.loads(capfd.readouterr().err)
+    assert timing["apid"] == "myapp"
+    assert [phase["name"] for phase in timing["phases"]] == ["launch_request"]
+
+
+def test_transfer_all(cli_runner, requests_mock):
+    """ Test transferring executables concurrently """
+    runner, cli, opts = cli_runner
+    files_url = f"{opts['default']['hostname']}/apis/pals/v1/apps/myapp/files"
+    uploads = {}
+
+    def upload(request, _):
+        uploads[request.qs["name"][0]] = (request.qs, request.body.read())
+        return {"path": "/tmp/" + request.qs["name"][0]}
+
+    @cli.command('test')
+    def cli_obj():
+        """ Sub cli """
+        requests_mock.post(files_url, json=upload)
+        requests_mock.get(f"{files_url}/small", status_code=200, json={})
+        requests_mock.get(f"{files_url}/large", status_code=404)
+
+        app = pals.PALSApp()
+        app.apid = "myapp"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            executables = []
+            for name, size in [("small", 10), ("large", 3 << 20)]:
+                path = os.path.join(tmpdir, name)
+                with open(path, "wb") as exefile:
+                    exefile.write(os.urandom(size))
+                os.chmod(path, 0o750)
+                executables.append(path)
+
+            app.transfer_all(executables)
+            assert sorted(uploads) == ["large", "small"]
+            for path in executables:
+                with open(path, "rb") as exefile:
+                    params, body = uploads[os.path.basename(path)]
+                    assert body == exefile.read()
+                    assert params["mode"] == ["0750"]
+                    assert "sha256" not in params
+
+            # With checksums, files the service has aren't sent again
+            uploads.clear()
+            os.environ["PALS_TRANSFER_CHECKSUM"] = "1"
+            try:
+                app.transfer_all(executables)
+            finally:
+                del os.environ["PALS_TRANSFER_CHECKSUM"]
+            assert list(uploads) == ["large"]
+            params = uploads["large"][0]
+            assert params["sha256"] == [transfer.file_sha256(executables[1])]
+
+            with pytest.raises(click.ClickException):
+                app.transfer_all([os.path.join(tmpdir, "missing")])
+
+    result = runner.invoke(cli, ['test'])
+    print(result.output)
+    assert result.exit_code == 0
+
+
+def test_transfer_compressed(cli_runner, requests_mock, monkeypatch):
+    """ Test streaming compressed executable transfers """
+    runner, cli, opts = cli_runner
+    monkeypatch.setattr(rest, "_NO_COMPRESSION", set())
+    files_url = f"{opts['default']['hostname']}/apis/pals/v1/apps/myapp/files"
+    uploads = []
+
+    def upload(request, context):
+        encoding = request.headers.get("Content-Encoding")
+        if encoding and len(uploads) == 1:
+            # Refuse compression the second time around
+            context.status_code = 415
+            return {}
+        body = request.body
+        body = body.read() if hasattr(body, "read") else b"".join(body)
+        uploads.append((encoding, gzip.decompress(body) if encoding else body))
+        return {"path": "/tmp/a.out"}
+
+    @cli.command('test')
+    def cli_obj():
+        """ Sub cli """
+        requests_mock.post(files_url, json=upload)
+        app = pals.PALSApp()
+        app.apid = "myapp"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "a.out")
+            content = b"\0" * (3 << 20) + os.urandom(1000)
+            with open(path, "wb") as exefile:
+                exefile.write(content)
+
+            app.transfer(path)
+            app.transfer(path)
+            app.transfer(path)
+            assert uploads == [
+                ("gzip", content), (None, content), (None, content)
+            ]
+
+    result = runner.invoke(cli, ['config', 'set', 'core', 'compression=gzip'])
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ['test'])
+    print(result.output)
+    assert result.exit_code == 0
+
+
+def test_transfer_dedup(cli_runner, requests_mock, monkeypatch):
+    """ Test that repeat launches don't read or send unchanged executables """
+    runner, cli, opts = cli_runner
+    apps_url = f"{opts['default']['hostname']}/apis/pals/v1/apps"
+    store = set()
+    uploads = []
+    hashed = []
+    file_sha256 = transfer.file_sha256
+    monkeypatch.setattr(
+        transfer, "file_sha256", lambda path: hashed.append(path) or
+        file_sha256(path)
+    )
+    monkeypatch.setenv("PALS_TRANSFER_CHECKSUM", "1")
+
+    # Stand-in for a service that keeps transferred files by checksum
+    def upload(request, _):
+        uploads.append(request.qs["name"][0])
+        store.add(request.qs["sha256"][0])
+        return {"path": "/tmp/" + request.qs["name"][0]}
+
+    def query(request, context):
+        context.status_code = 200 if request.qs["sha256"][0] in store else 404
+        return {}
+
+    @cli.command('test')
+    def cli_obj():
+        """ Sub cli """
+        for apid in ("app1", "app2"):
+            requests_mock.post(f"{apps_url}/{apid}/files", json=upload)
+            requests_mock.get(
+                re.compile(f"{apps_url}/{apid}/files/"),
+                json=query
+            )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "a.out")
+            with open(path, "wb") as exefile:
+                exefile.write(os.urandom(1000))
+
+            app = pals.PALSApp()
+            app.apid = "app1"
+            app.transfer_all([path])
+            assert uploads == ["a.out"]
+            assert len(hashed) == 1
+
+            # A new process launching the same binary only stats it
+            app = pals.PALSApp()
+            app.apid = "app2"
+            app.transfer_all([path])
+            assert uploads == ["a.out"]
+            assert len(hashed) == 1
+
+    result = runner.invoke(cli, ['test'])
+    print(result.output)
+    assert result.exit_code == 0
@@ -0,0 +1,143 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+""" Test binary procinfo files """
+# pylint: disable=redefined-outer-name
+
+import json
+import os
+import time
+import pytest
+
+from cray import procinfo
+from cray.tests.utils import benchmark
+
+PROCINFO = {
+    "apid": "5a2ecfa0-c99b-47f4-ae07-636da6dcc07e",
+    "pids": [123, 234, 345, 456, 567],
+    "placement": [0, 0, 1, 2, 2],
+    "cmdidxs": [0, 0, 0, 1, 1],
+    "nodes": ["nid000001", "nid000002", "nid000003"],
+    "executables": ["/home/users/seymour/a.out", "/home/users/sëymour/b.out"],
+}
+
+
+@pytest.fixture
+def procinfo_path(tmp_path):
+    """ Get a path for a procinfo file """
+    return str(tmp_path / "procinfo")
+
+
+def write_binary(info, path):
+    """ Write a binary procinfo file """
+    with open(path, "wb") as procinfo_fp:
+        procinfo.write_procinfo(info, procinfo_fp)
+
+
+def test_procinfo_file(procinfo_path):
+    """ Test writing and mapping a binary procinfo file """
+    write_binary(PROCINFO, procinfo_path)
+    # Sections are aligned, so the file is a multiple of the alignment
+    assert os.path.getsize(procinfo_path) % procinfo.ALIGNMENT == 0
+
+    with procinfo.ProcinfoFile(procinfo_path) as info:
+        assert len(info) == 5
+        assert info.apid == PROCINFO["apid"]
+        assert info.pids[3] == 456
+        assert list(info.placement) == PROCINFO["placement"]
+        assert info.nodes[info.placement[4]] == "nid000003"
+        assert info.executables[info.cmdidxs[4]].endswith("sëymour/b.out")
+        assert info.to_dict() == PROCINFO
+    assert procinfo.read_procinfo(procinfo_path) == PROCINFO
+
+    # JSON procinfo files can be read the same way
+    with open(procinfo_path, "w", encoding="utf-8") as procinfo_fp:
+        json.dump(PROCINFO, procinfo_fp)
+    assert procinfo.read_procinfo(procinfo_path) == PROCINFO
+
+    # Procinfo without cmdidxs or executables runs a single command
+    write_binary({"apid": "x", "pids": [1, 2], "placement": [0, 0],
+                  "nodes": ["nid000001"]}, procinfo_path)
+    with procinfo.ProcinfoFile(procinfo_path) as info:
+        assert list(info.cmdidxs) == [0, 0]
+        assert info.executables == []
+
+
+def test_procinfo_file_errors(procinfo_path):
+    """ Test bad procinfo files are rejected """
+    with pytest.raises(ValueError):
+        with open(procinfo_path, "wb") as procinfo_fp:
+            procinfo.write_procinfo(
+                dict(PROCINFO, placement=[0]), procinfo_fp
+            )
+
+    write_binary(PROCINFO, procinfo_path)
+    with open(procinfo_path, "rb") as procinfo_fp:
+        data = procinfo_fp.read()
+    for bad in (b"x" * 64, data[:-16], data.replace(b"PALSPROC\x01", b"PALSPROC\x02")):
+        with open(procinfo_path, "wb") as procinfo_fp:
+            procinfo_fp.write(bad)
+        with pytest.raises(ValueError):
+            procinfo.ProcinfoFile(procinfo_path)
+
+
+@benchmark
+def test_procinfo_file_benchmark(procinfo_path):
+    """ Test a million-rank procinfo is smaller, and quicker to write and
+    load, in the binary format than as JSON """
+    nranks = 1000000
+    info = {
+        "apid": PROCINFO["apid"],
+        "pids": list(range(100000, 100000 + nranks)),
+        "placement": [rank // 128 for rank in range(nranks)],
+        "cmdidxs": [0] * nranks,
+        "nodes": [f"nid{node + 1:06d}" for node in range(nranks // 128 + 1)],
+        "executables": ["/home/users/seymour/a.out"],
+    }
+
+    start = time.perf_counter()
+    with open(procinfo_path, "w", encoding="utf-8") as procinfo_fp:
+        json.dump(info, procinfo_fp)
+    json_write = time.perf_counter() - start
+    json_size = os.path.getsize(procinfo_path)
+    start = time.perf_counter()
+    with open(procinfo_path, encoding="utf-8") as procinfo_fp:
+        pid = json.load(procinfo_fp)["pids"][nranks - 1]
+    json_load = time.perf_counter() - start
+    assert pid == 100000 + nranks - 1
+
+    start = time.perf_counter()
+    write_binary(info, procinfo_path)
+    binary_write = time.perf_counter() - start
+    binary_size = os.path.getsize(procinfo_path)
+    start = time.perf_counter()
+    with procinfo.ProcinfoFile(procinfo_path) as mapped:
+        pid = mapped.pids[nranks - 1]
+    binary_load = time.perf_counter() - start
+    assert pid == 100000 + nranks - 1
+    assert procinfo.read_procinfo(procinfo_path) == info
+
+    assert binary_size < json_size
+    assert binary_write < json_write
+    # Mapping reads nothing up front, so it's far quicker than parsing
+    assert binary_load * 10 < json_load
@@ -0,0 +1,113 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+""" Unit tests for the rest module """
+import gzip
+import io
+import json
+
+import click
+import pytest
+
+from cray import rest
+
+
+def test_compress():
+    """ Test compressing request bodies """
+    data = b"environment=value\n" * 10000
+    compressed = rest.compress(data, "gzip")
+    assert len(compressed) < len(data) // 10
+    assert gzip.decompress(compressed) == data
+
+    stream = rest.compress_stream(io.BytesIO(data), "gzip")
+    assert gzip.decompress(b"".join(stream)) == data
+
+    try:
+        import zstandard  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        with pytest.raises(click.UsageError):
+            rest.compress(data, "zstd")
+    else:
+        decompressor = zstandard.ZstdDecompressor()
+        assert decompressor.decompress(rest.compress(data, "zstd")) == data
+        stream = rest.compress_stream(io.BytesIO(data), "zstd")
+        assert decompressor.decompressobj().decompress(
+            b"".join(stream)
+        ) == data
+
+
+def test_request_compression(cli_runner, requests_mock, monkeypatch):
+    """ Test request bodies are compressed when configured """
+    runner, cli, opts = cli_runner
+    monkeypatch.setattr(rest, "_NO_COMPRESSION", set())
+    hostname = opts['default']['hostname']
+    bodies = []
+
+    def receive(request, _context):
+        encoding = request.headers.get("Content-Encoding")
+        body = request.body
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        bodies.append((encoding, json.loads(body)))
+        return {}
+
+    def refuse(request, context):
+        if request.headers.get("Content-Encoding"):
+            context.status_code = 415
+            return {}
+        return receive(request, context)
+
+    @cli.command('test')
+    def cli_obj():
+        """ Sub cli """
+        requests_mock.post(f"{hostname}/apis/test", json=receive)
+        requests_mock.post(f"{hostname}/apis/refuse", json=refuse)
+        big = {"environment": [f"VAR{i}=value" for i in range(1000)]}
+
+        rest.request("POST", "apis/test", json=big)
+        rest.request("POST", "apis/test", json={"small": True})
+        rest.request("POST", "apis/test", json=big, compress=False)
+        assert bodies == [
+            ("gzip", big), (None, {"small": True}), (None, big)
+        ]
+
+        # A server that refuses compressed bodies gets them uncompressed
+        bodies.clear()
+        rest.request("POST", "apis/refuse", json=big)
+        rest.request("POST", "apis/test", json=big)
+        assert bodies == [(None, big), (None, big)]
+
+    result = runner.invoke(
+        cli, ['config', 'set', 'core', 'compression=gzip']
+    )
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ['test'])
+    print(result.output)
+    assert result.exit_code == 0
+
+    result = runner.invoke(
+        cli, ['config', 'set', 'core', 'compression=lz4']
+    )
+    result = runner.invoke(cli, ['test'])
+    assert result.exit_code == 2
+    assert "Invalid core.compression lz4" in result.output
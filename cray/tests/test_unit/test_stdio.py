@@ -0,0 +1,645 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+"""
+test_stdio.py - Unit tests for the stdio module
+"""
+# pylint: disable=comparison-with-callable
+# pylint: disable=too-many-locals
+
+import asyncio
+import base64
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import zlib
+import click
+import pytest
+import websocket
+from websocket import ABNF
+
+from cray import pals
+from cray import stdio
+from cray.tests.utils import benchmark
+from cray.tests.utils import compare_dicts
+from cray.tests.utils import MockSocket
+from cray.tests.utils import stdio_server
+from cray.tests.utils import WebSocketServer
+
+
+def test_signals():
+
+    """ Test signal handling setup """
+    stdio.signal_handler(signal.SIGTERM, None)
+    assert stdio.SIGNAL_RECEIVED == signal.SIGTERM
+
+    assert stdio.setup_signals() >= 0
+    for signum in [
+        signal.SIGHUP,
+        signal.SIGINT,
+        signal.SIGQUIT,
+        signal.SIGABRT,
+        signal.SIGALRM,
+        signal.SIGTERM,
+        signal.SIGUSR1,
+        signal.SIGUSR2,
+    ]:
+        assert signal.getsignal(signum) == stdio.signal_handler
+
+
+def test_make_ws_url():
+    """ Test making a websocket URL from an API gateway URL """
+    wsurl = stdio.make_ws_url("test", "https://api-gw-service-nmn.local:30443")
+    assert wsurl == "wss://api-gw-service-nmn.local:30443/test"
+
+    wsurl = stdio.make_ws_url("test", "api-gw-service-nmn.local:30443")
+    assert wsurl == "wss://api-gw-service-nmn.local:30443/test"
+
+
+def test_get_rpc():
+    """ Test JSON-RPC request creation """
+    rpc = json.loads(stdio.get_rpc("test"))
+    expected = {"jsonrpc": "2.0", "method": "test"}
+    compare_dicts(expected, rpc)
+    rpc = json.loads(stdio.get_rpc("test", foo="bar"))
+    expected = {"jsonrpc": "2.0", "method": "test", "params": {"foo": "bar"}}
+    compare_dicts(expected, rpc)
+    rpc = json.loads(stdio.get_rpc("test", "1234"))
+    expected = {"jsonrpc": "2.0", "method": "test", "id": "1234"}
+    compare_dicts(expected, rpc)
+
+
+def test_send_rpc():
+    """ Test RPC sending """
+    sock = MockSocket()
+
+    stdio.send_rpc(sock, "start")
+    stdio.send_rpc(sock, "stream", "myrpc", foo="bar")
+
+    start = {"jsonrpc": "2.0", "method": "start"}
+    stream = {
+        "jsonrpc": "2.0",
+        "method": "stream",
+        "params": {"foo": "bar"},
+        "id": "myrpc",
+    }
+    compare_dicts(start, json.loads(sock.send_queue[0]))
+    compare_dicts(stream, json.loads(sock.send_queue[1]))
+
+
+def test_forward_stdin():
+    """ Test forwarding stdin to application """
+    sock = MockSocket()
+
+    # Send some UTF-8 content
+    tmpfd, tmpfname = tempfile.mkstemp()
+    os.write(tmpfd, b"test")
+    os.lseek(tmpfd, 0, os.SEEK_SET)
+    with os.fdopen(tmpfd) as tmpf:
+        stdio.forward_stdin(sock, tmpf)
+    os.unlink(tmpfname)
+
+    expected = {
+        "jsonrpc": "2.0",
+        "method": "stdin",
+        "params": {"content": "test", "encoding": "UTF-8"},
+    }
+    compare_dicts(expected, json.loads(sock.send_queue[0]))
+
+    expected = {"jsonrpc": "2.0", "method": "stdin", "params": {"eof": True}}
+    compare_dicts(expected, json.loads(sock.send_queue[1]))
+
+    # Send some non-UTF-8 content
+    sock.send_queue = []
+    tmpfd, tmpfname = tempfile.mkstemp()
+    os.write(tmpfd, b"\xc0")
+    os.lseek(tmpfd, 0, os.SEEK_SET)
+    with os.fdopen(tmpfd) as tmpf:
+        stdio.forward_stdin(sock, tmpf)
+    os.unlink(tmpfname)
+
+    expected = {
+        "jsonrpc": "2.0",
+        "method": "stdin",
+        "params": {"content": "wA==", "encoding": "base64"},
+    }
+    compare_dicts(expected, json.loads(sock.send_queue[0]))
+
+    expected = {"jsonrpc": "2.0", "method": "stdin", "params": {"eof": True}}
+    compare_dicts(expected, json.loads(sock.send_queue[1]))
+
+
+def test_stdin_encoder(monkeypatch):
+    """ Test sending stdin read in arbitrary chunks """
+    def encode(chunks, binary=False):
+        sock = MockSocket()
+        encoder = stdio.StdinEncoder(binary)
+        for chunk in chunks:
+            encoder.send(sock, chunk)
+        encoder.close(sock)
+        if binary:
+            return sock.send_queue[:-1]
+        return [json.loads(rpc)["params"] for rpc in sock.send_queue[:-1]]
+
+    # Characters split between reads are sent whole
+    text = "h\u00e9llo \u2603\U0001f600".encode("utf-8")
+    params = encode([text[i:i + 1] for i in range(len(text))])
+    assert "".join(param["content"] for param in params) == text.decode()
+    assert all(param["encoding"] == "UTF-8" for param in params)
+
+    # Once content isn't UTF-8 the rest is base64, including held bytes
+    params = encode([b"ok\xe2\x98", b"\xff", b"more"])
+    assert params[0] == {"content": "ok", "encoding": "UTF-8"}
+    assert [param["encoding"] for param in params[1:]] == ["base64"] * 2
+    assert b"".join(
+        base64.b64decode(param["content"]) for param in params[1:]
+    ) == b"\xe2\x98\xffmore"
+
+    # A character cut off by EOF is sent as base64
+    params = encode([b"ok\xe2\x98"])
+    assert params == [{"content": "ok", "encoding": "UTF-8"},
+                      {"content": "4pg=", "encoding": "base64"}]
+
+    # Binary frames carry content as is
+    assert encode([b"\xff", b"ok"], binary=True) == [b"\xff", b"ok"]
+    monkeypatch.setenv("PALS_STDIN_BINARY", "1")
+    assert stdio.StdinEncoder().binary
+
+    assert stdio.stdin_read_size() == stdio.STDIN_READ_SIZE
+    monkeypatch.setenv("PALS_STDIN_READ_SIZE", "1048576")
+    assert stdio.stdin_read_size() == 1 << 20
+    monkeypatch.setenv("PALS_STDIN_READ_SIZE", "big")
+    assert stdio.stdin_read_size() == stdio.STDIN_READ_SIZE
+
+
+def run_stdio_engine(monkeypatch, engine, nrpcs, label=False, stdin=b"",
+                     batch=0, deflate=False):
+    """ Run an app with the given engine against a stand-in server """
+    with tempfile.TemporaryFile() as stdin_fp, \
+            stdio_server(nrpcs, batch, deflate) as server:
+        stdin_fp.write(stdin)
+        stdin_fp.seek(0)
+        monkeypatch.setattr(sys, "stdin", stdin_fp)
+        monkeypatch.setattr(stdio, "make_ws_url", lambda route: server.url)
+        monkeypatch.setattr(stdio, "get_ws_headers", lambda: [])
+        app = pals.PALSApp(engine)
+        app.apid = "5a2ecfa0-c99b-47f4-ae07-636da6dcc07e"
+        with click.Context(click.Command("mpiexec"), obj={"globals": {}}):
+            start = time.perf_counter()
+            exit_codes = app.run(label=label)
+            elapsed = time.perf_counter() - start
+
+    rpcs = [json.loads(msg) for msg in server.received]
+    return exit_codes, rpcs, elapsed
+
+
+@pytest.mark.parametrize("deflate", [True, False])
+def test_connect_websock_deflate(monkeypatch, deflate):
+    """ Test receiving compressed messages, whole and in fragments """
+
+    def handler(server, conn, message):
+        if message != "go":
+            return
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        data = compressor.compress(b"fragmented message")
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        conn.sendall(
+            ABNF(0, 1, 0, 0, ABNF.OPCODE_TEXT, 0, data[:5]).format() +
+            ABNF(1, 0, 0, 0, ABNF.OPCODE_CONT, 0, data[5:-4]).format() +
+            ABNF(1, 0, 0, 0, ABNF.OPCODE_TEXT, 0, b"plain").format()
+        )
+        server.send(conn, "compressed " * 100)
+
+    with WebSocketServer(handler, deflate=True) as server:
+        monkeypatch.setattr(stdio, "make_ws_url", lambda route: server.url)
+        monkeypatch.setattr(stdio, "get_ws_headers", lambda: [])
+        monkeypatch.setenv("PALS_WS_DEFLATE", "1" if deflate else "0")
+        with click.Context(click.Command("mpiexec"), obj={"globals": {}}):
+            websock = stdio.connect_websock("apid")
+        if not deflate:
+            assert not server.compressors
+            return
+        websock.send("go")
+        assert websock.recv() == "fragmented message"
+        assert websock.recv() == "plain"
+        assert websock.recv() == "compressed " * 100
+        websock.close()
+        assert "permessage-deflate" in list(server.extensions.values())[0]
+
+
+def test_connect_websock_deflate_final(monkeypatch):
+    """ Test messages after one that ends with a final deflate block """
+
+    def handler(server, conn, message):
+        if message != "go":
+            return
+        # A final block ends the server's context too, RFC 7692 7.2.3.4
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        data = compressor.compress(b"final") + compressor.flush() + b"\0"
+        conn.sendall(ABNF(1, 1, 0, 0, ABNF.OPCODE_TEXT, 0, data).format())
+        server.compressors[conn] = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        server.send(conn, "after final", "after final")
+
+    with WebSocketServer(handler, deflate=True) as server:
+        monkeypatch.setattr(stdio, "make_ws_url", lambda route: server.url)
+        monkeypatch.setattr(stdio, "get_ws_headers", lambda: [])
+        with click.Context(click.Command("mpiexec"), obj={"globals": {}}):
+            websock = stdio.connect_websock("apid")
+        websock.send("go")
+        assert websock.recv() == "final"
+        assert websock.recv() == "after final"
+        assert websock.recv() == "after final"
+        websock.close()
+
+
+def test_reconnect_delay():
+    """ Test reconnect backoff stays within its bounds """
+    for attempt in range(40):
+        delay = stdio.reconnect_delay(attempt)
+        assert 0 <= delay <= stdio.RECONNECT_MAX_INTERVAL
+        assert delay <= stdio.RECONNECT_MIN_INTERVAL * 2 ** attempt
+
+
+@pytest.mark.parametrize("engine", pals.STDIO_ENGINES)
+def test_stdio_engine_reconnect(monkeypatch, capfd, engine):
+    """ Test output isn't lost or repeated when the connection drops """
+    streams = []
+
+    def output(seq):
+        return json.dumps({
+            "method": "stdout",
+            "params": {
+                "content": f"line {seq}\n", "encoding": "UTF-8",
+                "host": "nid000001", "rankid": 0, "seq": seq,
+            },
+        })
+
+    def handler(server, conn, message):
+        rpc = json.loads(message)
+        if rpc["method"] == "stream":
+            streams.append(rpc.get("params", {}))
+            server.send(conn, json.dumps({"result": None, "id": rpc["id"]}))
+            if len(streams) == 2:
+                # Replay from a little before the requested offset
+                offset = rpc["params"]["offset"]
+                server.send(
+                    conn, *[output(seq) for seq in range(offset - 2, 10)],
+                    json.dumps({
+                        "method": "exit",
+                        "params": {"rankid": 0, "host": "nid000001",
+                                   "status": 0, "seq": 10},
+                    }),
+                    json.dumps({"method": "complete"}),
+                )
+        elif rpc["method"] == "start":
+            server.send(
+                conn, json.dumps({"result": None, "id": rpc["id"]}),
+                *[output(seq) for seq in range(5)]
+            )
+            # Drop the connection as a gateway might
+            conn.shutdown(socket.SHUT_RDWR)
+
+    with tempfile.TemporaryFile() as stdin_fp, \
+            WebSocketServer(handler) as server:
+        monkeypatch.setattr(sys, "stdin", stdin_fp)
+        monkeypatch.setattr(stdio, "make_ws_url", lambda route: server.url)
+        monkeypatch.setattr(stdio, "get_ws_headers", lambda: [])
+        app = pals.PALSApp(engine)
+        app.apid = "5a2ecfa0-c99b-47f4-ae07-636da6dcc07e"
+        with click.Context(click.Command("mpiexec"), obj={"globals": {}}):
+            assert app.run() == {0}
+
+    assert streams == [{}, {"offset": 5}]
+    lines = capfd.readouterr().out.splitlines()
+    assert lines[5].startswith("Lost application connection")
+    del lines[5]
+    assert lines == [f"line {seq}" for seq in range(10)]
+
+
+@pytest.mark.parametrize("engine", pals.STDIO_ENGINES)
+@pytest.mark.parametrize("rejects", [1, 3])
+def test_stdio_engine_reconnect_retry(monkeypatch, capfd, engine, rejects):
+    """ Test failed reconnect handshakes are retried, up to a limit """
+    monkeypatch.setattr(stdio, "RECONNECT_MIN_INTERVAL", 0.01)
+    monkeypatch.setattr(stdio, "RECONNECT_ATTEMPTS", 3)
+    streams = []
+
+    def handler(server, conn, message):
+        rpc = json.loads(message)
+        if rpc["method"] == "stream":
+            streams.append(rpc)
+            server.send(conn, json.dumps({"result": None, "id": rpc["id"]}))
+            if len(streams) == 2:
+                server.send(conn, json.dumps({"method": "complete"}))
+        elif rpc["method"] == "start":
+            # Drop the connection, and have the gateway refuse the next
+            # handshakes
+            server.send(conn, json.dumps({"result": None, "id": rpc["id"]}))
+            server.rejects = rejects
+            conn.shutdown(socket.SHUT_RDWR)
+
+    with tempfile.TemporaryFile() as stdin_fp, \
+            WebSocketServer(handler) as server:
+        monkeypatch.setattr(sys, "stdin", stdin_fp)
+        monkeypatch.setattr(stdio, "make_ws_url", lambda route: server.url)
+        monkeypatch.setattr(stdio, "get_ws_headers", lambda: [])
+        app = pals.PALSApp(engine)
+        app.apid = "5a2ecfa0-c99b-47f4-ae07-636da6dcc07e"
+        with click.Context(click.Command("mpiexec"), obj={"globals": {}}):
+            if rejects < stdio.RECONNECT_ATTEMPTS:
+                assert app.run() == set()
+                assert server.connections == 2 + rejects
+            else:
+                with pytest.raises(click.ClickException) as err:
+                    app.run()
+                assert "Couldn't reconnect" in str(err.value)
+                assert server.connections == 1 + rejects
+
+    assert capfd.readouterr().out.count("Lost application connection") == 1
+
+
+@pytest.mark.parametrize("engine", pals.STDIO_ENGINES)
+def test_stdio_engine_stdin_resend(monkeypatch, engine):
+    """ Test stdin content that failed to send goes on the new connection,
+    from the same stdin reader """
+    send_binary = websocket.WebSocket.send_binary
+    spawn_threads = stdio.spawn_threads
+    failures = []
+    spawned = []
+
+    def fail_once(websock, data):
+        if not failures:
+            failures.append(data)
+            raise websocket.WebSocketConnectionClosedException("closed")
+        return send_binary(websock, data)
+
+    monkeypatch.setenv("PALS_STDIN_BINARY", "1")
+    monkeypatch.setattr(stdio, "RECONNECT_MIN_INTERVAL", 0.01)
+    monkeypatch.setattr(websocket.WebSocket, "send_binary", fail_once)
+    monkeypatch.setattr(
+        pals, "spawn_threads",
+        lambda websock: spawned.append(websock) or spawn_threads(websock)
+    )
+    with stdio_server(1) as server:
+        with tempfile.TemporaryFile() as stdin_fp:
+            stdin_fp.write(b"test")
+            stdin_fp.seek(0)
+            monkeypatch.setattr(sys, "stdin", stdin_fp)
+            monkeypatch.setattr(stdio, "make_ws_url", lambda route: server.url)
+            monkeypatch.setattr(stdio, "get_ws_headers", lambda: [])
+            app = pals.PALSApp(engine)
+            app.apid = "5a2ecfa0-c99b-47f4-ae07-636da6dcc07e"
+            with click.Context(click.Command("mpiexec"), obj={"globals": {}}):
+                assert app.run() == {3}
+
+    assert failures == [b"test"]
+    assert server.received_binary == [b"test"]
+    assert server.connections == 2
+    assert len(spawned) == (engine == "threads")
+
+
+def test_stdio_engine_procinfo_delay(monkeypatch):
+    """ Test waiting out PALS_PROCINFO_DELAY doesn't hold up the event
+    loop """
+    monkeypatch.setenv("PALS_PROCINFO_DELAY", "0.2")
+    events = []
+    procinfo = {
+        "apid": "5a2ecfa0-c99b-47f4-ae07-636da6dcc07e",
+        "pids": [123], "placement": [0], "cmdidxs": [0],
+        "nodes": ["nid000001"], "executables": ["a.out"],
+    }
+
+    def handler(server, conn, message):
+        rpc = json.loads(message)
+        if rpc["method"] == "stream":
+            server.send(conn, json.dumps({"result": None, "id": rpc["id"]}))
+        elif rpc["method"] == "start":
+            server.send(
+                conn, json.dumps({"result": None, "id": rpc["id"]}),
+                json.dumps({
+                    "method": "stdout",
+                    "params": {"content": "started\n", "encoding": "UTF-8",
+                               "host": "nid000001", "rankid": 0},
+                }),
+            )
+        elif rpc["method"] == "procinfo":
+            events.append("procinfo")
+            server.send(
+                conn, json.dumps({"result": procinfo, "id": rpc["id"]}),
+                json.dumps({"method": "complete"}),
+            )
+
+    with tempfile.TemporaryDirectory() as tmpdir, \
+            tempfile.TemporaryFile() as stdin_fp, \
+            WebSocketServer(handler) as server:
+        monkeypatch.setattr(sys, "stdin", stdin_fp)
+        monkeypatch.setattr(stdio, "make_ws_url", lambda route: server.url)
+        monkeypatch.setattr(stdio, "get_ws_headers", lambda: [])
+        app = pals.PALSApp("asyncio")
+        app.apid = procinfo["apid"]
+        write = app.output.write
+        monkeypatch.setattr(
+            app.output, "write",
+            lambda *args: events.append("output") or write(*args)
+        )
+        procinfo_file = os.path.join(tmpdir, "procinfo")
+        with click.Context(click.Command("mpiexec"), obj={"globals": {}}):
+            assert app.run(procinfo_file=procinfo_file) == set()
+        with open(procinfo_file, encoding="utf-8") as procinfo_fp:
+            assert json.load(procinfo_fp) == procinfo
+
+    # The output was handled while the procinfo request waited
+    assert events == ["output", "procinfo"]
+
+
+def test_stdio_loop_check_mpir(monkeypatch):
+    """ Test an MPIR attach run off the loop reports its errors and is
+    cancelled when the loop stops """
+    monkeypatch.setattr(stdio.mpir, "get_MPIR_being_debugged", lambda: True)
+    attaching = threading.Event()
+    app = pals.PALSApp("asyncio")
+
+    def check_mpir(ctx):
+        assert ctx is not None
+        raise RuntimeError("attach failed")
+
+    monkeypatch.setattr(app, "check_mpir", check_mpir)
+    loop = asyncio.new_event_loop()
+    try:
+        with click.Context(click.Command("mpiexec"), obj={"globals": {}}):
+            stdio_loop = stdio.StdioLoop(app)
+            stdio_loop.ctx = click.get_current_context()
+            stdio_loop.loop = loop
+            stdio_loop.done = loop.create_future()
+            stdio_loop.check_mpir()
+            with pytest.raises(RuntimeError, match="attach failed"):
+                loop.run_until_complete(
+                    asyncio.wait_for(stdio_loop.done, 5)
+                )
+            assert not stdio_loop.tasks
+
+            # A check still running when the loop stops is cancelled
+            monkeypatch.setattr(
+                app, "check_mpir", lambda ctx: attaching.wait(5)
+            )
+            stdio_loop.done = loop.create_future()
+            stdio_loop.check_mpir()
+            tasks = list(stdio_loop.tasks)
+            stdio_loop.stop()
+            loop.run_until_complete(asyncio.wait(tasks))
+            assert tasks[0].cancelled()
+    finally:
+        attaching.set()
+        loop.close()
+
+
+@pytest.mark.parametrize("engine", pals.STDIO_ENGINES)
+def test_stdio_engine_run(monkeypatch, capfd, engine):
+    """ Test running an application with each stdio engine """
+    exit_codes, rpcs, _ = run_stdio_engine(
+        monkeypatch, engine, 3, label=True, stdin=b"test"
+    )
+    assert exit_codes == {3}
+
+    methods = [rpc["method"] for rpc in rpcs if rpc["method"] != "stdin"]
+    assert methods == ["stream", "start"]
+    stdin_params = [rpc["params"] for rpc in rpcs if rpc["method"] == "stdin"]
+    assert stdin_params[-1] == {"eof": True}
+    assert stdin_params[0] == {"content": "test", "encoding": "UTF-8"}
+
+    out, _ = capfd.readouterr()
+    assert out.count("nid000001 0: progress line\n") == 3
+
+
+@benchmark
+def test_stdio_engine_benchmark(monkeypatch, capfd):
+    """ Test stdout RPC throughput of the stdio engines """
+    nrpcs = 5000
+    modes = {"plain": {}, "deflate": {"deflate": True},
+             "batched+deflate": {"batch": 64, "deflate": True}}
+    for engine in pals.STDIO_ENGINES:
+        for kwargs in modes.values():
+            exit_codes, _, elapsed = run_stdio_engine(
+                monkeypatch, engine, nrpcs, **kwargs
+            )
+            assert exit_codes == {3}
+            out, _ = capfd.readouterr()
+            assert out.count("progress line") == nrpcs
+            assert nrpcs / elapsed > 1000
+
+
+@benchmark
+@pytest.mark.parametrize("engine", pals.STDIO_ENGINES)
+def test_stdin_benchmark(monkeypatch, engine):
+    """ Test piping stdin to an application through each engine runs at
+    more than 10 MiB/s """
+    size = 32 << 20
+    content = (b"0123456789abcdef" * 4096 + b"\n") * (size // 65537)
+    for binary in ("0", "1"):
+        monkeypatch.setenv("PALS_STDIN_BINARY", binary)
+        stdin_read, stdin_write = os.pipe()
+
+        def feed(stdin_write=stdin_write):
+            with os.fdopen(stdin_write, "wb") as stdin_fp:
+                stdin_fp.write(content)
+
+        with os.fdopen(stdin_read, "rb") as stdin_fp, \
+                stdio_server(0) as server:
+            monkeypatch.setattr(sys, "stdin", stdin_fp)
+            monkeypatch.setattr(
+                stdio, "make_ws_url", lambda route, url=server.url: url
+            )
+            monkeypatch.setattr(stdio, "get_ws_headers", lambda: [])
+            app = pals.PALSApp(engine)
+            app.apid = "5a2ecfa0-c99b-47f4-ae07-636da6dcc07e"
+            feeder = threading.Thread(target=feed)
+            with click.Context(click.Command("mpiexec"), obj={"globals": {}}):
+                start = time.perf_counter()
+                feeder.start()
+                assert app.run() == {3}
+                elapsed = time.perf_counter() - start
+            feeder.join()
+
+        if binary == "1":
+            received = b"".join(server.received_binary)
+        else:
+            rpcs = [json.loads(msg) for msg in server.received]
+            received = "".join(
+                rpc["params"]["content"] for rpc in rpcs
+                if rpc["method"] == "stdin" and "content" in rpc["params"]
+            ).encode()
+        assert received == content
+        assert len(content) / elapsed > 10 << 20
+
+
+def test_stdin_backpressure(monkeypatch):
+    """ Test stdin sends to a slow application stay off the event loop """
+    senders = set()
+    flush = stdio.StdinEncoder.flush
+
+    def flush_on_thread(self, websock):
+        senders.add(threading.current_thread())
+        flush(self, websock)
+
+    monkeypatch.setattr(stdio.StdinEncoder, "flush", flush_on_thread)
+
+    def handler(server, conn, message):
+        rpc = json.loads(message)
+        if rpc["method"] in ("stream", "start"):
+            server.send(conn, json.dumps({"result": None, "id": rpc["id"]}))
+        elif rpc["method"] == "stdin":
+            time.sleep(0.005)
+            if rpc["params"].get("eof"):
+                server.send(conn, json.dumps({"method": "complete"}))
+
+    content = b"x" * (16 << 20)
+    stdin_read, stdin_write = os.pipe()
+
+    def feed():
+        with os.fdopen(stdin_write, "wb") as stdin_fp:
+            stdin_fp.write(content)
+
+    with os.fdopen(stdin_read, "rb") as stdin_fp, \
+            WebSocketServer(handler) as server:
+        monkeypatch.setattr(sys, "stdin", stdin_fp)
+        monkeypatch.setattr(stdio, "make_ws_url", lambda route: server.url)
+        monkeypatch.setattr(stdio, "get_ws_headers", lambda: [])
+        app = pals.PALSApp("asyncio")
+        app.apid = "5a2ecfa0-c99b-47f4-ae07-636da6dcc07e"
+        feeder = threading.Thread(target=feed)
+        feeder.start()
+        with click.Context(click.Command("mpiexec"), obj={"globals": {}}):
+            app.run()
+        feeder.join()
+
+    rpcs = [json.loads(msg) for msg in server.received]
+    assert "".join(
+        rpc["params"].get("content", "") for rpc in rpcs
+        if rpc["method"] == "stdin"
+    ).encode() == content
+    assert senders and threading.main_thread() not in senders
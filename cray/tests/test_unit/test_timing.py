@@ -0,0 +1,64 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+"""
+test_timing.py - Unit tests for the timing module
+"""
+
+import json
+import os
+import tempfile
+
+from cray import timing
+
+
+def test_phase_timer():
+    """ Test recording launch phases and milestones """
+    # A disabled timer records nothing
+    timer = timing.PhaseTimer()
+    with timer.phase("launch_request"):
+        timer.mark("started")
+    assert not timer.phases and not timer.events
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        report_file = os.path.join(tmpdir, "timing.json")
+        timer = timing.PhaseTimer(report_file=report_file)
+        assert timer.enabled
+        with timer.phase("launch_request"):
+            timer.mark("started")
+            # Only the first time an event happens counts
+            timer.mark("started")
+        with timer.phase("run"):
+            pass
+        timer.report("myapp")
+        with open(report_file, encoding="utf-8") as report:
+            report = json.load(report)
+
+    assert report["apid"] == "myapp"
+    assert [phase["name"] for phase in report["phases"]] == [
+        "launch_request", "run"
+    ]
+    launch, run = report["phases"]
+    assert launch["start"] + launch["duration"] <= run["start"]
+    assert launch["start"] <= report["events"]["started"] <= run["start"]
+    assert run["start"] + run["duration"] <= report["total"]
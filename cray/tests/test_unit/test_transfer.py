@@ -0,0 +1,72 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+"""
+test_transfer.py - Unit tests for the transfer module
+"""
+
+import os
+import tempfile
+
+from cray import transfer
+
+def test_transfer_manifest(monkeypatch):
+    """ Test remembering executable checksums """
+    hashed = []
+    file_sha256 = transfer.file_sha256
+    monkeypatch.setattr(
+        transfer, "file_sha256", lambda path: hashed.append(path) or
+        file_sha256(path)
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "a.out")
+        with open(path, "wb") as exefile:
+            exefile.write(b"binary")
+        manifest_path = os.path.join(tmpdir, "cache", "transfers.json")
+
+        manifest = transfer.TransferManifest(manifest_path)
+        digest = manifest.digest(path, os.stat(path))
+        assert digest == file_sha256(path)
+        assert manifest.digest(path, os.stat(path)) == digest
+        assert len(hashed) == 1
+        manifest.save()
+
+        # A new manifest reuses the saved checksum without reading the file
+        manifest = transfer.TransferManifest(manifest_path)
+        assert manifest.digest(path, os.stat(path)) == digest
+        assert len(hashed) == 1
+
+        # A precomputed checksum is used as-is
+        manifest.add(path, os.stat(path), "f" * 64)
+        assert manifest.digest(path, os.stat(path)) == "f" * 64
+
+        # Changed files are read again
+        with open(path, "ab") as exefile:
+            exefile.write(b"changed")
+        assert manifest.digest(path, os.stat(path)) == file_sha256(path)
+        assert len(hashed) == 2
+
+        # Bad manifests are ignored
+        with open(manifest_path, "w", encoding="utf-8") as bad:
+            bad.write("{")
+        assert not transfer.TransferManifest(manifest_path).entries
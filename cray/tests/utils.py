@@ -24,13 +24,21 @@
 """ Test utilities that make testing easier. """
 # pylint: disable=missing-function-docstring
 # pylint: disable=invalid-name
+import base64
+import hashlib
 import os
+import socket
+import struct
+import threading
 import uuid
 import json
+import zlib
 from urllib.parse import urlparse
 from itertools import chain, combinations
 import names
+import pytest
 import toml
+from websocket import ABNF
 
 
 def _uuid():
@@ -112,3 +120,213 @@ def powerset(iterable):
     """powerset([1,2,3]) → () (1,) (2,) (3,) (1,2) (1,3) (2,3) (1,2,3)"""
     s = list(iterable)
     return chain.from_iterable(combinations(s, r) for r in range(len(s)+1))
+
+
+# Benchmarks are slow and print nothing useful in a normal run, so they only
+# run when CRAY_BENCHMARKS is set
+benchmark = pytest.mark.skipif(
+    not os.environ.get("CRAY_BENCHMARKS"),
+    reason="set CRAY_BENCHMARKS=1 to run benchmarks"
+)
+
+
+class WebSocketServer(threading.Thread):  # pylint: disable=too-many-instance-attributes
+    """ Minimal local WebSocket server to stand in for the PALS stdio endpoint.
+    handler(server, conn, message) is called for each text message received,
+    and can reply with server.send(conn, message). Binary messages are kept
+    in server.received_binary. Connections are served one at a time unless
+    threaded is set, and server.paths has the request path of each
+    connection. With deflate set, permessage-deflate is accepted when the
+    client offers it and sent messages are compressed. While
+    server.rejects is positive, handshakes are refused with a 502 and
+    it counts down. """
+
+    GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+    def __init__(self, handler, threaded=False, deflate=False):
+        super().__init__(daemon=True)
+        self.handler = handler
+        self.threaded = threaded
+        self.deflate = deflate
+        self.paths = {}
+        self.extensions = {}
+        self.compressors = {}
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(4)
+        self.url = f"ws://127.0.0.1:{self.listener.getsockname()[1]}/"
+        self.connections = 0
+        self.rejects = 0
+        self.received = []
+        self.received_binary = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.listener.close()
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections += 1
+            if self.threaded:
+                threading.Thread(
+                    target=self.serve_conn, args=(conn,), daemon=True
+                ).start()
+            else:
+                self.serve_conn(conn)
+
+    def serve_conn(self, conn):
+        with conn:
+            self.serve(conn)
+
+    def serve(self, conn):
+        rfile = conn.makefile("rb")
+        key = ""
+        self.paths[conn] = rfile.readline().decode().split(" ")[1]
+        for line in iter(rfile.readline, b"\r\n"):
+            if not line:
+                return
+            name, _, value = line.decode().partition(":")
+            if name.lower() == "sec-websocket-key":
+                key = value.strip()
+            elif name.lower() == "sec-websocket-extensions":
+                self.extensions[conn] = value.strip()
+        if self.rejects > 0:
+            self.rejects -= 1
+            conn.sendall(b"HTTP/1.1 502 Bad Gateway\r\n\r\n")
+            return
+        accept = base64.b64encode(
+            hashlib.sha1((key + self.GUID).encode()).digest()
+        ).decode()
+        extension = b""
+        if self.deflate and "permessage-deflate" in self.extensions.get(
+                conn, ""):
+            self.compressors[conn] = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            extension = b"Sec-WebSocket-Extensions: permessage-deflate\r\n"
+        conn.sendall(
+            b"HTTP/1.1 101 Switching Protocols\r\n"
+            b"Upgrade: websocket\r\nConnection: Upgrade\r\n" + extension +
+            b"Sec-WebSocket-Accept: " + accept.encode() + b"\r\n\r\n"
+        )
+
+        try:
+            while True:
+                opcode, data = self.read_frame(rfile)
+                if opcode in (None, ABNF.OPCODE_CLOSE):
+                    return
+                if opcode == ABNF.OPCODE_PING:
+                    conn.sendall(
+                        ABNF(1, 0, 0, 0, ABNF.OPCODE_PONG, 0, data).format()
+                    )
+                elif opcode == ABNF.OPCODE_TEXT:
+                    message = data.decode("utf-8")
+                    self.received.append(message)
+                    self.handler(self, conn, message)
+                elif opcode == ABNF.OPCODE_BINARY:
+                    self.received_binary.append(data)
+        except OSError:
+            return
+
+    @staticmethod
+    def read_frame(rfile):
+        header = rfile.read(2)
+        if len(header) < 2:
+            return None, None
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", rfile.read(8))[0]
+        mask = rfile.read(4) if header[1] & 0x80 else None
+        data = rfile.read(length)
+        if mask:
+            data = ABNF.mask(mask, data)
+        return header[0] & 0x0F, data
+
+    def send(self, conn, *messages):
+        compressor = self.compressors.get(conn)
+        frames = []
+        for message in messages:
+            data = message.encode()
+            if compressor:
+                data = compressor.compress(data)
+                data += compressor.flush(zlib.Z_SYNC_FLUSH)
+                frames.append(
+                    ABNF(1, 1, 0, 0, ABNF.OPCODE_TEXT, 0, data[:-4]).format()
+                )
+            else:
+                frames.append(
+                    ABNF(1, 0, 0, 0, ABNF.OPCODE_TEXT, 0, data).format()
+                )
+        conn.sendall(b"".join(frames))
+
+
+def stdio_server(nrpcs, batch=0, deflate=False):
+    """ Create a stand-in stdio server sending nrpcs stdout RPCs once the
+    application is started and stdin has been closed. With batch set, the
+    RPCs are sent in arrays of that many. """
+    waiting = {"start", "eof"}
+
+    def handler(server, conn, message):
+        rpc = json.loads(message)
+        if rpc["method"] in ("stream", "start"):
+            server.send(conn, json.dumps({"result": None, "id": rpc["id"]}))
+        waiting.discard(rpc["method"])
+        if rpc["method"] == "stdin" and rpc["params"].get("eof"):
+            waiting.discard("eof")
+        if waiting:
+            return
+
+        output = json.dumps({
+            "method": "stdout",
+            "params": {
+                "content": "progress line\n", "encoding": "UTF-8",
+                "host": "nid000001", "rankid": 0,
+            },
+        })
+        outputs = [output] * nrpcs
+        if batch:
+            outputs = [
+                "[" + ",".join(outputs[idx:idx + batch]) + "]"
+                for idx in range(0, nrpcs, batch)
+            ]
+        server.send(
+            conn,
+            *outputs,
+            json.dumps({
+                "method": "exit",
+                "params": {"rankid": 0, "host": "nid000001",
+                           "status": 0x0300},
+            }),
+            json.dumps({"method": "complete"}),
+        )
+
+    return WebSocketServer(handler, deflate=deflate)
+
+
+class MockSocket(object):
+    """ Mock socket class that receives canned content """
+
+    def __init__(self, recv_queue=None):
+        self.recv_queue = recv_queue
+        self.send_queue = []
+
+    def recv(self):
+        """ Receive a message from the socket """
+        if self.recv_queue:
+            return self.recv_queue.pop(0)
+        return b""
+
+    def send(self, msg):
+        """ Send a message to the socket """
+        self.send_queue.append(msg)
+
+    def send_binary(self, msg):
+        """ Send a binary message to the socket """
+        self.send_queue.append(msg)
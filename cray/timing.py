@@ -0,0 +1,95 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+""" timing.py - Timing the phases of a PALS launch. """
+import contextlib
+import json
+import sys
+import time
+
+from cray.echo import echo
+from cray.echo import LOG_WARN
+
+
+class PhaseTimer(object):
+    """ Record how long each phase of a launch takes, and when milestones
+    such as the first output happen, as monotonic offsets from when the
+    timer was created. The JSON report goes to report_file if given, or
+    else stderr. A disabled timer records nothing. """
+
+    def __init__(self, enabled=False, report_file=None):
+        self.enabled = enabled or bool(report_file)
+        self.report_file = report_file
+        self.origin = time.monotonic()
+        self.phases = []
+        self.events = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Time the enclosed block as the named phase """
+        if not self.enabled:
+            yield
+            return
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases.append((name, start, time.monotonic()))
+
+    def mark(self, name):
+        """ Record the first time the named event happens """
+        if self.enabled and name not in self.events:
+            self.events[name] = time.monotonic()
+
+    def report(self, apid=None):
+        """ Write the JSON timing report """
+        if not self.enabled:
+            return
+        timing = {
+            "apid": apid,
+            "total": round(time.monotonic() - self.origin, 6),
+            "phases": [
+                {
+                    "name": name,
+                    "start": round(start - self.origin, 6),
+                    "duration": round(end - start, 6),
+                }
+                for name, start, end in self.phases
+            ],
+            "events": {
+                name: round(when - self.origin, 6)
+                for name, when in self.events.items()
+            },
+        }
+        if not self.report_file:
+            sys.stderr.write(json.dumps(timing) + "\n")
+            sys.stderr.flush()
+            return
+        try:
+            with open(self.report_file, "w", encoding="utf-8") as a_file:
+                json.dump(timing, a_file)
+        except OSError as err:
+            echo(
+                f"Couldn't write {self.report_file}: {str(err)}",
+                level=LOG_WARN
+            )
@@ -0,0 +1,174 @@
+#
+#  MIT License
+#
+#  (C) Copyright 2020-2023 Hewlett Packard Enterprise Development LP
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+#  OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+#  ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#  OTHER DEALINGS IN THE SOFTWARE.
+#
+""" transfer.py - Helpers for transferring executables to PALS. """
+import collections
+import hashlib
+import json
+import os
+import threading
+import click
+
+from cray.constants import CACHE_DIR_NAME
+from cray.echo import echo
+from cray.echo import LOG_DEBUG
+from cray.echo import LOG_INFO
+from cray.utils import open_atomic
+
+TRANSFER_CHUNK_SIZE = 1 << 20  # Executable upload read size
+TRANSFER_MANIFEST = "transfers.json"  # Executable checksum manifest name
+TRANSFER_MANIFEST_LIMIT = 1024  # Executables remembered in the manifest
+
+
+def file_sha256(path):
+    """ Get the SHA-256 hex digest of a file """
+    digest = hashlib.sha256()
+    with open(path, "rb") as a_file:
+        for chunk in iter(lambda: a_file.read(TRANSFER_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TransferManifest(object):
+    """ Remember executable checksums keyed by path, mtime and size, so a
+    file that hasn't changed since the last launch costs only a stat """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = collections.OrderedDict()
+        self.dirty = False
+        self.lock = threading.Lock()
+        if path:
+            self.load()
+
+    def load(self):
+        """ Read entries from the manifest file, ignoring a bad file """
+        try:
+            with open(self.path, encoding="utf-8") as a_file:
+                entries = json.load(a_file)["files"]
+            self.entries.update(
+                (path, list(entry)) for path, entry in entries.items()
+                if len(entry) == 3
+            )
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+
+    def get(self, path, stat_result):
+        """ Get the recorded checksum of a file, None if it has changed """
+        key = [stat_result.st_mtime_ns, stat_result.st_size]
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[:2] != key:
+                return None
+            self.entries.move_to_end(path)
+            return entry[2]
+
+    def add(self, path, stat_result, digest):
+        """ Record the checksum of a file, e.g. one computed elsewhere """
+        with self.lock:
+            self.entries[path] = [
+                stat_result.st_mtime_ns, stat_result.st_size, digest
+            ]
+            self.entries.move_to_end(path)
+            while len(self.entries) > TRANSFER_MANIFEST_LIMIT:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def digest(self, path, stat_result):
+        """ Get the checksum of a file, only reading it if it has changed """
+        path = os.path.abspath(path)
+        digest = self.get(path, stat_result)
+        if digest is None:
+            digest = file_sha256(path)
+            self.add(path, stat_result, digest)
+        return digest
+
+    def save(self):
+        """ Write the manifest file if anything was added """
+        if not self.path or not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with self.lock, open_atomic(self.path) as a_file:
+                json.dump({"files": self.entries}, a_file)
+            self.dirty = False
+        except OSError as err:
+            echo(f"Couldn't write {self.path}: {str(err)}", level=LOG_DEBUG)
+
+
+def get_transfer_manifest(ctx=None):
+    """ Get the executable checksum manifest kept in the config directory.
+    Set PALS_TRANSFER_MANIFEST=0 to only keep checksums in memory. """
+    ctx = ctx or click.get_current_context()
+    config_dir = ctx.obj.get("config_dir")
+    if not config_dir or os.environ.get("PALS_TRANSFER_MANIFEST") == "0":
+        return TransferManifest()
+    return TransferManifest(
+        os.path.join(config_dir, CACHE_DIR_NAME, TRANSFER_MANIFEST)
+    )
+
+
+class TransferProgress(object):  # pylint: disable=too-few-public-methods
+    """ Track and report bytes sent by executable transfers. The transfer
+    threads share one of these, so the count is kept behind a lock. """
+
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.reported = 0
+        self.lock = threading.Lock()
+
+    def update(self, nbytes):
+        """ Add sent bytes, reporting every 10% """
+        with self.lock:
+            self.sent += nbytes
+            percent = self.sent * 100 // self.total if self.total else 100
+            if percent < self.reported + 10 and self.sent < self.total:
+                return
+            self.reported = percent - percent % 10
+            echo(
+                f"Transferred {self.sent / (1 << 20):.1f} of "
+                f"{self.total / (1 << 20):.1f} MiB ({percent:d}%)",
+                level=LOG_INFO
+            )
+
+
+class TransferReader(object):
+    """ Stream a file being uploaded in large chunks, reporting progress """
+
+    def __init__(self, a_file, size, progress=None):
+        self.file = a_file
+        self.size = size
+        self.progress = progress
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        """ Read the next chunk of the file """
+        if size is not None and size >= 0:
+            size = max(size, TRANSFER_CHUNK_SIZE)
+        data = self.file.read(size)
+        if self.progress:
+            self.progress.update(len(data))
+        return data
@@ -92,14 +92,15 @@ def hostname_to_name(hostname=None, ctx=None):
 
 
 @contextmanager
-def open_atomic(path, perms=0o600):
+def open_atomic(path, perms=0o600, mode='w'):
     """ Open a file to be written atomically """
     # Create a temporary file in the same directory, since we can't rename
     # across filesystems
     tmpfd, tmpfname = tempfile.mkstemp(dir=os.path.dirname(path))
     os.close(tmpfd)
 
-    with open(tmpfname, 'w', encoding='utf-8') as tmpfp:
+    encoding = None if 'b' in mode else 'utf-8'
+    with open(tmpfname, mode, encoding=encoding) as tmpfp:
         try:
             yield tmpfp
         finally: